@@ -0,0 +1,136 @@
+from fastapi import APIRouter, Depends
+
+from depenedencies.auth import check_is_manager
+from depenedencies.pool_metrics import sync_pool_metrics, async_pool_metrics
+from depenedencies.rate_limiter import rate_limiter_stats
+from services.todos import todo_events
+from services.mailer import mailer
+from services.outbox import outbox
+from services.passwords import password_hasher
+from services.revocation import revoked_tokens
+from services.tombstones import tombstone_purger
+from services.users import principal_cache
+from schemas.user import User
+
+
+router = APIRouter()
+
+
+@router.get("/db-pool")
+async def db_pool_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The db_pool_stats function returns the connection pool statistics of this worker:
+        connections checked out, overflow, checkout wait time histogram and checkout timeouts,
+        for the sync and the async engine.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary with the statistics of both pools
+    :doc-author: Trelent
+    """
+    return {"sync": sync_pool_metrics.snapshot(), "async": async_pool_metrics.snapshot()}
+
+
+@router.get("/todo-events")
+async def todo_event_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The todo_event_stats function returns the counters of the todo event hub of this worker:
+        connected subscribers, events published and slow subscribers dropped.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters
+    :doc-author: Trelent
+    """
+    return todo_events.stats()
+
+
+@router.get("/principal-cache")
+async def principal_cache_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The principal_cache_stats function returns the hit, miss and eviction counters of the principal cache of this worker.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of cache counters, or {"backend": "none"} if the cache is disabled
+    :doc-author: Trelent
+    """
+    if principal_cache is None:
+        return {"backend": "none"}
+    return principal_cache.stats()
+
+
+@router.get("/token-revocation")
+async def token_revocation_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The token_revocation_stats function returns the counters of the revoked token list of this worker:
+        tokens checked, store lookups the Bloom filter could not spare, false positives and rebuilds.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters
+    :doc-author: Trelent
+    """
+    return revoked_tokens.stats()
+
+
+@router.get("/password-hasher")
+async def password_hasher_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The password_hasher_stats function returns the counters of the password hashing pool of this worker:
+        hashes pending and completed, logins refused because the queue was full, legacy hashes upgraded
+        and the time hashes waited for a thread.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters
+    :doc-author: Trelent
+    """
+    return password_hasher.stats()
+
+
+@router.get("/rate-limits")
+async def rate_limit_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The rate_limit_stats function returns the counters of the rate limiters of this worker, by limit:
+        requests refused, and for Redis the checks that fell back to the local limiter.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters by limit
+    :doc-author: Trelent
+    """
+    return rate_limiter_stats()
+
+
+@router.get("/mailer")
+async def mailer_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The mailer_stats function returns the counters of the mailer of this worker: messages queued, sent,
+        retried and given up, open SMTP sessions and the time from queueing to delivery.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters
+    :doc-author: Trelent
+    """
+    return mailer.stats()
+
+
+@router.get("/outbox")
+async def outbox_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The outbox_stats function returns the counters of the outbox worker of this process:
+        rows claimed, delivered, rescheduled for a retry and given up.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters
+    :doc-author: Trelent
+    """
+    return outbox.stats()
+
+
+@router.get("/todo-tombstones")
+async def todo_tombstone_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The todo_tombstone_stats function returns the counters of the tombstone purger of this process:
+        runs, deleted todos purged so far and the retention they are kept for.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of counters
+    :doc-author: Trelent
+    """
+    return tombstone_purger.stats()
@@ -0,0 +1,61 @@
+from typing import Any
+
+from fastapi import Header
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from services.serialization import dumps_json, dumps_msgpack, prefers_msgpack, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPES
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        """
+        The render function encodes content that is already made of plain dicts, lists, dates and scalars.
+            A route that returns this response directly is not validated against its response model again,
+            so it is meant for rows that come straight from the database in the shape of the schema.
+        
+        :param self: Represent the instance of the class
+        :param content: Any: The content of the response
+        :return: The encoded body
+        :doc-author: Trelent
+        """
+        return dumps_json(content)
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPES[0]
+
+    def render(self, content: Any) -> bytes:
+        """
+        The render function encodes the content as MessagePack, with the same rules as FastJSONResponse.
+        
+        :param self: Represent the instance of the class
+        :param content: Any: The content of the response
+        :return: The encoded body
+        :doc-author: Trelent
+        """
+        return dumps_msgpack(content)
+
+
+class NegotiatedResponse():
+    def __init__(self, accept: str | None = Header(None)) -> None:
+        """
+        The __init__ function picks the response class from the Accept header of the request.
+            Use the class as a dependency and call the instance with the content to build the response:
+            MessagePack for clients that ask for it, JSON for everyone else.
+        
+        :param self: Represent the instance of the class
+        :param accept: str | None: The Accept header of the request
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.use_msgpack = prefers_msgpack(accept)
+        self.response_class = MsgPackResponse if self.use_msgpack else FastJSONResponse
+        self.media_type = MSGPACK_MEDIA_TYPES[0] if self.use_msgpack else JSON_MEDIA_TYPE
+
+    def __call__(self, content: Any, status_code: int = 200, headers: dict | None = None) -> Response:
+        if isinstance(content, BaseModel):
+            content = content.dict()
+        headers = dict(headers or {})
+        headers["Vary"] = "Accept"
+        return self.response_class(content, status_code=status_code, headers=headers)
@@ -1,47 +1,255 @@
-from fastapi import APIRouter, Depends
-from schemas.todo import Todo, TodoCreate, TodoUpdate
-from depenedencies.database import get_db, SessionLocal
-from services.todos import TodoService
+import asyncio
+
+from fastapi import APIRouter, Body, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from datetime import date
+from schemas.todo import Todo, TodoChanges, TodoCreate, TodoUpdate, TodoPage, TodoFilter, TodoSort, ExportFormat, TodoBulkResult, TodoBulkUpdate, TodoBulkUpdateResult
+from sqlalchemy.ext.asyncio import AsyncSession
+from depenedencies.database import get_db, get_async_db, SessionLocal
+from services.todos import TodoService, AsyncTodoService, EXPORT_COLUMNS, EXPORT_MEDIA_TYPES, LIST_FIELDS, MAX_BULK_SIZE, todo_events
+from services.events import encode_sse
+from services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.etag import etag_matches
+from api.responses import NegotiatedResponse
 from schemas.user import User
 
 from depenedencies.auth import check_is_manager, check_is_admin, check_is_default_user
 
 router = APIRouter()
 
+# a comment line every so often keeps proxies from closing an idle event stream
+SSE_HEARTBEAT_SECONDS = 15
+
 
 @router.get("/")
-async def list_todos(user: User = Depends(check_is_default_user), db: SessionLocal = Depends(get_db)) -> list[Todo]:
+async def list_todos(after: str | None = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     is_done: bool | None = None, email: str | None = None, email_prefix: str | None = None,
+                     birthday_from: date | None = None, birthday_to: date | None = None, sort: TodoSort = TodoSort.ID,
+                     fields: str | None = None, if_none_match: str | None = Header(None), respond: NegotiatedResponse = Depends(),
+                     user: User = Depends(check_is_default_user), db: AsyncSession = Depends(get_async_db)) -> TodoPage:
+    """
+    The list_todos function returns one page of todo items from the database.
+        The items can be filtered by is_done, email (exact or prefix) and a birthday range,
+        and ordered by id, birthday or email; prefix the sort with - for descending order.
+        Pass the next_cursor of a page as the after parameter to get the following page.
+        The response carries an ETag; send it back in If-None-Match to get 304 Not Modified while the page is unchanged.
+        The page is read as plain rows and encoded directly, without going through the TodoPage model,
+        as MessagePack for clients that send Accept: application/msgpack and as JSON otherwise.
+        Pass fields, e.g. fields=id,name,is_done, to read and return only those fields;
+        by default every field but description is returned.
+    
+    :param after: str | None: Opaque cursor of the previous page
+    :param limit: int: Number of items per page
+    :param is_done: bool | None: Only return done or not done items
+    :param email: str | None: Only return items with this email
+    :param email_prefix: str | None: Only return items whose email starts with this prefix
+    :param birthday_from: date | None: Only return items with a birthday on or after this date
+    :param birthday_to: date | None: Only return items with a birthday on or before this date
+    :param sort: TodoSort: Order of the items
+    :param fields: str | None: Comma separated fields of the items
+    :param if_none_match: str | None: ETag of the page the client already has
+    :param respond: NegotiatedResponse: Encode the page in the format the client accepts
+    :param user: User: Pass the user object to the function
+    :param db: AsyncSession: Pass the asynchronous database session to the todoservice
+    :return: A page of todo objects with the cursor of the next page
+    :doc-author: Trelent
+    """
+    todo_filter = TodoFilter(is_done=is_done, email=email, email_prefix=email_prefix,
+                             birthday_from=birthday_from, birthday_to=birthday_to)
+    fields = TodoService.parse_fields(fields, default=LIST_FIELDS)
+    todo_service = AsyncTodoService(db=db)
+    etag = await todo_service.get_list_etag(after=after, limit=limit, todo_filter=todo_filter, sort=sort, fields=fields,
+                                            media_type=respond.media_type)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    todo_page = await todo_service.get_page_rows(after=after, limit=limit, todo_filter=todo_filter, sort=sort, fields=fields)
+    return respond(todo_page, headers={"ETag": etag})
+
+
+@router.get("/export")
+async def export_todos(format: ExportFormat | None = None, since_id: int | None = None, fields: str | None = None,
+                       respond: NegotiatedResponse = Depends(),
+                       user: User = Depends(check_is_default_user)) -> StreamingResponse:
+    """
+    The export_todos function streams the whole todos table as ndjson, csv or a stream of MessagePack maps.
+        Without a format, clients that send Accept: application/msgpack get MessagePack and everyone else ndjson.
+        The export opens its own session, because the one from get_db is closed before
+        a streaming body has been sent.
+    
+    :param format: ExportFormat | None: Encode the rows as ndjson, csv or msgpack
+    :param since_id: int | None: Resume an interrupted export after this id
+    :param fields: str | None: Comma separated columns to export, all of them by default
+    :param respond: NegotiatedResponse: Pick the default format from the Accept header
+    :param user: User: Check that the user is allowed to read todos
+    :return: A streaming response with the exported rows
+    :doc-author: Trelent
+    """
+    if format is None:
+        format = ExportFormat.MSGPACK if respond.use_msgpack else ExportFormat.NDJSON
+    TodoService.check_export_format(format)
+    fields = TodoService.parse_fields(fields, default=EXPORT_COLUMNS)
+
+    def stream():
+        db = SessionLocal()
+        try:
+            yield from TodoService(db=db).export(format, since_id=since_id, fields=fields)
+        finally:
+            db.close()
+
+    return StreamingResponse(stream(), media_type=EXPORT_MEDIA_TYPES[format])
+
+
+@router.get("/search")
+def search_todos(q: str = Query(..., min_length=1, max_length=200), after: str | None = None,
+                 limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: str | None = None,
+                 respond: NegotiatedResponse = Depends(),
+                 user: User = Depends(check_is_default_user), db: SessionLocal = Depends(get_db)) -> TodoPage:
+    """
+    The search_todos function runs a full-text search over the name, surname and description of the todo items.
+        Results are ranked by relevance and paged with the same cursor as list_todos.
+        fields works as in list_todos.
+    
+    :param q: str: The words to search for
+    :param after: str | None: Opaque cursor of the previous page
+    :param limit: int: Number of items per page
+    :param fields: str | None: Comma separated fields of the items
+    :param respond: NegotiatedResponse: Encode the page as JSON or MessagePack
+    :param user: User: Pass the user object to the function
+    :param db: SessionLocal: Get the database session
+    :return: A page of todo objects with the cursor of the next page
+    :doc-author: Trelent
+    """
+    fields = TodoService.parse_fields(fields, default=LIST_FIELDS)
+    todo_page = TodoService(db=db).search(q, after=after, limit=limit, fields=fields)
+    return respond(todo_page)
+
+
+@router.get("/changes")
+def todo_changes(since: str | None = None, limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                 respond: NegotiatedResponse = Depends(),
+                 user: User = Depends(check_is_default_user), db: SessionLocal = Depends(get_db)) -> TodoChanges:
+    """
+    The todo_changes function returns the todo items created, modified or deleted since a sync token,
+        so offline clients can stay in sync without downloading the whole list again.
+        Call it without since for the first sync, then pass the next_token of the previous answer;
+        while has_more is true there are more changes to fetch right away.
+        Changes show up settings.sync_settle_seconds after their write, once it has surely committed.
+        A token that was not used for settings.sync_tombstone_retention_days is refused with 410:
+        the deletions it would need may be gone, so the client has to sync from scratch.
+    
+    :param since: str | None: The next_token of the previous answer
+    :param limit: int: Maximum number of changes per answer
+    :param respond: NegotiatedResponse: Encode the changes as JSON or MessagePack
+    :param user: User: Pass the user object to the function
+    :param db: SessionLocal: Get the database session
+    :return: The changed items, the ids of the deleted items and the next sync token
+    :doc-author: Trelent
+    """
+    todo_changes = TodoService(db=db).get_changes(since, limit=limit)
+    return respond(todo_changes)
+
+
+@router.get("/events")
+async def todo_event_stream(request: Request, last_event_id: str | None = Header(None),
+                            user: User = Depends(check_is_default_user)) -> StreamingResponse:
+    """
+    The todo_event_stream function streams todo created, updated and deleted events as Server-Sent Events,
+        so dashboards do not have to poll the list. Every event has an id; a client that reconnects with
+        Last-Event-ID (EventSource does it by itself) gets the events it missed, or a reset event if they are
+        too old, after which it should catch up with GET /todo/changes. A client that falls too far behind
+        gets an overflow event and is disconnected.
+    
+    :param request: Request: Notice when the client goes away
+    :param last_event_id: str | None: Id of the last event the client received
+    :param user: User: Check that the user is allowed to read todos
+    :return: A streaming response of text/event-stream
+    :doc-author: Trelent
     """
-    The list_todos function returns a list of all todo items in the database.
-        
+    subscription = todo_events.subscribe(last_event_id)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                yield encode_sse(event)
+        finally:
+            todo_events.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/birthdays/upcoming")
+def upcoming_birthdays(days: int = Query(7, ge=0, le=366), limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       fields: str | None = None, respond: NegotiatedResponse = Depends(),
+                       user: User = Depends(check_is_default_user), db: SessionLocal = Depends(get_db)) -> list[Todo]:
+    """
+    The upcoming_birthdays function returns the todo items with a birthday in the next days days,
+        ordered by the date of the birthday. The window wraps around the end of the year.
+        fields works as in list_todos.
     
+    :param days: int: Length of the window in days, 0 means only today
+    :param limit: int: Maximum number of items to return
+    :param fields: str | None: Comma separated fields of the items
+    :param respond: NegotiatedResponse: Encode the items as JSON or MessagePack
     :param user: User: Pass the user object to the function
-    :param db: SessionLocal: Pass the database session to the todoservice
+    :param db: SessionLocal: Get the database session
     :return: A list of todo objects
     :doc-author: Trelent
     """
-    todo_items = TodoService(db=db).get_all_todos()
-    return todo_items
+    fields = TodoService.parse_fields(fields, default=LIST_FIELDS)
+    todo_items = TodoService(db=db).get_upcoming_birthdays(days, limit=limit, fields=fields)
+    return respond(todo_items)
+
+
+@router.get("/cache/stats")
+async def todo_cache_stats(manager: User = Depends(check_is_manager)) -> dict:
+    """
+    The todo_cache_stats function returns the hit, miss and eviction counters of the todo cache of this worker.
+    
+    :param manager: User: Check if the user is a manager or an admin
+    :return: A dictionary of cache counters
+    :doc-author: Trelent
+    """
+    return TodoService(db=None).cache_stats()
 
 
 @router.get("/{id}")
-async def get_detail(id: int, user: User = Depends(check_is_default_user), db: SessionLocal = Depends(get_db)) -> Todo:
+async def get_detail(id: int, fields: str | None = None, if_none_match: str | None = Header(None), respond: NegotiatedResponse = Depends(),
+                     user: User = Depends(check_is_default_user), db: AsyncSession = Depends(get_async_db)) -> Todo:
     """
     The get_detail function returns a single Todo item by id.
-        
+        The response carries an ETag; send it back in If-None-Match to get 304 Not Modified while the item is unchanged.
+        Pass fields to return only some of the fields. The item itself is read whole, so it can be served from the cache.
     
     :param id: int: Specify the id of the todo item that we want to get
+    :param fields: str | None: Comma separated fields to return, all of them by default
+    :param if_none_match: str | None: ETag of the item the client already has
+    :param respond: NegotiatedResponse: Encode the item as JSON or MessagePack
     :param user: User: Get the user from the request
-    :param db: SessionLocal: Get the database session
+    :param db: AsyncSession: Get the asynchronous database session
     :return: A todo object
     :doc-author: Trelent
     """
-    todo_item = TodoService(db=db).get_by_id(id)
-    return todo_item
+    fields = TodoService.parse_fields(fields)
+    todo_item = await AsyncTodoService(db=db).get_by_id(id)
+    etag = TodoService.get_etag(todo_item, fields, respond.media_type)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    return respond(todo_item.dict(include=set(fields)), headers={"ETag": etag})
 
 
 @router.post("/")
-async def create_todo( todo_item: TodoCreate, admin: User = Depends(check_is_admin), db: SessionLocal = Depends(get_db)) -> Todo:
+def create_todo( todo_item: TodoCreate, admin: User = Depends(check_is_admin), db: SessionLocal = Depends(get_db)) -> Todo:
     """
     The create_todo function creates a new todo item.
         The function takes in the following parameters:
@@ -59,23 +267,60 @@ async def create_todo( todo_item: TodoCreate, admin: User = Depends(check_is_adm
     return new_item
 
 
+@router.post("/bulk")
+def create_todos_bulk(todo_items: list[dict] = Body(..., max_length=MAX_BULK_SIZE), admin: User = Depends(check_is_admin),
+                      db: SessionLocal = Depends(get_db)) -> TodoBulkResult:
+    """
+    The create_todos_bulk function creates many todo items in one request.
+        The body is a list of TodoCreate objects. Items are validated one by one, so invalid
+        items are reported in the errors list while the valid ones are still created.
+    
+    :param todo_items: list[dict]: The todo items to create
+    :param admin: User: Check if the user is an admin
+    :param db: SessionLocal: Get the database session
+    :return: The ids of the created items and the per-item validation errors
+    :doc-author: Trelent
+    """
+    result = TodoService(db=db).create_many(todo_items)
+    return result
+
+
 @router.put("/{id}")
-async def update_todo(id: int, todo_item: TodoUpdate, db: SessionLocal = Depends(get_db)) -> Todo:
+def update_todo(id: int, todo_item: TodoUpdate, admin: User = Depends(check_is_admin),
+                db: SessionLocal = Depends(get_db)) -> Todo:
     """
     The update_todo function updates a todo item in the database.
         The function takes an id and a TodoUpdate object as input, and returns the updated Todo object.
     
     :param id: int: Specify the id of the todo item that is being updated
     :param todo_item: TodoUpdate: Get the updated todo item from the request body
+    :param admin: User: Check if the user is an admin
     :param db: SessionLocal: Pass the database session to the todoservice class
     :return: A todo object
     :doc-author: Trelent
     """
-    updated_item = TodoService(db=db).update(todo_item)
+    updated_item = TodoService(db=db).update(id, todo_item)
     return updated_item
 
+
+@router.patch("/")
+def update_todos_bulk(bulk_update: TodoBulkUpdate, admin: User = Depends(check_is_admin),
+                      db: SessionLocal = Depends(get_db)) -> TodoBulkUpdateResult:
+    """
+    The update_todos_bulk function applies one patch to many todo items at once,
+        for example {&quot;ids&quot;: [1, 2, 3], &quot;patch&quot;: {&quot;is_done&quot;: true}}.
+    
+    :param bulk_update: TodoBulkUpdate: The ids of the items and the fields to change
+    :param admin: User: Check if the user is an admin
+    :param db: SessionLocal: Get the database session
+    :return: The ids of the updated items
+    :doc-author: Trelent
+    """
+    result = TodoService(db=db).update_many(bulk_update)
+    return result
+
 @router.delete("/")
-async def remove_todo(id: int, db: SessionLocal = Depends(get_db)):
+def remove_todo(id: int, admin: User = Depends(check_is_admin), db: SessionLocal = Depends(get_db)) -> Todo:
     """
     The remove_todo function removes a todo item from the database.
         Args:
@@ -85,9 +330,10 @@ async def remove_todo(id: int, db: SessionLocal = Depends(get_db)):
             TodoItem: The deleted TodoItem object.
     
     :param id: int: Specify that the id parameter is an integer
+    :param admin: User: Check if the user is an admin
     :param db: SessionLocal: Pass the database session to the todoservice class
     :return: A todo object
     :doc-author: Trelent
     """
-    todo_item = TodoService(db=db).remove(todo_item)
+    todo_item = TodoService(db=db).remove(id)
     return todo_item
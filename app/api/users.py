@@ -1,40 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Security, BackgroundTasks, Request, File, UploadFile
-from depenedencies.database import get_db, SessionLocal
-from depenedencies.auth import Token, create_access_token, get_current_user
-from schemas.user import User, UserConfirmed
-from services.users import UserService
-from services.email import send_email
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from depenedencies.database import get_db, get_async_db, SessionLocal
+from depenedencies.auth import Token, create_access_token, get_current_user, get_current_user_uncached, check_is_admin, \
+    oauth2_scheme, revoke_access_token
+from schemas.user import User, UserConfirmed, UserRole
+from services.users import UserService, AsyncUserService
 from fastapi.security import OAuth2PasswordRequestForm
 
-from depenedencies.rate_limiter import RateLimiter
+from depenedencies.rate_limiter import RateLimit
 from depenedencies.cloudinary_client import get_uploader
+from api.responses import NegotiatedResponse
 
 
 router = APIRouter()
 
-rate_limiter = RateLimiter(3, 120)
-
-async def rate_limit(request: Request):
-    """
-    The rate_limit function is a middleware function that will be called before every request.
-    It checks if the client has exceeded their rate limit, and if so, raises an HTTPException with status code 429 (Too Many Requests).
-    If the client hasn't exceeded their rate limit, it returns True to indicate that the request should proceed as normal.
-    
-    :param request: Request: Get the client id from the request object
-    :return: True if the client is allowed to make a request, and raises an exception otherwise
-    :doc-author: Trelent
-    """
-    global rate_limiter
-    client_id = request.client.host
-    if not rate_limiter.is_allowed(client_id):
-        raise HTTPException(status_code=429, detail="Too Many Requests")
-    return True
+rate_limit = RateLimit(3, 120)
 
 
-
-
-@router.post("/register", response_model=User)
-async def register(user: User, db: SessionLocal = Depends(get_db)):
+@router.post("/register", response_model=User, dependencies=[Depends(rate_limit)])
+def register(user: User, db: SessionLocal = Depends(get_db)):
     """
     The register function creates a new user in the database.
     
@@ -46,38 +31,56 @@ async def register(user: User, db: SessionLocal = Depends(get_db)):
     user_service = UserService(db=db)
     return user_service.create_new(user)
 
-@router.post("/token", response_model=dict)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: SessionLocal = Depends(get_db)):
+@router.post("/token", response_model=dict, dependencies=[Depends(RateLimit(10, 60))])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """
     The login_for_access_token function is used to obtain an access token for a user.
         The function takes in the username and password of the user, and returns an access token if successful.
+        The password is checked on the hashing pool, so slow hashes do not hold up the event loop.
     
     :param form_data: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: SessionLocal: Get the database connection
+    :param db: AsyncSession: Get the asynchronous database connection
     :return: A dictionary with the access token and its type
     :doc-author: Trelent
     """
-    user_service = UserService(db)
-    user = user_service.get_user_for_auth(form_data.username, form_data.password)
-    access_token = create_access_token(username = user.username, role=user.role)
+    user_service = AsyncUserService(db)
+    user = await user_service.get_user_for_auth(form_data.username, form_data.password)
+    access_token = create_access_token(username = user.username, role=user.role, confirmed=user.confirmed,
+                                       version=user.token_version)
     return {"access_token": access_token, "token_type": "bearer"}
 
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme)):
+    """
+    The logout function revokes the access token the request was made with.
+        The token is refused by every route from then on, until it would have expired anyway.
+    
+    :param token: str: Get the token from the request header
+    :return: A confirmation message
+    :doc-author: Trelent
+    """
+    if not await revoke_access_token(token):
+        raise HTTPException(status_code=401, detail="Could not validate credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return {"message": "Logged out"}
+
 @router.get("/protected-resource/", response_model=User)
-async def protected_resource(current_user: User = Depends(get_current_user)):
+async def protected_resource(current_user: User = Depends(get_current_user), respond: NegotiatedResponse = Depends()):
     """
     The protected_resource function is a protected resource that requires authentication.
-    It returns the current user's details.
+    It returns the current user's details, as JSON or as MessagePack if the client asks for it.
     
     :param current_user: User: Get the user object from the database
+    :param respond: NegotiatedResponse: Encode the user in the format the client accepts
     :return: The current user
     :doc-author: Trelent
     """
-    return current_user
+    return respond(current_user)
 
 
 
-@router.post('/confirmed/', response_model=User)
-async def confirmed(data: UserConfirmed, db: SessionLocal = Depends(get_db)):
+@router.post('/confirmed/', response_model=User, dependencies=[Depends(RateLimit(5, 300))])
+def confirmed(data: UserConfirmed, db: SessionLocal = Depends(get_db)):
     """
     The confirmed function is used to confirm a user's email address.
         It takes in the UserConfirmed data model and returns a User object.
@@ -90,8 +93,23 @@ async def confirmed(data: UserConfirmed, db: SessionLocal = Depends(get_db)):
     user_service = UserService(db)
     return user_service.confirmed_user(data)
 
+@router.put("/role", response_model=User)
+def set_role(data: UserRole, admin: User = Depends(check_is_admin), db: SessionLocal = Depends(get_db)):
+    """
+    The set_role function changes the role of a user. The tokens the user was issued before are revoked,
+        so the user has to log in again to use the new role.
+    
+    :param data: UserRole: The email of the user and the new role
+    :param admin: User: Check if the user is an admin
+    :param db: SessionLocal: Pass the database session to the user service
+    :return: The updated user
+    :doc-author: Trelent
+    """
+    user_service = UserService(db)
+    return user_service.set_role(data.email, data.role)
+
 @router.post("/upload_image")
-def upload(current_user: User = Depends(get_current_user), file: UploadFile = File(...),  uploader = Depends(get_uploader), db: SessionLocal = Depends(get_db)):
+def upload(current_user: User = Depends(get_current_user_uncached), file: UploadFile = File(...),  uploader = Depends(get_uploader), db: SessionLocal = Depends(get_db)):
     """
     The upload function is used to upload a file to the cloudinary server.
         The function takes in a file and an uploader object, which is used to 
@@ -0,0 +1,85 @@
+"""
+Throughput of a mix of slow and fast requests served from one event loop,
+with the synchronous session (what the routes used to do) against the async session.
+
+Each slow request runs a query that takes SLOW_QUERY_SECONDS in the database
+(pg_sleep on Postgres, a registered sleep() function on SQLite); fast requests read one todo by id.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import benchmarks  # noqa: F401  configures the settings
+from depenedencies.database import Base, to_async_url
+from models.todo import TodoDB
+from repository.todos import TodoRepo, AsyncTodoRepo
+
+SLOW_QUERY_SECONDS = 0.2
+
+
+def make_engines():
+    url = os.environ.get("BENCH_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    sync_engine = create_engine(url)
+    async_engine = create_async_engine(to_async_url(url))
+    if sync_engine.dialect.name == "sqlite":
+        for target in (sync_engine, async_engine.sync_engine):
+            event.listen(target, "connect", lambda dbapi_connection, record: dbapi_connection.create_function(
+                "pg_sleep", 1, lambda seconds: time.sleep(seconds) or 0))
+    Base.metadata.drop_all(bind=sync_engine)
+    Base.metadata.create_all(bind=sync_engine)
+    with sessionmaker(bind=sync_engine)() as db:
+        db.add_all(TodoDB(id=i, name=f"name {i}", surname="surname", email=f"user{i}@example.com", phone=i,
+                          birthday=date(1990, 1, 1), description="lorem ipsum") for i in range(1, 101))
+        db.commit()
+    return sessionmaker(bind=sync_engine), async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+async def sync_request(session_factory, slow: bool, arrival: float, latencies: list):
+    with session_factory() as db:
+        if slow:
+            db.execute(text(f"SELECT pg_sleep({SLOW_QUERY_SECONDS})"))
+        else:
+            TodoRepo(db).get_by_id(1)
+    if not slow:
+        latencies.append(time.perf_counter() - arrival)
+
+
+async def async_request(session_factory, slow: bool, arrival: float, latencies: list):
+    async with session_factory() as db:
+        if slow:
+            await db.execute(text(f"SELECT pg_sleep({SLOW_QUERY_SECONDS})"))
+        else:
+            await AsyncTodoRepo(db).get_by_id(1)
+    if not slow:
+        latencies.append(time.perf_counter() - arrival)
+
+
+async def run(request, session_factory, slow_count: int, fast_count: int):
+    latencies = []
+    workload = [True] * slow_count + [False] * fast_count
+    start = time.perf_counter()
+    # every request arrives at once; latency is measured from that moment
+    await asyncio.gather(*[request(session_factory, slow, start, latencies) for slow in workload])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{request.__name__:<15} {elapsed:8.2f} s  {len(workload) / elapsed:8.1f} req/s  "
+          f"fast p50 {statistics.median(latencies) * 1000:8.1f} ms  "
+          f"fast p95 {latencies[int(len(latencies) * 0.95)] * 1000:8.1f} ms")
+
+
+def main(slow_count: int = 20, fast_count: int = 200):
+    sync_factory, async_factory = make_engines()
+    asyncio.run(run(sync_request, sync_factory, slow_count, fast_count))
+    asyncio.run(run(async_request, async_factory, slow_count, fast_count))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
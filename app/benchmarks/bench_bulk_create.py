@@ -0,0 +1,39 @@
+"""
+N calls to TodoService.create_new against one TodoService.create_many call.
+"""
+import sys
+from datetime import date
+
+from benchmarks import make_session_factory, timed
+from services.todos import TodoService
+from schemas.todo import TodoCreate
+
+
+def make_items(count: int, first_id: int) -> list[dict]:
+    return [
+        {"id": first_id + i, "name": f"name {i}", "surname": "surname", "email": f"user{i}@example.com",
+         "phone": 380000000 + i, "birthday": date(1990, 1, 1 + i % 28), "description": "lorem ipsum"}
+        for i in range(count)
+    ]
+
+
+def main(count: int = 5000):
+    session_factory = make_session_factory()
+
+    with session_factory() as db:
+        items = [TodoCreate(**item) for item in make_items(count, first_id=1)]
+        service = TodoService(db)
+        with timed(f"create_new x {count}", count):
+            for item in items:
+                service.create_new(item)
+
+    with session_factory() as db:
+        items = make_items(count, first_id=count + 1)
+        service = TodoService(db)
+        with timed(f"create_many({count})", count):
+            result = service.create_many(items)
+        assert len(result.created_ids) == count
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,61 @@
+"""
+Payload size and encode/decode time of todo data as JSON and as MessagePack.
+
+``page`` is one list page of MAX_PAGE_SIZE todos encoded as a whole, the way list_todos answers.
+``export`` is every row of the table encoded one record at a time, the way the export streams it.
+"""
+import json
+import sys
+import time
+from datetime import date, datetime
+
+import msgpack
+
+import benchmarks  # noqa: F401  configures the settings
+from services.pagination import MAX_PAGE_SIZE
+from services.serialization import dumps_json, dumps_msgpack, encode_default
+
+
+def make_rows(count: int) -> list[dict]:
+    return [dict(id=i, name=f"name {i}", surname="surname", email=f"user{i}@example.com", phone=380_000_000_000 + i,
+                 birthday=date(1990, 1 + i % 12, 1 + i % 28), is_done=bool(i % 2), description="lorem ipsum " * 4,
+                 updated_at=datetime(2024, 1, 1, 12, 0, i % 60, i))
+            for i in range(1, count + 1)]
+
+
+def stdlib_json(content) -> bytes:
+    return json.dumps(content, default=encode_default).encode("utf-8")
+
+
+def measure(label: str, encode, decode, payloads: list, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = [encode(payload) for payload in payloads]
+    encode_time = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for body in encoded:
+            decode(body)
+    decode_time = (time.perf_counter() - start) / repeat
+    size = sum(len(body) for body in encoded)
+    print(f"{label:<28} {size / 1024:10.1f} KiB  encode {encode_time * 1000:8.2f} ms  decode {decode_time * 1000:8.2f} ms")
+
+
+def main(rows: int = 100_000):
+    codecs = (
+        ("json (stdlib)", stdlib_json, json.loads),
+        ("json (FastJSONResponse)", dumps_json, json.loads),
+        ("msgpack", dumps_msgpack, msgpack.unpackb),
+    )
+    page = {"items": make_rows(MAX_PAGE_SIZE), "next_cursor": "eyJzIjoiaWQiLCJpZCI6NTAwfQ"}
+    print(f"page of {MAX_PAGE_SIZE} todos")
+    for label, encode, decode in codecs:
+        measure(label, encode, decode, [page], repeat=20)
+    print(f"export of {rows} todos")
+    export_rows = make_rows(rows)
+    for label, encode, decode in codecs:
+        measure(label, encode, decode, export_rows, repeat=1)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
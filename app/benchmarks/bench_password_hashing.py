@@ -0,0 +1,60 @@
+"""
+Logins per second of the password hasher at several pool sizes, and how long the event loop stalls meanwhile.
+
+Every login checks one scrypt hash with the production parameters. ``inline`` runs the check in the
+event loop itself, the way a KDF called straight from an ``async def`` handler would.
+``loop lag`` is the worst delay of a 5 ms ticker running next to the logins.
+"""
+import asyncio
+import os
+import sys
+import time
+
+import benchmarks  # noqa: F401  configures the settings
+from services.passwords import PasswordHasher
+
+CONCURRENT_LOGINS = 64
+
+
+async def watch_loop(stop: asyncio.Event) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        worst = max(worst, time.perf_counter() - start - 0.005)
+    return worst
+
+
+async def run(label: str, verify, logins: int, cpus: int) -> None:
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stop))
+    semaphore = asyncio.Semaphore(CONCURRENT_LOGINS)
+
+    async def login():
+        async with semaphore:
+            assert await verify()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lag = await watcher
+    print(f"{label:<20} {logins / elapsed:10.1f} logins/s  loop lag {lag * 1000:8.1f} ms  ({cpus} cpus)")
+
+
+def main(logins: int = 200):
+    cpus = os.cpu_count() or 1
+    stored = PasswordHasher(workers=1).hash("password")
+
+    async def inline():
+        return PasswordHasher._check("password", stored)
+
+    asyncio.run(run("inline", inline, logins, cpus))
+    for workers in (1, 2, 4, 8):
+        hasher = PasswordHasher(workers=workers, max_pending=logins)
+        asyncio.run(run(f"pool of {workers}", lambda: hasher.averify("password", stored), logins, cpus))
+        hasher.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
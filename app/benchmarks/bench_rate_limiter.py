@@ -0,0 +1,33 @@
+"""
+Memory and speed of RateLimiter while a million distinct clients each make one request, the way an address scan
+hits a public endpoint. The tracked clients, and with them the memory, stop growing at max_clients.
+"""
+import sys
+import time
+import tracemalloc
+
+from depenedencies.rate_limiter import RateLimiter
+
+
+def main(clients: int = 1_000_000, max_clients: int = 100_000):
+    limiter = RateLimiter(3, 120, max_clients=max_clients)
+    tracemalloc.start()
+    start = time.perf_counter()
+    checkpoint = start
+    for i in range(1, clients + 1):
+        limiter.is_allowed(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{i >> 24}")
+        if i % (clients // 10) == 0:
+            now = time.perf_counter()
+            current, _ = tracemalloc.get_traced_memory()
+            stats = limiter.stats()
+            print(f"{i:>9} clients seen  {stats['clients']:>7} tracked  {current / 2 ** 20:7.1f} MiB  "
+                  f"{clients // 10 / (now - checkpoint):10.0f} checks/s")
+            checkpoint = now
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"peak {peak / 2 ** 20:.1f} MiB, {limiter.stats()['evictions']} evictions, "
+          f"{clients / (time.perf_counter() - start):.0f} checks/s overall (under tracemalloc)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
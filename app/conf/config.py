@@ -10,8 +10,36 @@ class Settings(BaseSettings):
     mail_from: str
     mail_port: int
     mail_server: str
+    mail_ssl_tls: bool = True
+    mail_connections: int = 2
     redis_host: str = 'localhost'
     redis_port: int = 6379
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    cache_backend: str = 'memory'
+    cache_max_size: int = 10000
+    cache_ttl: int = 60
+    sync_settle_seconds: int = 5
+    sync_tombstone_retention_days: int = 30
+    principal_cache_enabled: bool = True
+    principal_cache_max_size: int = 10000
+    principal_cache_ttl: int = 30
+    access_token_ttl_minutes: int = 1440
+    auth_stateless_roles: bool = False
+    auth_stateless_max_age_seconds: int = 300
+    token_revocation_backend: str = 'memory'
+    token_revocation_capacity: int = 100000
+    token_revocation_error_rate: float = 0.001
+    token_revocation_rebuild_seconds: int = 30
+    token_revocation_redis_timeout: float = 0.5
+    token_revocation_fail_closed: bool = True
+    password_hash_workers: int = 4
+    password_hash_max_pending: int = 64
+    rate_limit_backend: str = 'memory'
+    rate_limit_redis_timeout: float = 0.1
 
     class Config:
         env_file = ".env"
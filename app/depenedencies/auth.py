@@ -1,12 +1,17 @@
 import datetime
+import time
+import uuid
 import jwt
 
 from fastapi import Depends, HTTPException
 from pydantic import BaseModel
 from fastapi.security import OAuth2PasswordBearer
-from depenedencies.database import get_db, SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from conf.config import settings
+from depenedencies.database import get_async_db
 
-from services.users import UserService
+from services.revocation import revoked_tokens
+from services.users import AsyncUserService, token_versions
 from schemas.user import User, RolesEnum
 
 
@@ -14,6 +19,10 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 secret_key = "secret_key"
 
+# access and email verification tokens share the key; the typ claim keeps one from being accepted as the other
+ACCESS_TOKEN_TYPE = "access"
+EMAIL_TOKEN_TYPE = "email_verify"
+
 
 
 class Token(BaseModel):
@@ -21,23 +30,38 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 
-def create_access_token(username: str, role: str):
+def create_access_token(username: str, role: str, confirmed: bool | None = None, version: int | None = None):
     """
     The create_access_token function creates a JWT token with the following claims:
         - sub (subject): The username of the user who is logging in.
         - role: The role of the user who is logging in.
+        - confirmed: Whether the user has confirmed their email.
+        - ver: The token version of the user; bumping it revokes the token.
+        - iat (issued at): When the token was made.
         - exp (expiration time): A datetime object that indicates when this token will expire.
+        - jti (token id): A random id, by which the token can be revoked.
+        - typ: "access", so the token is not taken for an email verification token.
+    Tokens with confirmed and ver can be authorized from their claims alone, see get_authorized_principal.
     
     :param username: str: Specify the username of the user that is being created
     :param role: str: Define the role of the user
+    :param confirmed: bool | None: Whether the user is confirmed
+    :param version: int | None: The token version of the user
     :return: A token
     :doc-author: Trelent
     """
+    now = datetime.datetime.utcnow()
     token_data = {
         "sub": username,
         "role": role,
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        "iat": now,
+        "exp": now + datetime.timedelta(minutes=settings.access_token_ttl_minutes),
+        "jti": uuid.uuid4().hex,
+        "typ": ACCESS_TOKEN_TYPE,
     }
+    if version is not None:
+        token_data["confirmed"] = bool(confirmed)
+        token_data["ver"] = version
     token = jwt.encode(token_data, secret_key, algorithm="HS256")
 
     return token
@@ -46,40 +70,135 @@ def decode_jwt_token(token):
         """
         The decode_jwt_token function takes in a token and returns the decoded payload.
             If the token is expired, it will return &quot;The token has already expired&quot;.
-            If the signature of the token is invalid, it will return &quot;Invalid Token&quot;.
+            If the signature of the token is invalid, or it is not an access token, it will return &quot;Invalid Token&quot;.
+            If the token was revoked, it will return &quot;The token has been revoked&quot;.
         
         :param token: Pass the token to be decoded
         :return: The decoded payload
         :doc-author: Trelent
         """
+        decoded_payload = _decode_claims(token)
+        if isinstance(decoded_payload, dict) and "jti" in decoded_payload and revoked_tokens.is_revoked(decoded_payload["jti"]):
+            return "The token has been revoked"
+        return decoded_payload
+
+def _decode_claims(token):
         try:
             decoded_payload = jwt.decode(token, secret_key, algorithms=["HS256"])
-            return decoded_payload
         except jwt.ExpiredSignatureError:
             return "The token has already expired"
         except jwt.InvalidTokenError:
             return "Invalid token"
+        if decoded_payload.get("typ") != ACCESS_TOKEN_TYPE:
+            return "Invalid token"
+        return decoded_payload
+
+async def revoke_access_token(token: str) -> bool:
+        """
+        The revoke_access_token function revokes an access token until it expires, e.g. on logout.
+            Like the auth dependencies it checks the token against the Bloom filter first and only
+            reaches the revocation store, off the event loop, when it has to.
+        
+        :param token: str: The access token
+        :return: True if the token was revoked, False if it was not valid or cannot be revoked
+        :doc-author: Trelent
+        """
+        payload = _decode_claims(token)
+        if not isinstance(payload, dict) or "jti" not in payload or await revoked_tokens.ais_revoked(payload["jti"]):
+            return False
+        await revoked_tokens.arevoke(payload["jti"], payload["exp"])
+        return True
 
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: SessionLocal = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
         """
         The get_current_user function is a dependency that will be used in the UserResource class.
         It takes a token as an argument and returns the user object associated with that token.
+        The user is served from the principal cache when possible; routes that must not see
+        a user that is a few seconds old depend on get_current_user_uncached instead.
+        
+        :param token: str: Get the token from the request header
+        :param db: AsyncSession: Get the asynchronous database connection
+        :return: The user object
+        :doc-author: Trelent
+        """
+        return await _resolve_user(token, db, use_cache=True)
+
+async def get_current_user_uncached(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+        """
+        The get_current_user_uncached function is get_current_user without the principal cache:
+            the user is always read from the database. Use it on routes that write the user back.
         
         :param token: str: Get the token from the request header
-        :param db: SessionLocal: Get the database connection
+        :param db: AsyncSession: Get the asynchronous database connection
         :return: The user object
         :doc-author: Trelent
         """
-        token = decode_jwt_token(token)
-        user_service = UserService(db)
-        username = token.get("sub")
-        user = user_service.get_by_username(username)
+        return await _resolve_user(token, db, use_cache=False)
 
+async def _resolve_user(token: str, db: AsyncSession, use_cache: bool) -> User:
+        return await _load_user(await _verified_claims(token), db, use_cache)
+
+async def _load_user(payload: dict, db: AsyncSession, use_cache: bool) -> User:
+        user_service = AsyncUserService(db)
+        user = await user_service.get_principal(payload["sub"], use_cache=use_cache)
+        if "ver" in payload and payload["ver"] != user.token_version:
+            raise _unauthorized()
         return user
 
-async def check_is_admin(user: User = Depends(get_current_user)) -> User:
+async def _verified_claims(token: str) -> dict:
+        # decode_jwt_token without its blocking revocation lookup; ais_revoked asks the store off the event loop
+        payload = _decode_claims(token)
+        if not isinstance(payload, dict) or not payload.get("sub"):
+            raise _unauthorized()
+        if "jti" in payload and await revoked_tokens.ais_revoked(payload["jti"]):
+            raise _unauthorized()
+        return payload
+
+def _unauthorized() -> HTTPException:
+        return HTTPException(status_code=401, detail="Could not validate credentials",
+                             headers={"WWW-Authenticate": "Bearer"})
+
+
+class TokenPrincipal(BaseModel):
+    username: str
+    role: RolesEnum
+    confirmed: bool
+    version: int
+
+
+async def get_authorized_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> User | TokenPrincipal:
+        """
+        The get_authorized_principal function is the dependency of the role checks.
+            With settings.auth_stateless_roles, a token that carries the confirmed and ver claims and was issued
+            less than auth_stateless_max_age_seconds ago is authorized from its claims alone, without loading
+            the user: the signature vouches for them, and a token older than the token version this worker knows
+            for the user is refused. Only this worker knows of a role change it did not make itself, so the claims
+            are trusted for a few minutes, not for the lifetime of the token; older tokens load the user again.
+            Otherwise, and for tokens issued without those claims, it is get_current_user.
+        
+        :param token: str: Get the token from the request header
+        :param db: AsyncSession: Get the asynchronous database connection, only used without the claims
+        :return: The user, or the principal built from the token claims
+        :doc-author: Trelent
+        """
+        if not settings.auth_stateless_roles:
+            return await _resolve_user(token, db, use_cache=True)
+        payload = await _verified_claims(token)
+        issued_at = payload.get("iat")
+        if "ver" not in payload or issued_at is None or time.time() - issued_at > settings.auth_stateless_max_age_seconds:
+            return await _load_user(payload, db, use_cache=True)
+        known_version = token_versions.get(payload["sub"])
+        if known_version is not None and payload["ver"] < known_version:
+            raise _unauthorized()
+        try:
+            return TokenPrincipal(username=payload["sub"], role=payload["role"],
+                                  confirmed=payload.get("confirmed", False), version=payload["ver"])
+        except (KeyError, ValueError):
+            raise _unauthorized()
+
+async def check_is_admin(user: User = Depends(get_authorized_principal)) -> User:
     """
     The check_is_admin function is a dependency that checks if the user has admin privileges.
     If they do, it returns the user object. If not, it raises an HTTPException with status code 403.
@@ -92,7 +211,7 @@ async def check_is_admin(user: User = Depends(get_current_user)) -> User:
         return user
     raise HTTPException(status_code=403)
 
-async def check_is_default_user(user: User = Depends(get_current_user)) -> User:
+async def check_is_default_user(user: User = Depends(get_authorized_principal)) -> User:
     """
     The check_is_default_user function is a dependency that checks if the user has one of the following roles:
         - USER
@@ -108,7 +227,7 @@ async def check_is_default_user(user: User = Depends(get_current_user)) -> User:
         return user
     raise HTTPException(status_code=403)
 
-async def check_is_manager(user: User = Depends(get_current_user)) -> User:
+async def check_is_manager(user: User = Depends(get_authorized_principal)) -> User:
     """
     The check_is_manager function checks if the user is a manager or admin.
         If so, it returns the user object. Otherwise, it raises an HTTPException with status code 403.
@@ -121,45 +240,37 @@ async def check_is_manager(user: User = Depends(get_current_user)) -> User:
         return user
     raise HTTPException(status_code=403)
 
-def create_email_token(self, data: dict):
+def create_email_token(data: dict):
         """
         The create_email_token function takes a dictionary of data and returns a JWT token.
-            The token is encoded with the SECRET_KEY and ALGORITHM defined in the class.
+            The token is signed with the secret key of the access tokens, its typ claim tells them apart.
             The iat (issued at) claim is set to datetime.utcnow() and exp (expiration time) 
             claim is set to 7 days from now.
         
-        :param self: Represent the instance of the class
         :param data: dict: Pass the data to be encoded
         :return: A token
         :doc-author: Trelent
         """
         to_encode = data.copy()
-        expire = datetime.utcnow() + timedelta(days=7)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        expire = datetime.datetime.utcnow() + datetime.timedelta(days=7)
+        to_encode.update({"iat": datetime.datetime.utcnow(), "exp": expire, "typ": EMAIL_TOKEN_TYPE})
+        token = jwt.encode(to_encode, secret_key, algorithm="HS256")
         return token
 
-async def get_email_from_token(self, token: str):
+def get_email_from_token(token: str):
   """
   The get_email_from_token function takes a token as an argument and returns the email address associated with that token.
-  If the token is invalid, it raises an HTTPException.
+  If the token is invalid or not an email verification token, it raises an HTTPException.
   
-  :param self: Represent the instance of the class
   :param token: str: Pass in the token that is sent to the user's email
   :return: The email address that was encoded in the token
   :doc-author: Trelent
   """
   try:
-      payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+      payload = jwt.decode(token, secret_key, algorithms=["HS256"])
+      if payload.get("typ") != EMAIL_TOKEN_TYPE:
+          raise KeyError("typ")
       email = payload["sub"]
       return email
-  except JWTError as e:
-      print(e)
-      raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                          detail="Invalid token for email verification")
-
-class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    SECRET_KEY = settings.secret_key
-    ALGORITHM = settings.algorithm
-
+  except (jwt.InvalidTokenError, KeyError):
+      raise HTTPException(status_code=422, detail="Invalid token for email verification")
@@ -1,11 +1,59 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from conf.config import settings
+from depenedencies.pool_metrics import MeteredQueuePool, MeteredAsyncQueuePool
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(database_url: str):
+    """
+    The to_async_url function swaps the driver of a database url for its asyncio counterpart,
+        e.g. postgresql+psycopg2:// becomes postgresql+asyncpg:// and sqlite:// becomes sqlite+aiosqlite://.
+    
+    :param database_url: str: The synchronous database url
+    :return: The url to pass to create_async_engine
+    :doc-author: Trelent
+    """
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def pool_options(database_url: str, is_async: bool = False) -> dict:
+    """
+    The pool_options function returns the connection pool arguments for create_engine from the settings.
+        SQLite keeps the default pool of its driver, which does not take these arguments.
+    
+    :param database_url: str: The database url
+    :param is_async: bool: Build the options of the async engine
+    :return: Keyword arguments for create_engine or create_async_engine
+    :doc-author: Trelent
+    """
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+
+
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(SQLALCHEMY_DATABASE_URL))
+async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), **pool_options(SQLALCHEMY_DATABASE_URL, is_async=True))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 #Dependency
@@ -21,4 +69,16 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    """
+    The get_async_db function is the asyncio version of get_db.
+        Queries on the session are awaited, so a slow query does not block the event loop.
+    
+    :return: An asynchronous database session
+    :doc-author: Trelent
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,85 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolMetrics():
+    def __init__(self) -> None:
+        """
+        The __init__ function creates empty counters for one connection pool of this worker.
+            wait_histogram[i] counts checkouts that waited at most WAIT_BUCKETS_MS[i] milliseconds,
+            the last slot counts the slower ones.
+        
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.lock = threading.Lock()
+        self.pool = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_wait(self, seconds: float) -> None:
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.wait_histogram[bisect.bisect_left(WAIT_BUCKETS_MS, seconds * 1000)] += 1
+
+    def record_timeout(self) -> None:
+        with self.lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        pool = self.pool
+        with self.lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_histogram)}
+            buckets["le_inf"] = self.wait_histogram[-1]
+            return {
+                "pool": type(pool).__name__ if pool is not None else None,
+                "size": pool.size() if isinstance(pool, QueuePool) else None,
+                "checked_out": pool.checkedout() if isinstance(pool, QueuePool) else None,
+                "checked_in": pool.checkedin() if isinstance(pool, QueuePool) else None,
+                "overflow": pool.overflow() if isinstance(pool, QueuePool) else None,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.timeouts,
+                "wait_avg_ms": self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+                "wait_histogram": buckets,
+            }
+
+
+sync_pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class MeteredPoolMixin():
+    metrics: PoolMetrics
+
+    def connect(self):
+        # pools are re-created on dispose(), the metrics always follow the current one
+        self.metrics.pool = self
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class MeteredQueuePool(MeteredPoolMixin, QueuePool):
+    metrics = sync_pool_metrics
+
+
+class MeteredAsyncQueuePool(MeteredPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
@@ -1,49 +1,237 @@
+import math
+import threading
 import time
+import zlib
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+
+from conf.config import settings
+
+MAX_TRACKED_CLIENTS = 100_000
+SHARD_COUNT = 16
+
 
 class RateLimiter:
-    def __init__(self, max_requests, window_time):
+    def __init__(self, max_requests, window_time, max_clients=MAX_TRACKED_CLIENTS, shards=SHARD_COUNT):
         """
         The __init__ function is called when the class is instantiated.
-        It sets up the instance variables that will be used by other methods in this class.
-        
+        It sets up a token bucket per client: a bucket holds up to max_requests tokens and refills at
+        max_requests per window_time seconds, so a client gets max_requests at once and then a steady
+        rate, without the double burst a fixed window allows at its edges.
+        At most max_clients buckets are kept. The clients are spread over shards, each with its own lock and
+        its buckets in least recently used order, so idle clients (whose bucket is full again anyway) are dropped
+        first and a scan over many addresses cannot grow the memory without bound.
         
         :param self: Represent the instance of the class
         :param max_requests: Set the maximum number of requests that can be made within a given time window
         :param window_time: Determine the time window to check for requests
+        :param max_clients: Maximum number of clients tracked at the same time
+        :param shards: Number of independently locked parts of the client table
         :return: The object itself, not a value
         :doc-author: Trelent
         """
-        self.requests = {}
         self.max_requests = max_requests
         self.window_time = window_time
+        self.refill_rate = max_requests / window_time
+        self.shard_size = max(1, max_clients // shards)
+        self.shards = [OrderedDict() for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.rejected = 0
+        self.evictions = 0
 
-    def is_allowed(self, client_id):
+    def is_allowed(self, client_id, cost=1):
         """
         The is_allowed function takes in a client_id and returns True if the client is allowed to make another request,
-        and False otherwise. The function keeps track of how many requests each client has made within a window of time.
-        If the number of requests exceeds max_requests within that window, then the function will return False for that 
-        client until enough time has passed.
+        and False otherwise. Every request takes cost tokens from the bucket of the client; a request the bucket
+        cannot pay for is refused and takes nothing. The check is O(1).
         
         :param self: Represent the instance of the class
         :param client_id: Identify the client making the request
-        :return: True if the client_id exists in the self
+        :param cost: Number of tokens the request takes
+        :return: True if the client may make the request
+        :doc-author: Trelent
+        """
+        now = time.monotonic()
+        index = zlib.crc32(str(client_id).encode()) % len(self.shards)
+        buckets = self.shards[index]
+        with self.locks[index]:
+            bucket = buckets.pop(client_id, None)
+            if bucket is None:
+                tokens = self.max_requests
+            else:
+                tokens = min(self.max_requests, bucket[0] + (now - bucket[1]) * self.refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            else:
+                self.rejected += 1
+            buckets[client_id] = (tokens, now)
+            self._evict(buckets, now)
+        return allowed
+
+    def _evict(self, buckets, now):
+        # the oldest buckets come first; once a bucket has been idle for a window it is full, the same as no bucket
+        while buckets:
+            oldest_id, (_, updated) = next(iter(buckets.items()))
+            if len(buckets) <= self.shard_size and now - updated < self.window_time:
+                break
+            del buckets[oldest_id]
+            self.evictions += 1
+
+    def stats(self):
+        return {"backend": "memory", "clients": sum(len(buckets) for buckets in self.shards),
+                "max_clients": self.shard_size * len(self.shards), "rejected": self.rejected, "evictions": self.evictions}
+
+
+# One round trip per check: refill, take and store the bucket atomically. The time is Redis' own, so workers
+# with skewed clocks still agree; the bucket expires once it would be full again.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(bucket[2])) * refill_rate)
+end
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill_rate) + 1)
+return allowed
+"""
+
+
+class RedisRateLimiter:
+    def __init__(self, client, max_requests, window_time, fallback=None, errors=(Exception,), prefix="rate:",
+                 retry_after=5):
+        """
+        The __init__ function creates a rate limiter whose token buckets live in Redis, so all workers share
+        the limits. It has the is_allowed interface of RateLimiter.
+        When Redis cannot be reached the checks go to fallback, a local RateLimiter, for retry_after seconds
+        before Redis is tried again; the limits are then enforced per worker instead of not at all.
+        
+        :param self: Represent the instance of the class
+        :param client: A redis.Redis client, or anything with the same register_script method
+        :param max_requests: Set the maximum number of requests that can be made within a given time window
+        :param window_time: Determine the time window to check for requests
+        :param fallback: The limiter used while Redis is unreachable
+        :param errors: The exceptions that mean Redis is unreachable
+        :param prefix: Prefix of every key written to Redis
+        :param retry_after: Number of seconds to use the fallback before trying Redis again
+        :return: The object itself, not a value
         :doc-author: Trelent
         """
-        current_time = time.time()
-        request_info = self.requests.get(client_id)
+        self.max_requests = max_requests
+        self.window_time = window_time
+        self.refill_rate = max_requests / window_time
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.fallback = fallback if fallback is not None else RateLimiter(max_requests, window_time)
+        self.errors = errors
+        self.prefix = prefix
+        self.retry_after = retry_after
+        self.down_until = 0.0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    def is_allowed(self, client_id, cost=1):
+        if time.monotonic() < self.down_until:
+            self.fallbacks += 1
+            return self.fallback.is_allowed(client_id, cost)
+        try:
+            allowed = bool(self.script(keys=[f"{self.prefix}{client_id}"], args=[self.max_requests, self.refill_rate, cost]))
+        except self.errors:
+            self.down_until = time.monotonic() + self.retry_after
+            self.fallbacks += 1
+            return self.fallback.is_allowed(client_id, cost)
+        if not allowed:
+            self.rejected += 1
+        return allowed
 
-        if request_info is None:
-            self.requests[client_id] = [current_time, 1]
-            return True
+    def stats(self):
+        return {"backend": "redis", "rejected": self.rejected, "fallbacks": self.fallbacks,
+                "redis_down": time.monotonic() < self.down_until, "fallback": self.fallback.stats()}
 
-        last_request_time, request_count = request_info
 
-        if current_time - last_request_time > self.window_time:
-            self.requests[client_id] = [current_time, 1]
-            return True
+_limiters = {}
 
-        if request_count < self.max_requests:
-            self.requests[client_id][1] += 1
-            return True
 
-        return False
\ No newline at end of file
+def get_rate_limiter(max_requests, window_time):
+    """
+    The get_rate_limiter function returns the limiter of this worker for a limit of max_requests per window_time seconds,
+        creating it on first use: a RedisRateLimiter on redis_host/redis_port when settings.rate_limit_backend
+        is "redis", a local RateLimiter otherwise. Routes with the same limit share the limiter,
+        their clients are told apart by the key.
+    
+    :param max_requests: Set the maximum number of requests that can be made within a given time window
+    :param window_time: Determine the time window to check for requests
+    :return: A limiter with an is_allowed method
+    :doc-author: Trelent
+    """
+    limiter = _limiters.get((max_requests, window_time))
+    if limiter is None:
+        if settings.rate_limit_backend == "redis":
+            import redis
+
+            client = redis.Redis(host=settings.redis_host, port=settings.redis_port,
+                                 socket_timeout=settings.rate_limit_redis_timeout,
+                                 socket_connect_timeout=settings.rate_limit_redis_timeout)
+            limiter = RedisRateLimiter(client, max_requests, window_time, errors=(redis.RedisError,))
+        else:
+            limiter = RateLimiter(max_requests, window_time)
+        limiter = _limiters.setdefault((max_requests, window_time), limiter)
+    return limiter
+
+
+
+def rate_limiter_stats():
+    return {f"{max_requests}/{window_time}s": limiter.stats() for (max_requests, window_time), limiter in _limiters.items()}
+
+
+class RateLimit:
+    def __init__(self, max_requests, window_time, cost=1, scope=None):
+        """
+        The __init__ function declares the rate limit of a route, to be used as a dependency:
+            @router.post("/token", dependencies=[Depends(RateLimit(10, 60))])
+        Every client gets max_requests per window_time seconds on the route, and a request takes cost of them.
+        Routes with the same scope draw from the same budget; by default every route has its own.
+        
+        :param self: Represent the instance of the class
+        :param max_requests: Set the maximum number of requests that can be made within a given time window
+        :param window_time: Determine the time window to check for requests
+        :param cost: Number of requests one call of the route counts as
+        :param scope: Name of the budget, the path of the route by default
+        :return: The object itself, not a value
+        :doc-author: Trelent
+        """
+        self.max_requests = max_requests
+        self.window_time = window_time
+        self.cost = cost
+        self.scope = scope
+
+    def __call__(self, request: Request):
+        """
+        The __call__ function checks the request against the limit and raises an HTTPException with status code 429
+        (Too Many Requests) if the client has used it up.
+        It is a plain function on purpose: FastAPI runs it in the threadpool, where the Redis round trip cannot stall the event loop.
+        
+        :param self: Represent the instance of the class
+        :param request: Request: Get the client and the route from the request object
+        :return: True if the request may proceed
+        :doc-author: Trelent
+        """
+        route = request.scope.get("route")
+        scope = self.scope or (route.path if route is not None else request.url.path)
+        limiter = get_rate_limiter(self.max_requests, self.window_time)
+        if not limiter.is_allowed(f"{scope}:{request.client.host}", self.cost):
+            raise HTTPException(status_code=429, detail="Too Many Requests",
+                                headers={"Retry-After": str(max(1, math.ceil(self.cost * self.window_time / self.max_requests)))})
+        return True
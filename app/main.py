@@ -1,15 +1,19 @@
-from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, status, Request
-from pathlib import Path
+from fastapi import FastAPI, Depends, HTTPException, status, Request
 import uvicorn
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import EmailStr, BaseModel
 from typing import List
 from api.todo_items import router as todo_router
 from api.users import router as user_router
+from api.internal import router as internal_router
 from models import todo
-from depenedencies.database import engine, get_db, SessionLocal
-from schemas.user import Email
+from depenedencies.database import engine, async_engine, get_db, SessionLocal, AsyncSessionLocal
+from services.todos import todo_events
+from services.mailer import mailer
+from services.outbox import outbox
+from services.email import queue_emails
+from services.revocation import revoked_tokens
+from services.tombstones import tombstone_purger
 
 app = FastAPI()
 
@@ -24,26 +28,83 @@ class EmailSchema(BaseModel):
     email: EmailStr
 
 
-conf = ConnectionConfig(
-    MAIL_USERNAME="andriiok@meta.ua",
-    MAIL_PASSWORD="secretPassword_",
-    MAIL_FROM="andriiok@meta.ua",
-    MAIL_PORT=465,
-    MAIL_SERVER="smtp.meta.ua",
-    MAIL_FROM_NAME="Andriiok email",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
-
 todo.Base.metadata.create_all(bind=engine)
 
 
 
 app.include_router(todo_router, prefix="/todo")
 app.include_router(user_router, prefix="/users")
+app.include_router(internal_router, prefix="/internal")
+
+
+@app.on_event("startup")
+async def start_todo_events():
+    """
+    The start_todo_events function starts the todo event hub of this worker,
+        which listens for the events of the other workers when the database is Postgres.
+    
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    await todo_events.start(async_engine)
+
+
+@app.on_event("shutdown")
+async def stop_todo_events():
+    await todo_events.stop()
+
+
+@app.on_event("startup")
+async def start_revoked_tokens():
+    """
+    The start_revoked_tokens function starts the background task that refreshes the list of revoked tokens
+        of this worker from the revocation store.
+    
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    await revoked_tokens.start()
+
+
+@app.on_event("shutdown")
+async def stop_revoked_tokens():
+    await revoked_tokens.stop()
+
+
+@app.on_event("startup")
+async def start_tombstone_purger():
+    """
+    The start_tombstone_purger function starts the background task that deletes the tombstones
+        of todos deleted longer ago than the sync window.
+    
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    await tombstone_purger.start(AsyncSessionLocal)
+
+
+@app.on_event("shutdown")
+async def stop_tombstone_purger():
+    await tombstone_purger.stop()
+
+
+@app.on_event("startup")
+async def start_mailer():
+    """
+    The start_mailer function starts the background workers that send the queued emails of this worker,
+        and the outbox worker that feeds them.
+    
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    await mailer.start()
+    await outbox.start(AsyncSessionLocal)
+
+
+@app.on_event("shutdown")
+async def stop_mailer():
+    await outbox.stop()
+    await mailer.stop()
 
 
 
@@ -58,46 +119,20 @@ async def health_check():
     :return: A dictionary with the key &quot;ok&quot; and value true
     :doc-author: Trelent
     """
-    print()
     return {"OK": True}
 
-@app.post("/get_access_token")
-async def complete_google_login(login: Email, db: SessionLocal = Depends(get_db)):
-    """
-    The complete_google_login function is used to complete the Google login process.
-    It takes in a user's email address and returns an access token that can be used for authentication.
-    
-    :param login: Email: Pass the email address of the user to this function
-    :param db: SessionLocal: Get the database session
-    :return: A dictionary with the access token and its type
-    :doc-author: Trelent
-    """
-    user_service = UserService(db)
-    user = user_service.get_by_username(login.email)
-    access_token = create_access_token(username = user.username, role=user.role)
-    return {"access_token": access_token, "token_type": "bearer"}
-
-
 @app.post("/send-email")
-async def send_in_background(background_tasks: BackgroundTasks, body: EmailSchema):
+def send_in_background(body: EmailSchema, db: SessionLocal = Depends(get_db)):
     """
-    The send_in_background function sends an email in the background.
+    The send_in_background function sends an email in the background, through the outbox.
     
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks
     :param body: EmailSchema: Get the email address from the request body
+    :param db: SessionLocal: Get the database session
     :return: A dictionary with the key &quot;message&quot; and value &quot;email has been sent&quot;
     :doc-author: Trelent
     """
-    message = MessageSchema(
-        subject="Fastapi mail module",
-        recipients=[body.email],
-        template_body={"fullname": "Billy Jones"},
-        subtype=MessageType.html
-    )
-
-    fm = FastMail(conf)
-
-    background_tasks.add_task(fm.send_message, message, template_name="example_email.html")
+    queue_emails(db, {"recipient": body.email, "subject": "Fastapi mail module", "template": "example_email.html",
+                      "body": {"fullname": "Billy Jones"}})
 
     return {"message": "email has been sent"}
 
@@ -0,0 +1,34 @@
+"""Todo birthday key
+
+Revision ID: 0f3a9d6e2b71
+Revises: c552c89c4f97
+Create Date: 2026-10-18 11:02:17.540913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0f3a9d6e2b71'
+down_revision: Union[str, None] = 'c552c89c4f97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('todos', sa.Column('birthday_key', sa.Integer(), nullable=True))
+    todos = sa.table('todos', sa.column('birthday', sa.Date()), sa.column('birthday_key', sa.Integer()))
+    op.execute(
+        todos.update()
+        .where(todos.c.birthday.isnot(None))
+        .values(birthday_key=sa.cast(sa.extract('month', todos.c.birthday) * 100 + sa.extract('day', todos.c.birthday), sa.Integer()))
+    )
+    op.create_index('ix_todos_birthday_key_id', 'todos', ['birthday_key', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_todos_birthday_key_id', table_name='todos')
+    op.drop_column('todos', 'birthday_key')
@@ -0,0 +1,30 @@
+"""Todo sync tombstones
+
+Revision ID: 49e7c6665be7
+Revises: 7d41e0b8c3a5
+Create Date: 2026-10-18 15:12:44.380215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '49e7c6665be7'
+down_revision: Union[str, None] = '7d41e0b8c3a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('todos', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_todos_updated_at_id', 'todos', ['updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_todos_updated_at_id', table_name='todos')
+    # without the column the tombstones would come back as live todos
+    op.execute(sa.text("DELETE FROM todos WHERE deleted_at IS NOT NULL"))
+    op.drop_column('todos', 'deleted_at')
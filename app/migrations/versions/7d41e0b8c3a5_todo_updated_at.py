@@ -0,0 +1,27 @@
+"""Todo updated_at
+
+Revision ID: 7d41e0b8c3a5
+Revises: eac2bffcd7ff
+Create Date: 2026-10-18 13:40:09.215734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d41e0b8c3a5'
+down_revision: Union[str, None] = 'eac2bffcd7ff'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('todos', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute(sa.text("UPDATE todos SET updated_at = CURRENT_TIMESTAMP"))
+
+
+def downgrade() -> None:
+    op.drop_column('todos', 'updated_at')
@@ -0,0 +1,26 @@
+"""User token version
+
+Revision ID: a3c91f5d7e20
+Revises: 49e7c6665be7
+Create Date: 2026-10-18 16:05:27.914632
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c91f5d7e20'
+down_revision: Union[str, None] = '49e7c6665be7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
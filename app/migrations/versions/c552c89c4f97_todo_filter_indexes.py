@@ -0,0 +1,37 @@
+"""Todo filter indexes
+
+Revision ID: c552c89c4f97
+Revises: 5b95cbd54138
+Create Date: 2026-10-18 10:12:41.318052
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c552c89c4f97'
+down_revision: Union[str, None] = '5b95cbd54138'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_todos_is_done_id', 'todos', ['is_done', 'id'], unique=False)
+    op.create_index('ix_todos_is_done_birthday_id', 'todos', ['is_done', 'birthday', 'id'], unique=False)
+    op.create_index('ix_todos_is_done_email_id', 'todos', ['is_done', 'email', 'id'], unique=False)
+    op.create_index('ix_todos_birthday_id', 'todos', ['birthday', 'id'], unique=False)
+    op.create_index('ix_todos_email_id', 'todos', ['email', 'id'], unique=False)
+    op.create_index('ix_todos_email_pattern', 'todos', ['email'], unique=False,
+                    postgresql_ops={'email': 'varchar_pattern_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_todos_email_pattern', table_name='todos')
+    op.drop_index('ix_todos_email_id', table_name='todos')
+    op.drop_index('ix_todos_birthday_id', table_name='todos')
+    op.drop_index('ix_todos_is_done_email_id', table_name='todos')
+    op.drop_index('ix_todos_is_done_birthday_id', table_name='todos')
+    op.drop_index('ix_todos_is_done_id', table_name='todos')
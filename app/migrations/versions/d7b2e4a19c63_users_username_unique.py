@@ -0,0 +1,28 @@
+"""Users username unique
+
+Revision ID: d7b2e4a19c63
+Revises: a3c91f5d7e20
+Create Date: 2026-10-18 16:48:03.127594
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7b2e4a19c63'
+down_revision: Union[str, None] = 'a3c91f5d7e20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # registering twice used to create a second row; lookups by username only ever found one of them
+    op.execute(sa.text("DELETE FROM users WHERE id NOT IN (SELECT MAX(id) FROM users GROUP BY username)"))
+    op.create_index('ix_users_username', 'users', ['username'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_username', table_name='users')
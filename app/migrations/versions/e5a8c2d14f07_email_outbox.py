@@ -0,0 +1,46 @@
+"""Email outbox
+
+Revision ID: e5a8c2d14f07
+Revises: d7b2e4a19c63
+Create Date: 2026-10-18 19:12:41.503918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a8c2d14f07'
+down_revision: Union[str, None] = 'd7b2e4a19c63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('email_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.String(), nullable=False),
+    sa.Column('subject', sa.String(), nullable=False),
+    sa.Column('template', sa.String(), nullable=True),
+    sa.Column('body', sa.JSON(), nullable=True),
+    sa.Column('text', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('delivered_at', sa.DateTime(), nullable=True),
+    sa.Column('failed_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_email_outbox_id'), 'email_outbox', ['id'], unique=False)
+    op.create_index('ix_email_outbox_pending', 'email_outbox', ['available_at', 'id'], unique=False,
+                    postgresql_where=sa.text('delivered_at IS NULL AND failed_at IS NULL'),
+                    sqlite_where=sa.text('delivered_at IS NULL AND failed_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_outbox_pending', table_name='email_outbox')
+    op.drop_index(op.f('ix_email_outbox_id'), table_name='email_outbox')
+    op.drop_table('email_outbox')
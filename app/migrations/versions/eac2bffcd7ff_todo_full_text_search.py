@@ -0,0 +1,57 @@
+"""Todo full text search
+
+Revision ID: eac2bffcd7ff
+Revises: 0f3a9d6e2b71
+Create Date: 2026-10-18 12:24:53.906117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'eac2bffcd7ff'
+down_revision: Union[str, None] = '0f3a9d6e2b71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE INDEX ix_todos_search ON todos USING gin "
+            "(to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(surname, '') || ' ' || coalesce(description, '')))"
+        )
+    elif op.get_bind().dialect.name == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE todos_fts USING fts5("
+            "name, surname, description, content='todos', content_rowid='id')"
+        )
+        op.execute(
+            "CREATE TRIGGER todos_fts_ai AFTER INSERT ON todos BEGIN "
+            "INSERT INTO todos_fts(rowid, name, surname, description) VALUES (new.id, new.name, new.surname, new.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER todos_fts_ad AFTER DELETE ON todos BEGIN "
+            "INSERT INTO todos_fts(todos_fts, rowid, name, surname, description) "
+            "VALUES ('delete', old.id, old.name, old.surname, old.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER todos_fts_au AFTER UPDATE ON todos BEGIN "
+            "INSERT INTO todos_fts(todos_fts, rowid, name, surname, description) "
+            "VALUES ('delete', old.id, old.name, old.surname, old.description); "
+            "INSERT INTO todos_fts(rowid, name, surname, description) VALUES (new.id, new.name, new.surname, new.description); END"
+        )
+        op.execute("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_todos_search', table_name='todos')
+    elif op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS todos_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS todos_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS todos_fts_ai")
+        op.execute("DROP TABLE IF EXISTS todos_fts")
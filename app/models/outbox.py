@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from sqlalchemy import Column, String, Integer, Text, DateTime, JSON, Index
+
+from .base import BaseModel
+
+
+class OutboxDB(BaseModel):
+    __tablename__ = "email_outbox"
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    # an html template of services/templates rendered with body, or plain text
+    template = Column(String)
+    body = Column(JSON)
+    text = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # a claimed row is leased until then; if its worker dies before marking it, another worker sends it again
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = Column(DateTime)
+    failed_at = Column(DateTime)
+    last_error = Column(String)
+
+    # only the rows still to be sent, in the order OutboxRepo.claim takes them
+    __table_args__ = (
+        Index("ix_email_outbox_pending", "available_at", "id",
+              postgresql_where=delivered_at.is_(None) & failed_at.is_(None),
+              sqlite_where=delivered_at.is_(None) & failed_at.is_(None)),
+    )
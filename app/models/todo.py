@@ -1,7 +1,29 @@
-from sqlalchemy import Column, String, Boolean, Date, Integer
+from datetime import date, datetime
+
+from sqlalchemy import Column, String, Boolean, Date, DateTime, Integer, Index, DDL, event, func, literal_column
 
 from .base import BaseModel, Base
 
+
+def birthday_key(birthday: date | None) -> int | None:
+    """
+    The birthday_key function maps a birthday to month * 100 + day, e.g. 14 March is 314.
+        Unlike the day of the year it does not depend on the birth year, so 29 February is always 229
+        and the keys of one calendar year are in the same order as the dates.
+    
+    :param birthday: date | None: The birthday
+    :return: The month/day key, or None if there is no birthday
+    :doc-author: Trelent
+    """
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
+
+def _birthday_key_default(context) -> int | None:
+    return birthday_key(context.get_current_parameters().get("birthday"))
+
+
 class TodoDB(BaseModel):
     __tablename__ = "todos"
     # id = Column(Integer)
@@ -11,4 +33,56 @@ class TodoDB(BaseModel):
     phone = Column(Integer)
     birthday = Column(Date)
     is_done = Column(Boolean, default=False)
-    description = Column(String)
\ No newline at end of file
+    description = Column(String)
+    # kept in sync with birthday: filled on insert here, set next to birthday by TodoRepo on update
+    birthday_key = Column(Integer, default=_birthday_key_default)
+    # set by Python rather than now(), so it has microsecond precision on every backend
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # set instead of deleting the row, see TodoRepo.remove
+    deleted_at = Column(DateTime)
+
+    # every filter/sort combination allowed by GET /todo/ is served by one of these, GET /todo/changes by the last one
+    __table_args__ = (
+        Index("ix_todos_is_done_id", "is_done", "id"),
+        Index("ix_todos_is_done_birthday_id", "is_done", "birthday", "id"),
+        Index("ix_todos_is_done_email_id", "is_done", "email", "id"),
+        Index("ix_todos_birthday_id", "birthday", "id"),
+        Index("ix_todos_email_id", "email", "id"),
+        Index("ix_todos_email_pattern", "email", postgresql_ops={"email": "varchar_pattern_ops"}),
+        Index("ix_todos_birthday_key_id", "birthday_key", "id"),
+        Index("ix_todos_updated_at_id", "updated_at", "id"),
+    )
+
+
+# Full-text search. On Postgres a GIN expression index over the same tsvector expression that
+# TodoRepo.search queries; on SQLite an external-content FTS5 table kept in sync by triggers.
+search_vector = func.to_tsvector(
+    literal_column("'simple'"),
+    func.coalesce(TodoDB.name, literal_column("''")) + literal_column("' '")
+    + func.coalesce(TodoDB.surname, literal_column("''")) + literal_column("' '")
+    + func.coalesce(TodoDB.description, literal_column("''")),
+)
+
+POSTGRES_SEARCH_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_todos_search ON todos USING gin "
+    "(to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(surname, '') || ' ' || coalesce(description, '')))"
+)
+
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5("
+    "name, surname, description, content='todos', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_ai AFTER INSERT ON todos BEGIN "
+    "INSERT INTO todos_fts(rowid, name, surname, description) VALUES (new.id, new.name, new.surname, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_ad AFTER DELETE ON todos BEGIN "
+    "INSERT INTO todos_fts(todos_fts, rowid, name, surname, description) "
+    "VALUES ('delete', old.id, old.name, old.surname, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_au AFTER UPDATE ON todos BEGIN "
+    "INSERT INTO todos_fts(todos_fts, rowid, name, surname, description) "
+    "VALUES ('delete', old.id, old.name, old.surname, old.description); "
+    "INSERT INTO todos_fts(rowid, name, surname, description) VALUES (new.id, new.name, new.surname, new.description); END",
+)
+
+event.listen(TodoDB.__table__, "after_create", DDL(POSTGRES_SEARCH_INDEX_DDL).execute_if(dialect="postgresql"))
+for statement in SQLITE_FTS_DDL:
+    event.listen(TodoDB.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(TodoDB.__table__, "before_drop", DDL("DROP TABLE IF EXISTS todos_fts").execute_if(dialect="sqlite"))
@@ -1,13 +1,14 @@
-from sqlalchemy import Column, String, Boolean
+from sqlalchemy import Column, String, Boolean, Integer
 
 from .base import Base, BaseModel
 
 class UserDB(BaseModel):
     __tablename__ = "users"
-    username = Column(String)
+    username = Column(String, unique=True, index=True)
     password = Column(String)
     salt = Column(String)
     role = Column(String)
     confirmed = Column(Boolean, default=False)
     otp = Column(String)
-    image = Column(String)
\ No newline at end of file
+    image = Column(String)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
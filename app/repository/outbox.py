@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from models.outbox import OutboxDB
+
+PENDING = (OutboxDB.delivered_at.is_(None), OutboxDB.failed_at.is_(None))
+
+
+class OutboxRepo():
+    def __init__(self, db) -> None:
+        self.db = db
+
+    def add(self, *mails: dict) -> list[OutboxDB]:
+        rows = [OutboxDB(**mail) for mail in mails]
+        self.db.add_all(rows)
+        self.db.commit()
+        return rows
+
+    @staticmethod
+    def _claim_query(limit: int, lease: timedelta, now: datetime):
+        # one statement, so two workers never get the same row: on Postgres the subquery skips the rows
+        # another worker is claiming, on SQLite (no FOR UPDATE) the statement holds the write lock
+        claimable = (
+            select(OutboxDB.id)
+            .where(*PENDING, OutboxDB.available_at <= now)
+            .order_by(OutboxDB.available_at, OutboxDB.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return (
+            update(OutboxDB)
+            .where(OutboxDB.id.in_(claimable.scalar_subquery()))
+            .values(available_at=now + lease, attempts=OutboxDB.attempts + 1)
+            .returning(*OutboxDB.__table__.columns)
+        )
+
+    def claim(self, limit: int, lease: timedelta) -> list:
+        rows = self.db.execute(self._claim_query(limit, lease, datetime.utcnow()),
+                               execution_options={"synchronize_session": False}).mappings().all()
+        self.db.commit()
+        return sorted(rows, key=lambda row: row["id"])
+
+    def mark_delivered(self, ids: list[int]) -> None:
+        if ids:
+            self.db.execute(update(OutboxDB).where(OutboxDB.id.in_(ids)).values(delivered_at=datetime.utcnow()),
+                            execution_options={"synchronize_session": False})
+            self.db.commit()
+
+    def reschedule(self, id: int, error: str, retry_at: datetime) -> None:
+        self.db.execute(update(OutboxDB).where(OutboxDB.id == id).values(available_at=retry_at, last_error=error),
+                        execution_options={"synchronize_session": False})
+        self.db.commit()
+
+    def mark_failed(self, id: int, error: str) -> None:
+        self.db.execute(update(OutboxDB).where(OutboxDB.id == id).values(failed_at=datetime.utcnow(), last_error=error),
+                        execution_options={"synchronize_session": False})
+        self.db.commit()
+
+
+class AsyncOutboxRepo():
+    def __init__(self, db) -> None:
+        self.db = db
+
+    async def add(self, *mails: dict) -> list[OutboxDB]:
+        rows = [OutboxDB(**mail) for mail in mails]
+        self.db.add_all(rows)
+        await self.db.commit()
+        return rows
+
+    async def claim(self, limit: int, lease: timedelta) -> list:
+        rows = (await self.db.execute(OutboxRepo._claim_query(limit, lease, datetime.utcnow()),
+                                      execution_options={"synchronize_session": False})).mappings().all()
+        await self.db.commit()
+        return sorted(rows, key=lambda row: row["id"])
+
+    async def mark_delivered(self, ids: list[int]) -> None:
+        if ids:
+            await self.db.execute(update(OutboxDB).where(OutboxDB.id.in_(ids)).values(delivered_at=datetime.utcnow()),
+                                  execution_options={"synchronize_session": False})
+            await self.db.commit()
+
+    async def reschedule(self, id: int, error: str, retry_at: datetime) -> None:
+        await self.db.execute(update(OutboxDB).where(OutboxDB.id == id).values(available_at=retry_at, last_error=error),
+                              execution_options={"synchronize_session": False})
+        await self.db.commit()
+
+    async def mark_failed(self, id: int, error: str) -> None:
+        await self.db.execute(update(OutboxDB).where(OutboxDB.id == id).values(failed_at=datetime.utcnow(), last_error=error),
+                              execution_options={"synchronize_session": False})
+        await self.db.commit()
@@ -1,19 +1,272 @@
-from models.todo import TodoDB
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, tuple_, or_, and_, case, func, cast, Float, table, column, literal_column
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import load_only
+
+from models.todo import TodoDB, birthday_key, search_vector
+from schemas.todo import TodoFilter, TodoSort
+
+
+# the columns of the Todo schema, for the list pages that skip the ORM objects
+ROW_COLUMNS = (TodoDB.id, TodoDB.name, TodoDB.surname, TodoDB.email, TodoDB.phone,
+               TodoDB.birthday, TodoDB.is_done, TodoDB.description, TodoDB.updated_at)
+
+
+# deleted todos stay in the table as tombstones for GET /todo/changes, every other read skips them
+NOT_DELETED = TodoDB.deleted_at.is_(None)
 
 
 class TodoRepo():
     def __init__(self, db) -> None:
         self.db = db
 
-    def get_all(self) -> list[TodoDB]:
-        return self.db.query(TodoDB).filter()
+    def get_all(self, todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                after: tuple | None = None, limit: int | None = None) -> list[TodoDB]:
+        return self._page_query(self.db.query(TodoDB), todo_filter, sort, after, limit).all()
+
+    def get_all_rows(self, todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                     after: tuple | None = None, limit: int | None = None, columns: tuple[str, ...] | None = None) -> list:
+        # plain rows instead of TodoDB objects, no identity map or attribute instrumentation per row
+        stmt = select(*self._columns(columns))
+        return self.db.execute(self._page_query(stmt, todo_filter, sort, after, limit)).all()
+
+    @staticmethod
+    def _columns(columns: tuple[str, ...] | None) -> tuple:
+        return ROW_COLUMNS if columns is None else tuple(getattr(TodoDB, name) for name in columns)
+
+    @staticmethod
+    def _load_only(query, columns: tuple[str, ...] | None):
+        # the other columns stay unloaded; touching them on the objects would cost one query per row
+        return query if columns is None else query.options(load_only(*TodoRepo._columns(columns)))
+
+    def get_page_versions(self, todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                          after: tuple | None = None, limit: int | None = None) -> list[tuple]:
+        # same rows as get_all, but only (id, updated_at), which is enough to tell whether the page changed
+        return self._page_query(self.db.query(TodoDB.id, TodoDB.updated_at), todo_filter, sort, after, limit).all()
 
-    def create(self, todo_item):
-        new_item = TodoDB(**todo_item.dict())
-        self.db.add(new_item)
+    @staticmethod
+    def _page_query(query, todo_filter: TodoFilter | None, sort: TodoSort, after: tuple | None, limit: int | None):
+        query = TodoRepo._apply_filter(query.filter(NOT_DELETED), todo_filter)
+        sort_column = getattr(TodoDB, sort.column)
+        # the id tie-breaker makes the order total, so (sort key, id) is a valid keyset
+        keyset = [sort_column] if sort.column == "id" else [sort_column, TodoDB.id]
+        if after is not None:
+            if len(keyset) == 1:
+                query = query.filter(keyset[0] < after[0] if sort.descending else keyset[0] > after[0])
+            else:
+                row, position = tuple_(*keyset), tuple_(*after)
+                query = query.filter(row < position if sort.descending else row > position)
+        query = query.order_by(*[key_column.desc() if sort.descending else key_column for key_column in keyset])
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def search(self, q: str, after: tuple | None = None, limit: int | None = None,
+               columns: tuple[str, ...] | None = None) -> list[tuple[TodoDB, float]]:
+        if self.db.get_bind().dialect.name == "postgresql":
+            query, rank = self._search_postgres(q)
+        else:
+            query, rank = self._search_sqlite(q)
+        query = self._load_only(query, columns).filter(NOT_DELETED)
+        # best match first, id breaks ties, so (rank, id) is the keyset of the cursor
+        if after is not None:
+            after_rank, after_id = after
+            query = query.filter(or_(rank < after_rank, and_(rank == after_rank, TodoDB.id > after_id)))
+        query = query.order_by(rank.desc(), TodoDB.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return [(item, item_rank) for item, item_rank in query.all()]
+
+    def _search_postgres(self, q: str):
+        ts_query = func.websearch_to_tsquery(literal_column("'simple'"), q)
+        rank = cast(func.ts_rank_cd(search_vector, ts_query), Float)
+        query = self.db.query(TodoDB, rank.label("rank")).filter(search_vector.op("@@")(ts_query))
+        return query, rank
+
+    def _search_sqlite(self, q: str):
+        todos_fts = table("todos_fts", column("rowid"))
+        # quote every term so user input is never parsed as FTS5 query syntax; terms are ANDed
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+        rank = -func.bm25(literal_column("todos_fts"))
+        query = (
+            self.db.query(TodoDB, rank.label("rank"))
+            .join(todos_fts, todos_fts.c.rowid == TodoDB.id)
+            .filter(literal_column("todos_fts").match(match))
+        )
+        return query, rank
+
+    @staticmethod
+    def _apply_filter(query, todo_filter: TodoFilter | None):
+        if todo_filter is None:
+            return query
+        if todo_filter.is_done is not None:
+            query = query.filter(TodoDB.is_done == todo_filter.is_done)
+        if todo_filter.email is not None:
+            query = query.filter(TodoDB.email == todo_filter.email)
+        if todo_filter.email_prefix:
+            query = query.filter(TodoDB.email.startswith(todo_filter.email_prefix, autoescape=True))
+        if todo_filter.birthday_from is not None:
+            query = query.filter(TodoDB.birthday >= todo_filter.birthday_from)
+        if todo_filter.birthday_to is not None:
+            query = query.filter(TodoDB.birthday <= todo_filter.birthday_to)
+        return query
+
+    def iter_chunks(self, since_id: int | None = None, chunk_size: int = 1000, columns: tuple[str, ...] | None = None):
+        stmt = select(*(TodoDB.__table__.columns if columns is None else self._columns(columns)))
+        stmt = stmt.where(NOT_DELETED).order_by(TodoDB.id)
+        if since_id is not None:
+            stmt = stmt.where(TodoDB.id > since_id)
+        # yield_per turns on stream_results, i.e. a server-side cursor on Postgres
+        result = self.db.execute(stmt, execution_options={"yield_per": chunk_size})
+        for chunk in result.mappings().partitions():
+            yield chunk
+
+    @staticmethod
+    def _insert_or_revive(dialect_name: str):
+        # INSERT ... ON CONFLICT (id) DO UPDATE ... WHERE deleted_at IS NOT NULL: an id that belongs to a tombstone
+        # takes the row over again, with a fresh updated_at and no deleted_at, while the id of a live row is
+        # skipped and missing from RETURNING
+        dialect_insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+        stmt = dialect_insert(TodoDB)
+        return stmt.on_conflict_do_update(
+            index_elements=[TodoDB.id],
+            set_={column.name: stmt.excluded[column.name] for column in TodoDB.__table__.columns if column.name != "id"},
+            where=TodoDB.deleted_at.is_not(None),
+        )
+
+    def _commit(self, notify, written) -> None:
+        # notify(written) runs in the write transaction, so its statements commit or roll back with the write
+        if notify is not None and written:
+            notify(written)
         self.db.commit()
-        self.db.refresh(new_item)
-        return new_item
+
+    def create(self, todo_item, notify=None):
+        # None means a live todo already has the id
+        stmt = self._insert_or_revive(self.db.get_bind().dialect.name).returning(*TodoDB.__table__.columns)
+        new_row = self.db.execute(stmt, todo_item.dict()).mappings().first()
+        self._commit(notify, new_row)
+        return new_row
+
+    def create_many(self, todo_items, notify=None) -> list[int]:
+        if not todo_items:
+            return []
+        # batched multi-row INSERT ... ON CONFLICT ... RETURNING in one transaction;
+        # the ids of live rows are skipped, and missing from the result, instead of failing the batch
+        new_ids = set(self.db.scalars(
+            self._insert_or_revive(self.db.get_bind().dialect.name).returning(TodoDB.id),
+            [todo_item.dict() for todo_item in todo_items],
+        ).all())
+        created_ids = [todo_item.id for todo_item in todo_items if todo_item.id in new_ids]
+        self._commit(notify, created_ids)
+        return created_ids
 
     def get_by_id(self, id):
-        return self.db.query(TodoDB).filter(TodoDB.id == id).first()
\ No newline at end of file
+        return self.db.query(TodoDB).filter(TodoDB.id == id, NOT_DELETED).first()
+
+    def get_changes(self, after: tuple | None, until: datetime, limit: int, include_deleted: bool = True) -> list:
+        # (updated_at, id) keyset over ix_todos_updated_at_id: the cost depends on the number of changes, not on the table
+        stmt = select(*ROW_COLUMNS, TodoDB.deleted_at).where(TodoDB.updated_at <= until)
+        if after is not None:
+            stmt = stmt.where(tuple_(TodoDB.updated_at, TodoDB.id) > tuple_(*after))
+        if not include_deleted:
+            stmt = stmt.where(NOT_DELETED)
+        stmt = stmt.order_by(TodoDB.updated_at, TodoDB.id).limit(limit)
+        return self.db.execute(stmt).all()
+
+    def update(self, id, values: dict, notify=None):
+        values = self._with_birthday_key(values)
+        stmt = update(TodoDB).where(TodoDB.id == id, NOT_DELETED).values(**values).returning(*TodoDB.__table__.columns)
+        updated_row = self.db.execute(stmt, execution_options={"synchronize_session": False}).mappings().first()
+        self._commit(notify, updated_row)
+        return updated_row
+
+    def update_many(self, ids: list[int], values: dict, notify=None) -> list[int]:
+        values = self._with_birthday_key(values)
+        stmt = update(TodoDB).where(TodoDB.id.in_(ids), NOT_DELETED).values(**values).returning(TodoDB.id)
+        updated_ids = list(self.db.scalars(stmt, execution_options={"synchronize_session": False}).all())
+        self._commit(notify, updated_ids)
+        return updated_ids
+
+    @staticmethod
+    def _with_birthday_key(values: dict) -> dict:
+        if "birthday" in values:
+            values = dict(values, birthday_key=birthday_key(values["birthday"]))
+        return values
+
+    def get_by_birthday_keys(self, key_ranges: list[tuple[int, int]], limit: int,
+                             columns: tuple[str, ...] | None = None) -> list[TodoDB]:
+        # the first range holds the nearest birthdays, the second one (after a year-end wrap) comes next
+        first_start = key_ranges[0][0]
+        query = self._load_only(self.db.query(TodoDB), columns).filter(NOT_DELETED).filter(
+            or_(*[and_(TodoDB.birthday_key >= start, TodoDB.birthday_key <= end) for start, end in key_ranges])
+        )
+        query = query.order_by(case((TodoDB.birthday_key >= first_start, 0), else_=1), TodoDB.birthday_key, TodoDB.id)
+        return query.limit(limit).all()
+
+    @staticmethod
+    def _soft_delete(id):
+        # a tombstone: the row keeps its id and gets a fresh updated_at, so syncing clients see the deletion
+        now = datetime.utcnow()
+        stmt = update(TodoDB).where(TodoDB.id == id, NOT_DELETED).values(deleted_at=now, updated_at=now)
+        return stmt.returning(*TodoDB.__table__.columns)
+
+    def remove(self, id, notify=None):
+        stmt = self._soft_delete(id)
+        removed_row = self.db.execute(stmt, execution_options={"synchronize_session": False}).mappings().first()
+        self._commit(notify, removed_row)
+        return removed_row
+
+    @staticmethod
+    def _purge(before: datetime, limit: int):
+        # tombstones keep updated_at == deleted_at, so ix_todos_updated_at_id finds the old ones
+        old_ids = select(TodoDB.id).where(TodoDB.updated_at < before, TodoDB.deleted_at.is_not(None)).limit(limit)
+        return delete(TodoDB).where(TodoDB.id.in_(old_ids.scalar_subquery()))
+
+
+class AsyncTodoRepo():
+    def __init__(self, db) -> None:
+        self.db = db
+
+    async def get_all(self, todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                      after: tuple | None = None, limit: int | None = None) -> list[TodoDB]:
+        stmt = TodoRepo._page_query(select(TodoDB), todo_filter, sort, after, limit)
+        return list((await self.db.scalars(stmt)).all())
+
+    async def get_all_rows(self, todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                           after: tuple | None = None, limit: int | None = None, columns: tuple[str, ...] | None = None) -> list:
+        stmt = TodoRepo._page_query(select(*TodoRepo._columns(columns)), todo_filter, sort, after, limit)
+        return list((await self.db.execute(stmt)).all())
+
+    async def get_page_versions(self, todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                                after: tuple | None = None, limit: int | None = None) -> list[tuple]:
+        stmt = TodoRepo._page_query(select(TodoDB.id, TodoDB.updated_at), todo_filter, sort, after, limit)
+        return list((await self.db.execute(stmt)).all())
+
+    async def get_by_id(self, id):
+        return (await self.db.scalars(select(TodoDB).where(TodoDB.id == id, NOT_DELETED))).first()
+
+    async def create(self, todo_item):
+        stmt = TodoRepo._insert_or_revive(self.db.get_bind().dialect.name).returning(*TodoDB.__table__.columns)
+        new_row = (await self.db.execute(stmt, todo_item.dict())).mappings().first()
+        await self.db.commit()
+        return new_row
+
+    async def update(self, id, values: dict):
+        values = TodoRepo._with_birthday_key(values)
+        stmt = update(TodoDB).where(TodoDB.id == id, NOT_DELETED).values(**values).returning(*TodoDB.__table__.columns)
+        updated_row = (await self.db.execute(stmt, execution_options={"synchronize_session": False})).mappings().first()
+        await self.db.commit()
+        return updated_row
+
+    async def remove(self, id):
+        stmt = TodoRepo._soft_delete(id)
+        removed_row = (await self.db.execute(stmt, execution_options={"synchronize_session": False})).mappings().first()
+        await self.db.commit()
+        return removed_row
+
+    async def purge_tombstones(self, before: datetime, limit: int) -> int:
+        result = await self.db.execute(TodoRepo._purge(before, limit), execution_options={"synchronize_session": False})
+        await self.db.commit()
+        return result.rowcount
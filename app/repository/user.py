@@ -1,6 +1,9 @@
+from models.outbox import OutboxDB
 from models.users import UserDB
 import os
 import hashlib
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from depenedencies.database import SessionLocal
 
 class UserRepo():
@@ -8,47 +11,86 @@ class UserRepo():
         self.db = db
 
 
-    def create(self, user):
-        password, salt = self.hash_password(user.password)
+    def create(self, user, salt=None, mails=()):
+        # user.password is already hashed by the service, salt is only set for legacy hashes;
+        # mails go to the outbox in the same transaction, so they are sent if and only if the user exists;
+        # None means the username was taken in the meantime
         new_user = UserDB(**user.dict())
-        new_user.password = password
         new_user.salt = salt
         self.db.add(new_user)
-        self.db.commit()
+        self.db.add_all(OutboxDB(**mail) for mail in mails)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            return None
         self.db.refresh(new_user)
         return new_user
 
-    def update(self, user):
-        self.db.query(UserDB).filter(UserDB.username==user.username).delete()
-        return self.create(user)
+    def update(self, username, values: dict, bump_token_version: bool = False):
+        # only the given columns are written; the id, password and salt of the user stay as they are
+        if bump_token_version:
+            values = dict(values, token_version=UserDB.token_version + 1)
+        stmt = update(UserDB).where(UserDB.username == username).values(**values).returning(*UserDB.__table__.columns)
+        updated_row = self.db.execute(stmt, execution_options={"synchronize_session": False}).mappings().first()
+        self.db.commit()
+        return updated_row
+
+    def set_password(self, username, password):
+        self.db.execute(update(UserDB).where(UserDB.username == username).values(password=password, salt=None))
+        self.db.commit()
 
     def get_by_username(self, username):
         return self.db.query(UserDB).filter(UserDB.username == username).first()
 
 
-    def get_user_and_check_pass(self, username, password):
-        user = self.db.query(UserDB).filter(UserDB.username == username).first()
-        password_from_db = user.password
-        user_salt = user.salt
-        hashed_pass, _ =  self.hash_password(password=password, salt=user_salt)
-        if hashed_pass ==password_from_db:
-            return user
-        else:
-            return None
-
-
-    def generate_salt(self):
+    @staticmethod
+    def generate_salt():
         return os.urandom(16)
 
-    def hash_password(self, password, salt=None) -> tuple[str]:
+    @staticmethod
+    def hash_password(password, salt=None) -> tuple[str]:
+        # the legacy scheme; new passwords are hashed by services.passwords, this only checks old ones
         if salt is None:
-            salt = self.generate_salt()
+            salt = UserRepo.generate_salt()
         else:
             salt = bytes.fromhex(salt)
         salted_password = password.encode() + salt
         hashed_password = hashlib.sha256(salted_password).hexdigest()
         return str(hashed_password), str(salt.hex())
 
+class AsyncUserRepo():
+    def __init__(self, db) -> None:
+        self.db = db
+
+    async def create(self, user, salt=None, mails=()):
+        new_user = UserDB(**user.dict())
+        new_user.salt = salt
+        self.db.add(new_user)
+        self.db.add_all(OutboxDB(**mail) for mail in mails)
+        try:
+            await self.db.commit()
+        except IntegrityError:
+            await self.db.rollback()
+            return None
+        await self.db.refresh(new_user)
+        return new_user
+
+    async def update(self, username, values: dict, bump_token_version: bool = False):
+        if bump_token_version:
+            values = dict(values, token_version=UserDB.token_version + 1)
+        stmt = update(UserDB).where(UserDB.username == username).values(**values).returning(*UserDB.__table__.columns)
+        updated_row = (await self.db.execute(stmt, execution_options={"synchronize_session": False})).mappings().first()
+        await self.db.commit()
+        return updated_row
+
+    async def set_password(self, username, password):
+        await self.db.execute(update(UserDB).where(UserDB.username == username).values(password=password, salt=None))
+        await self.db.commit()
+
+    async def get_by_username(self, username):
+        return (await self.db.scalars(select(UserDB).where(UserDB.username == username))).first()
+
 async def confirmed_email(email: str, db: SessionLocal) -> None:
         user = await get_user_by_email(email, db)
         user.confirmed = True
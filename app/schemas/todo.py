@@ -1,5 +1,6 @@
-from datetime import date
+from datetime import date, datetime
 from pydantic import BaseModel
+import enum
 
 class Todo(BaseModel):
     id: int
@@ -10,12 +11,56 @@ class Todo(BaseModel):
     birthday: date
     is_done: bool
     description: str
+    updated_at: datetime | None = None
 
     class Config:
         orm_mode = True
         from_attributes=True
 
 
+class TodoPage(BaseModel):
+    items: list[Todo]
+    next_cursor: str | None = None
+
+
+class TodoChanges(BaseModel):
+    changed: list[Todo]
+    deleted: list[int]
+    next_token: str | None = None
+    has_more: bool = False
+
+
+class TodoSort(str, enum.Enum):
+    ID = "id"
+    ID_DESC = "-id"
+    BIRTHDAY = "birthday"
+    BIRTHDAY_DESC = "-birthday"
+    EMAIL = "email"
+    EMAIL_DESC = "-email"
+
+    @property
+    def column(self) -> str:
+        return self.value.lstrip("-")
+
+    @property
+    def descending(self) -> bool:
+        return self.value.startswith("-")
+
+
+class TodoFilter(BaseModel):
+    is_done: bool | None = None
+    email: str | None = None
+    email_prefix: str | None = None
+    birthday_from: date | None = None
+    birthday_to: date | None = None
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+    MSGPACK = "msgpack"
+
+
 class TodoCreate(BaseModel):
     id: int
     name: str
@@ -26,14 +71,33 @@ class TodoCreate(BaseModel):
     description: str | None
 
 
+class TodoBulkError(BaseModel):
+    index: int
+    errors: list[dict]
+
+
+class TodoBulkResult(BaseModel):
+    created_ids: list[int]
+    errors: list[TodoBulkError]
+
+
 class TodoUpdate(BaseModel):
-    name: str | None
-    surname: str | None
-    email: str | None
-    phone: int | None
-    birthday: date | None
-    is_done: bool | None
-    description: str | None
+    name: str | None = None
+    surname: str | None = None
+    email: str | None = None
+    phone: int | None = None
+    birthday: date | None = None
+    is_done: bool | None = None
+    description: str | None = None
+
+
+class TodoBulkUpdate(BaseModel):
+    ids: list[int]
+    patch: TodoUpdate
+
+
+class TodoBulkUpdateResult(BaseModel):
+    updated_ids: list[int]
 
 class TodoDelete(BaseModel):
     id: int
@@ -17,6 +17,7 @@ class User(BaseModel):
     confirmed: bool | None
     otp: str | None
     image: str
+    token_version: int = 0
 
     class Config:
         orm_mode = True
@@ -28,3 +29,7 @@ class UserConfirmed(BaseModel):
     email: EmailStr
     otp: str
 
+
+class UserRole(BaseModel):
+    email: EmailStr
+    role: RolesEnum
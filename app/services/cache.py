@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.concurrency import run_in_threadpool
+
+from conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+# How long an invalidated key refuses to be repopulated: a reader that loaded the row before the write
+# committed cannot put its stale copy back, as long as it finishes within this time.
+CACHE_TOMBSTONE_SECONDS = 5
+TOMBSTONE = b"\x00"
+
+
+class LRUCache():
+    def __init__(self, max_size: int = 10000, ttl: float = 60, tombstone_ttl: float = 0) -> None:
+        """
+        The __init__ function creates an empty in-process cache.
+            Entries expire ttl seconds after they were stored, and once max_size entries are held
+            the least recently used one is evicted to make room for a new one.
+            With a tombstone_ttl, delete leaves a tombstone for that many seconds and set does not fill
+            a tombstoned key, like RedisCache; without it, delete simply drops the entries.
+        
+        :param self: Represent the instance of the class
+        :param max_size: int: Maximum number of entries kept in memory
+        :param ttl: float: Number of seconds an entry stays valid
+        :param tombstone_ttl: float: Number of seconds an invalidated key cannot be filled again
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now or entry[1] is TOMBSTONE:
+                if entry is not None and entry[0] <= now:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value) -> None:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is TOMBSTONE and entry[0] > now:
+                return
+            self._put(key, now + self.ttl, value)
+
+    def delete(self, *keys: str) -> None:
+        with self.lock:
+            for key in keys:
+                if self.tombstone_ttl > 0:
+                    self._put(key, time.monotonic() + self.tombstone_ttl, TOMBSTONE)
+                else:
+                    self.entries.pop(key, None)
+
+    def _put(self, key: str, expires_at: float, value) -> None:
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # the async interface of the caches; this one never waits, so it runs inline
+    async def aget(self, key: str):
+        return self.get(key)
+
+    async def aset(self, key: str, value) -> None:
+        self.set(key, value)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self.entries)}
+
+
+class RedisCache():
+    def __init__(self, client, model, ttl: float = 60, prefix: str = "cache:", errors=(Exception,),
+                 tombstone_ttl: float = CACHE_TOMBSTONE_SECONDS) -> None:
+        """
+        The __init__ function creates a cache stored in Redis, shared by all workers.
+            Values are pydantic models of class model, stored as JSON with a Redis expiry of ttl seconds.
+            Evictions are done by Redis itself, so they are not counted here.
+            Redis being unreachable is not an error for the callers: a read is a miss and goes to the database,
+            a write or an invalidation is logged and counted, and the entry expires with its ttl.
+            delete leaves a tombstone for tombstone_ttl seconds and set only fills an empty key, so a reader
+            racing a write cannot put back the value the write replaced.
+        
+        :param self: Represent the instance of the class
+        :param client: A redis.Redis client, or anything with the same get/set/delete methods
+        :param model: The pydantic model class of the cached values
+        :param ttl: float: Number of seconds an entry stays valid
+        :param prefix: str: Prefix of every key written to Redis
+        :param errors: The exceptions that mean Redis is unreachable
+        :param tombstone_ttl: float: Number of seconds an invalidated key cannot be filled again
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.client = client
+        self.model = model
+        self.ttl = ttl
+        self.prefix = prefix
+        self.errors = errors
+        self.tombstone_ttl = tombstone_ttl
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def get(self, key: str):
+        try:
+            raw = self.client.get(self.prefix + key)
+        except self.errors as error:
+            self._failed("get", error)
+            raw = None
+        if raw is None or raw == TOMBSTONE:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.model.parse_raw(raw)
+
+    def set(self, key: str, value) -> None:
+        try:
+            self.client.set(self.prefix + key, value.json(), ex=max(1, int(self.ttl)), nx=True)
+        except self.errors as error:
+            self._failed("set", error)
+
+    def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.set(self.prefix + key, TOMBSTONE, ex=max(1, int(self.tombstone_ttl)))
+            pipeline.execute()
+        except self.errors as error:
+            self._failed("delete", error)
+
+    # the client is blocking; from async code its round trips go to the threadpool, not the event loop
+    async def aget(self, key: str):
+        return await run_in_threadpool(self.get, key)
+
+    async def aset(self, key: str, value) -> None:
+        await run_in_threadpool(self.set, key, value)
+
+    def _failed(self, operation: str, error: Exception) -> None:
+        self.failures += 1
+        logger.warning("cache %s failed: %r", operation, error)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses, "evictions": 0, "size": None,
+                "failures": self.failures}
+
+
+def create_cache(model, prefix: str):
+    """
+    The create_cache function builds the cache selected by settings.cache_backend:
+        &quot;memory&quot; for a per-worker LRUCache, &quot;redis&quot; for a RedisCache on redis_host/redis_port,
+        or &quot;none&quot; to disable caching.
+        A write only invalidates the per-worker cache of the worker that made it, so &quot;memory&quot; is refused
+        when the server runs several workers (WEB_CONCURRENCY, as read by uvicorn and gunicorn, above 1).
+    
+    :param model: The pydantic model class of the cached values
+    :param prefix: str: Prefix of the Redis keys
+    :return: A cache object, or None if caching is disabled
+    :doc-author: Trelent
+    """
+    if settings.cache_backend == "redis":
+        import redis
+
+        client = redis.Redis(host=settings.redis_host, port=settings.redis_port)
+        return RedisCache(client, model, ttl=settings.cache_ttl, prefix=prefix, errors=(redis.RedisError,))
+    if settings.cache_backend == "memory":
+        if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+            raise RuntimeError("cache_backend 'memory' is invalidated in one worker only; "
+                               "use 'redis' or 'none' when running several workers")
+        return LRUCache(max_size=settings.cache_max_size, ttl=settings.cache_ttl,
+                        tombstone_ttl=CACHE_TOMBSTONE_SECONDS)
+    return None
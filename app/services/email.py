@@ -1,52 +1,29 @@
-from pathlib import Path
+from repository.outbox import OutboxRepo
+from services.outbox import outbox
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
-from pydantic import EmailStr
 
+def otp_email(email: str, otp: str) -> dict:
+    """
+    The otp_email function builds the email that gives a new user the code confirming their email address.
+    
+    :param email: str: The email address of the user
+    :param otp: str: The confirmation code
+    :return: An outbox row, for queue_emails or UserRepo.create
+    :doc-author: Trelent
+    """
+    return {"recipient": email, "subject": "Welcome", "text": f"your code is {otp}"}
 
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_from),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Desired Name",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
-
-
-async def send_email(email: EmailStr, username: str, host: str):
+def queue_emails(db, *mails: dict) -> None:
     """
-    The send_email function sends an email to the user with a link to confirm their email address.
-        The function takes in three arguments:
-            -email: the user's email address, which is used as a unique identifier for them.
-            -username: the username of the user who is registering. This will be displayed in 
-                their confirmation message so they know it was sent to them and not someone else.
-            -host: this is used as part of the URL that will be sent in their confirmation message, 
-                so they can click on it and verify themselves.
+    The queue_emails function commits emails to the outbox, from which the outbox worker sends them.
+        Once it returns the emails survive a restart; to send them together with other rows,
+        pass them to the repository that writes those instead, e.g. UserRepo.create.
     
-    :param email: EmailStr: Make sure that the email is a valid email address
-    :param username: str: Pass the username to the email template
-    :param host: str: Pass the host name to the email template
-    :return: A coroutine object, which is an awaitable object
+    :param db: Session: The database session
+    :param mails: dict: The outbox rows, e.g. from otp_email
+    :return: Nothing
     :doc-author: Trelent
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
\ No newline at end of file
+    OutboxRepo(db).add(*mails)
+    outbox.wake()
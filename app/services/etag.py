@@ -0,0 +1,29 @@
+import hashlib
+
+
+def make_etag(*parts) -> str:
+    """
+    The make_etag function builds a strong ETag from the values that identify a version of a resource.
+    
+    :param *parts: Values such as ids and update timestamps
+    :return: A quoted ETag
+    :doc-author: Trelent
+    """
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    The etag_matches function checks an If-None-Match header against the current ETag.
+        The header may list several ETags, weak or strong, or be *.
+    
+    :param if_none_match: str | None: The If-None-Match header of the request
+    :param etag: str: The current ETag of the resource
+    :return: True if the client already has the current version
+    :doc-author: Trelent
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import threading
+import uuid
+from collections import deque
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from conf.config import settings
+from services.serialization import dumps_json
+
+NOTIFY_CHANNEL = "todo_events"
+# pg_notify refuses payloads of 8000 bytes or more; bigger events are sent without their data
+MAX_NOTIFY_PAYLOAD = 7900
+# events per pg_notify statement; a bulk write of 10000 todos costs 10 round trips, not 10000
+NOTIFY_BATCH_SIZE = 1000
+NOTIFY_STATEMENT = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+SUBSCRIBER_QUEUE_SIZE = 256
+EVENT_HISTORY_SIZE = 1000
+LISTEN_BACKOFF_SECONDS = 1.0
+LISTEN_MAX_BACKOFF_SECONDS = 30.0
+
+
+class Subscription():
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE) -> None:
+        """
+        The __init__ function creates the bounded queue of one subscriber of a ChangeHub.
+            The queue holds events; None in the queue means the subscriber was dropped and has to reconnect.
+        
+        :param self: Represent the instance of the class
+        :param queue_size: int: Number of events the subscriber may fall behind before it is dropped
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    async def get(self) -> dict | None:
+        return await self.queue.get()
+
+
+class ChangeHub():
+    def __init__(self, use_notify: bool = False, queue_size: int = SUBSCRIBER_QUEUE_SIZE,
+                 history_size: int = EVENT_HISTORY_SIZE) -> None:
+        """
+        The __init__ function creates the fan-out hub of todo events of this worker.
+            With use_notify the events are published with Postgres NOTIFY and every worker's hub receives them
+            through LISTEN, so subscribers see the writes of all workers. Otherwise (SQLite) the events of
+            this process are handed to the subscribers directly.
+            The last history_size events are kept so a client can resume after its last event id.
+        
+        :param self: Represent the instance of the class
+        :param use_notify: bool: Publish through Postgres LISTEN/NOTIFY
+        :param queue_size: int: Size of the queue of every subscriber
+        :param history_size: int: Number of events kept for resuming
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.use_notify = use_notify
+        self.queue_size = queue_size
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self.loop = None
+        self.listener = None
+        self.listen_task = None
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.last_error = None
+
+    async def start(self, async_engine=None) -> None:
+        """
+        The start function binds the hub to the running event loop and, with use_notify,
+            starts listening on async_engine. Call it once per worker at startup.
+            The LISTEN connection is opened again, with backoff, whenever it is lost, e.g. when the database restarts.
+        
+        :param self: Represent the instance of the class
+        :param async_engine: The AsyncEngine to listen on
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.loop = asyncio.get_running_loop()
+        if self.use_notify and async_engine is not None:
+            self.listen_task = asyncio.create_task(self._listen(async_engine))
+
+    async def stop(self) -> None:
+        if self.listen_task is not None:
+            self.listen_task.cancel()
+            await asyncio.gather(self.listen_task, return_exceptions=True)
+            self.listen_task = None
+        for subscription in list(self.subscribers):
+            self._drop(subscription)
+        self.loop = None
+
+    async def _listen(self, async_engine) -> None:
+        backoff = LISTEN_BACKOFF_SECONDS
+        connected_before = False
+        while True:
+            try:
+                self.listener = await async_engine.connect()
+                raw_connection = await self.listener.get_raw_connection()
+                lost = asyncio.Event()
+                raw_connection.driver_connection.add_termination_listener(lambda connection: lost.set())
+                await raw_connection.driver_connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                if connected_before:
+                    # whatever was published while we were away is gone; clients catch up through GET /todo/changes
+                    self.reconnects += 1
+                    self._dispatch({"id": None, "type": "reset", "todo_id": None, "data": None})
+                connected_before = True
+                backoff = LISTEN_BACKOFF_SECONDS
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.last_error = repr(error)
+            finally:
+                await self._close_listener()
+            await asyncio.sleep(backoff)
+            backoff = min(LISTEN_MAX_BACKOFF_SECONDS, backoff * 2)
+
+    async def _close_listener(self) -> None:
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            try:
+                await listener.close()
+            except Exception:
+                # the connection is already broken; the pool discards it
+                pass
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        self._dispatch(json.loads(payload))
+
+    def notify(self, events: list[dict], db) -> None:
+        """
+        The notify function queues todo events in the open transaction of db, before the write commits.
+            With use_notify the events go through pg_notify, NOTIFY_BATCH_SIZE per statement; Postgres delivers
+            them to the subscribers of every worker when, and only if, the write commits.
+            Without it there is nothing to do here, publish hands the events over after the commit.
+        
+        :param self: Represent the instance of the class
+        :param events: list[dict]: The events, built with make_event
+        :param db: The database session of the write
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if not events or not self.use_notify or db is None:
+            return
+        payloads = []
+        for event in events:
+            payload = dumps_json(event).decode()
+            if len(payload.encode()) > MAX_NOTIFY_PAYLOAD:
+                payload = dumps_json(dict(event, data=None)).decode()
+            payloads.append(payload)
+        for start in range(0, len(payloads), NOTIFY_BATCH_SIZE):
+            db.execute(NOTIFY_STATEMENT, {"channel": NOTIFY_CHANNEL, "payloads": payloads[start:start + NOTIFY_BATCH_SIZE]})
+
+    def publish(self, events: list[dict]) -> None:
+        """
+        The publish function sends todo events to the subscribers, once the write has committed.
+            With use_notify it does nothing: notify already queued them in the write transaction.
+            Without it they are handed to this worker's event loop, from any thread.
+        
+        :param self: Represent the instance of the class
+        :param events: list[dict]: The events, built with make_event
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if not events or self.use_notify:
+            return
+        # encode and decode once, so local subscribers get exactly what a NOTIFY would carry
+        events = [json.loads(dumps_json(event)) for event in events]
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            for event in events:
+                self._dispatch(event)
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            for event in events:
+                self._dispatch(event)
+        else:
+            for event in events:
+                loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: dict) -> None:
+        with self.lock:
+            self.history.append(event)
+            self.published += 1
+        for subscription in list(self.subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # a slow consumer must not hold up the others or grow memory without bound
+                self._drop(subscription)
+
+    def _drop(self, subscription: Subscription) -> None:
+        self.subscribers.discard(subscription)
+        if subscription.dropped:
+            return
+        subscription.dropped = True
+        self.dropped += 1
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def subscribe(self, last_event_id: str | None = None) -> Subscription:
+        """
+        The subscribe function registers a new subscriber.
+            With last_event_id the events after it are queued first, if they are still in the history;
+            if they are not, the subscription starts with a reset event, and the client should catch up
+            through GET /todo/changes before it relies on the stream again.
+            Must be called from the event loop of the hub; a hub that was not started is bound to it here.
+        
+        :param self: Represent the instance of the class
+        :param last_event_id: str | None: The id of the last event the client received
+        :return: The subscription to read the events from
+        :doc-author: Trelent
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        subscription = Subscription(self.queue_size)
+        if last_event_id:
+            with self.lock:
+                history = list(self.history)
+            ids = [event["id"] for event in history]
+            missed = history[ids.index(last_event_id) + 1:] if last_event_id in ids else None
+            if missed is None or len(missed) >= self.queue_size:
+                subscription.queue.put_nowait({"id": None, "type": "reset", "todo_id": None, "data": None})
+            else:
+                for event in missed:
+                    subscription.queue.put_nowait(event)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscribers.discard(subscription)
+
+    def stats(self) -> dict:
+        return {"backend": "notify" if self.use_notify else "memory", "subscribers": len(self.subscribers),
+                "published": self.published, "dropped": self.dropped, "history": len(self.history),
+                "listening": self.listener is not None, "reconnects": self.reconnects, "last_error": self.last_error}
+
+
+def make_event(event_type: str, todo_id: int, data: dict | None = None) -> dict:
+    """
+    The make_event function builds a todo event: created, updated or deleted, the id of the todo
+        and, when it is at hand, the todo itself.
+    
+    :param event_type: str: created, updated or deleted
+    :param todo_id: int: The id of the todo
+    :param data: dict | None: The todo as a dictionary
+    :return: The event
+    :doc-author: Trelent
+    """
+    return {"id": uuid.uuid4().hex, "type": event_type, "todo_id": todo_id, "data": data}
+
+
+def encode_sse(event: dict) -> str:
+    lines = [] if event["id"] is None else [f"id: {event['id']}"]
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {dumps_json({'todo_id': event['todo_id'], 'data': event['data']}).decode()}")
+    return "\n".join(lines) + "\n\n"
+
+
+def create_change_hub() -> ChangeHub:
+    backend = make_url(settings.sqlalchemy_database_url).get_backend_name()
+    return ChangeHub(use_notify=backend == "postgresql")
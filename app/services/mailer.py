@@ -0,0 +1,367 @@
+import asyncio
+import bisect
+import random
+import threading
+import time
+from email.message import EmailMessage
+from pathlib import Path
+
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from conf.config import settings
+from depenedencies.pool_metrics import WAIT_BUCKETS_MS
+
+TEMPLATE_FOLDERS = [Path(__file__).parent / "templates", Path(__file__).parent.parent / "templates"]
+MAIL_QUEUE_SIZE = 1000
+MAIL_BATCH_SIZE = 20
+MAIL_MAX_ATTEMPTS = 5
+MAIL_BACKOFF_SECONDS = 1.0
+MAIL_MAX_BACKOFF_SECONDS = 60.0
+# SMTP servers hang up on idle sessions after a few minutes; close ours before they do
+MAIL_IDLE_SECONDS = 60.0
+
+templates = Environment(loader=FileSystemLoader(TEMPLATE_FOLDERS), autoescape=select_autoescape(["html"]))
+
+
+class MailNotSent(Exception):
+    def __init__(self, error: str, permanent: bool) -> None:
+        super().__init__(error)
+        self.error = error
+        # the server refused the message; sending it again will not help
+        self.permanent = permanent
+
+
+class OutgoingMail():
+    def __init__(self, message: EmailMessage, delivery: asyncio.Future | None = None) -> None:
+        self.message = message
+        self.attempts = 0
+        self.enqueued_at = time.perf_counter()
+        # resolved with None once sent, or with a MailNotSent once given up; set by Mailer.send only
+        self.delivery = delivery
+
+
+class Mailer():
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 sender: str | None = None, use_tls: bool = False, start_tls: bool | None = None,
+                 validate_certs: bool = True, connections: int = 2, queue_size: int = MAIL_QUEUE_SIZE,
+                 batch_size: int = MAIL_BATCH_SIZE, max_attempts: int = MAIL_MAX_ATTEMPTS,
+                 backoff: float = MAIL_BACKOFF_SECONDS, idle_timeout: float = MAIL_IDLE_SECONDS) -> None:
+        """
+        The __init__ function creates the mailer of this worker.
+            Messages are queued and sent in the background by connections workers, each holding one SMTP session
+            open between messages. A worker takes up to batch_size queued messages at a time and sends them all
+            over its session, so a burst of mail does not pay a TCP and TLS handshake per message.
+            A message that fails with a temporary error is retried with exponential backoff, at most max_attempts times.
+        
+        :param self: Represent the instance of the class
+        :param hostname: str: The SMTP server
+        :param port: int: The SMTP port
+        :param username: str | None: The SMTP login, if the server wants one
+        :param password: str | None: The SMTP password
+        :param sender: str | None: The From address of messages that have none
+        :param use_tls: bool: Connect with implicit TLS, as on port 465
+        :param start_tls: bool | None: Upgrade with STARTTLS; None to use it when the server offers it
+        :param validate_certs: bool: Check the certificate of the server
+        :param connections: int: Number of SMTP sessions, and of workers
+        :param queue_size: int: Number of messages that may wait to be sent
+        :param batch_size: int: Number of messages a worker sends in one go
+        :param max_attempts: int: Number of times a message is tried before it is given up
+        :param backoff: float: Seconds to wait before the first retry; doubled for every further one
+        :param idle_timeout: float: Seconds after which an unused session is closed
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.smtp_options = dict(hostname=hostname, port=port, username=username, password=password,
+                                 use_tls=use_tls, start_tls=start_tls, validate_certs=validate_certs)
+        self.sender = sender
+        self.connections = connections
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.queue = None
+        self.loop = None
+        self.workers = []
+        self.retries = set()
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error = None
+        self.sessions_opened = 0
+        self.sessions_open = 0
+        self.batches = 0
+        self.send_total = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    async def start(self) -> None:
+        """
+        The start function binds the mailer to the running event loop and starts its workers.
+            Call it once per worker process at startup.
+        
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.connections)]
+
+    async def stop(self, timeout: float = 10) -> None:
+        """
+        The stop function waits up to timeout seconds for the queued messages, and those waiting for a retry,
+            to be sent, then stops the workers and closes their sessions. Messages still queued after that are lost.
+        
+        :param self: Represent the instance of the class
+        :param timeout: float: Seconds to wait for the queue to drain
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self.workers + list(self.retries):
+            task.cancel()
+        await asyncio.gather(*self.workers, *self.retries, return_exceptions=True)
+        self.workers = []
+        self.retries = set()
+        self.queue = None
+        self.loop = None
+
+    async def _drain(self) -> None:
+        # a message waiting for its retry is in neither the queue nor a worker
+        while True:
+            await self.queue.join()
+            if not self.retries:
+                return
+            await asyncio.wait(list(self.retries))
+
+    def enqueue(self, message: EmailMessage) -> bool:
+        """
+        The enqueue function queues a message to be sent in the background, from the event loop or from any thread,
+            e.g. a sync route running in the threadpool.
+        
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The message
+        :return: False if the mailer is not running or, on the event loop, if the queue is full
+        :doc-author: Trelent
+        """
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            with self.lock:
+                self.dropped += 1
+            return False
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            return self._put(OutgoingMail(message))
+        loop.call_soon_threadsafe(self._put, OutgoingMail(message))
+        return True
+
+    async def send(self, message: EmailMessage) -> None:
+        """
+        The send function queues a message like enqueue, but waits for room in the queue instead of dropping it,
+            and then until the message is sent, retries included. For callers that must know the outcome,
+            e.g. the outbox, which marks a message delivered only once the server took it.
+        
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The message
+        :return: Nothing; raises MailNotSent if the message was given up or the mailer is not running
+        :doc-author: Trelent
+        """
+        if self.queue is None:
+            raise MailNotSent("the mailer is not running", permanent=False)
+        mail = OutgoingMail(message, delivery=asyncio.get_running_loop().create_future())
+        self._set_sender(mail)
+        await self.queue.put(mail)
+        with self.lock:
+            self.enqueued += 1
+        error = await mail.delivery
+        if error is not None:
+            raise error
+
+    def _set_sender(self, mail: OutgoingMail) -> None:
+        if mail.message["From"] is None and self.sender:
+            mail.message["From"] = self.sender
+
+    def _put(self, mail: OutgoingMail) -> bool:
+        self._set_sender(mail)
+        try:
+            self.queue.put_nowait(mail)
+        except (asyncio.QueueFull, AttributeError):
+            with self.lock:
+                self.dropped += 1
+            self._resolve(mail, MailNotSent("the mail queue is full", permanent=False))
+            return False
+        if mail.attempts == 0:
+            with self.lock:
+                self.enqueued += 1
+        return True
+
+    async def _work(self) -> None:
+        smtp = None
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(self.queue.get(), self.idle_timeout if smtp is not None else None)
+                except asyncio.TimeoutError:
+                    smtp = await self._close(smtp)
+                    continue
+                batch = [first]
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                with self.lock:
+                    self.batches += 1
+                for mail in batch:
+                    smtp = await self._send(smtp, mail)
+                    self.queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    async def _send(self, smtp, mail: OutgoingMail):
+        mail.attempts += 1
+        started = time.perf_counter()
+        try:
+            if smtp is None:
+                client = aiosmtplib.SMTP(**self.smtp_options)
+                try:
+                    await client.connect()
+                except BaseException:
+                    # a failed connect or STARTTLS can leave the socket open; each retry would leak another one
+                    client.close()
+                    raise
+                smtp = client
+                with self.lock:
+                    self.sessions_opened += 1
+                    self.sessions_open += 1
+            await smtp.send_message(mail.message)
+        except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPSenderRefused) as error:
+            self._give_up(mail, error)
+        except aiosmtplib.SMTPResponseException as error:
+            if error.code >= 500:
+                self._give_up(mail, error)
+            else:
+                self._retry(mail)
+            smtp = await self._close(smtp)
+        except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError):
+            self._retry(mail)
+            smtp = await self._close(smtp)
+        else:
+            self._record_sent(mail, time.perf_counter() - started)
+        return smtp
+
+    async def _close(self, smtp) -> None:
+        # returns None, to be assigned to the session variable of the worker
+        if smtp is not None:
+            with self.lock:
+                self.sessions_open -= 1
+            try:
+                await smtp.quit()
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError):
+                smtp.close()
+        return None
+
+    def _retry(self, mail: OutgoingMail) -> None:
+        if mail.attempts >= self.max_attempts:
+            self._give_up(mail, None)
+            return
+        with self.lock:
+            self.retried += 1
+        delay = min(MAIL_MAX_BACKOFF_SECONDS, self.backoff * 2 ** (mail.attempts - 1)) * random.uniform(0.5, 1.0)
+
+        async def requeue():
+            await asyncio.sleep(delay)
+            self._put(mail)
+
+        task = asyncio.create_task(requeue())
+        self.retries.add(task)
+        task.add_done_callback(self.retries.discard)
+
+    def _give_up(self, mail: OutgoingMail, error) -> None:
+        with self.lock:
+            self.failed += 1
+            self.last_error = repr(error) if error is not None else f"gave up after {mail.attempts} attempts"
+            last_error = self.last_error
+        self._resolve(mail, MailNotSent(last_error, permanent=error is not None))
+
+    @staticmethod
+    def _resolve(mail: OutgoingMail, error: MailNotSent | None) -> None:
+        # the sender may have stopped waiting, which cancels the future
+        if mail.delivery is not None and not mail.delivery.done():
+            mail.delivery.set_result(error)
+
+    def _record_sent(self, mail: OutgoingMail, send_time: float) -> None:
+        latency = time.perf_counter() - mail.enqueued_at
+        with self.lock:
+            self.sent += 1
+            self.send_total += send_time
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.latency_histogram[bisect.bisect_left(WAIT_BUCKETS_MS, latency * 1000)] += 1
+        self._resolve(mail, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.latency_histogram)}
+            buckets["le_inf"] = self.latency_histogram[-1]
+            return {
+                "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+                "retrying": len(self.retries),
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "last_error": self.last_error,
+                "batches": self.batches,
+                "sessions_open": self.sessions_open,
+                "sessions_opened": self.sessions_opened,
+                "send_avg_ms": self.send_total / self.sent * 1000 if self.sent else 0.0,
+                "latency_avg_ms": self.latency_total / self.sent * 1000 if self.sent else 0.0,
+                "latency_max_ms": self.latency_max * 1000,
+                "latency_histogram": buckets,
+            }
+
+
+def render_message(recipient: str, subject: str, template_name: str | None = None, body: dict | None = None,
+                   text: str | None = None) -> EmailMessage:
+    """
+    The render_message function builds an email: a plain text one from text, or an html one from a template
+        of services/templates or templates, rendered with body.
+    
+    :param recipient: str: The address to send to
+    :param subject: str: The subject
+    :param template_name: str | None: The html template
+    :param body: dict | None: The variables of the template
+    :param text: str | None: The plain text content, without a template
+    :return: The message, without From; the mailer sets it
+    :doc-author: Trelent
+    """
+    message = EmailMessage()
+    message["To"] = recipient
+    message["Subject"] = subject
+    if template_name is None:
+        message.set_content(text or "")
+    else:
+        message.set_content(templates.get_template(template_name).render(**(body or {})), subtype="html")
+    return message
+
+
+def create_mailer() -> Mailer:
+    return Mailer(settings.mail_server, settings.mail_port, username=settings.mail_username,
+                  password=settings.mail_password, sender=settings.mail_from, use_tls=settings.mail_ssl_tls,
+                  connections=settings.mail_connections)
+
+
+mailer = create_mailer()
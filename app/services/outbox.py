@@ -0,0 +1,198 @@
+import asyncio
+import random
+import threading
+from datetime import datetime, timedelta
+
+from jinja2 import TemplateError
+
+from repository.outbox import AsyncOutboxRepo
+from services.mailer import Mailer, MailNotSent, mailer, render_message
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_SECONDS = 5.0
+# longer than the mailer may take over one message, retries and connection timeouts included
+OUTBOX_LEASE_SECONDS = 600
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_SECONDS = 30.0
+OUTBOX_MAX_BACKOFF_SECONDS = 3600.0
+
+
+class OutboxWorker():
+    def __init__(self, mailer: Mailer, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_SECONDS,
+                 lease: float = OUTBOX_LEASE_SECONDS, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff: float = OUTBOX_BACKOFF_SECONDS) -> None:
+        """
+        The __init__ function creates the outbox worker of this worker process.
+            It claims up to batch_size due rows of the email_outbox table at a time, sends them through mailer
+            and marks them delivered. Claimed rows are leased for lease seconds, so the workers of every process
+            can drain the table side by side without sending a row twice, and a row claimed by a process that died
+            is sent again once its lease runs out. A row that cannot be sent is tried again later with exponential
+            backoff, at most max_attempts times, or never again if the server refused it.
+        
+        :param self: Represent the instance of the class
+        :param mailer: Mailer: Sends the messages
+        :param batch_size: int: Number of rows claimed at a time
+        :param poll_interval: float: Seconds between looks at the table when nobody calls wake
+        :param lease: float: Seconds a claimed row is kept from the other workers
+        :param max_attempts: int: Number of times a row is claimed before it is given up
+        :param backoff: float: Seconds before a failed row is due again; doubled for every further attempt
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.mailer = mailer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.session_factory = None
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.claimed = 0
+        self.delivered = 0
+        self.rescheduled = 0
+        self.failed = 0
+        self.last_error = None
+
+    async def start(self, session_factory) -> None:
+        """
+        The start function binds the worker to the running event loop and starts draining the outbox.
+            Call it once per worker process at startup, after the mailer.
+        
+        :param self: Represent the instance of the class
+        :param session_factory: Opens the AsyncSession the worker uses
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.session_factory = session_factory
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10) -> None:
+        """
+        The stop function lets the worker finish the batch it is sending, for up to timeout seconds, and stops it.
+            Rows of an unfinished batch stay in the table and are sent again once their lease runs out.
+        
+        :param self: Represent the instance of the class
+        :param timeout: float: Seconds to wait for the current batch
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if self.task is None:
+            return
+        task, self.task = self.task, None
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.loop = None
+
+    def wake(self) -> None:
+        """
+        The wake function tells the worker that rows were committed to the outbox, so they are sent right away
+            instead of at the next poll. Safe to call from any thread, and a no-op when the worker is not running.
+        
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            self.wakeup.set()
+        else:
+            loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _run(self) -> None:
+        while self.task is not None:
+            self.wakeup.clear()
+            try:
+                claimed = await self.run_once()
+            except Exception as error:
+                # the database is unreachable; the rows are still there, try again at the next poll
+                with self.lock:
+                    self.last_error = repr(error)
+                claimed = 0
+            if claimed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """
+        The run_once function claims one batch of due rows, sends them all at once and records the outcome.
+        
+        :param self: Represent the instance of the class
+        :return: The number of rows claimed
+        :doc-author: Trelent
+        """
+        async with self.session_factory() as db:
+            repository = AsyncOutboxRepo(db)
+            rows = await repository.claim(self.batch_size, self.lease)
+            if not rows:
+                return 0
+            errors = await asyncio.gather(*(self._deliver(row) for row in rows))
+            delivered = [row["id"] for row, error in zip(rows, errors) if error is None]
+            await repository.mark_delivered(delivered)
+            rescheduled = failed = 0
+            for row, error in zip(rows, errors):
+                if error is None:
+                    continue
+                if error.permanent or row["attempts"] >= self.max_attempts:
+                    await repository.mark_failed(row["id"], error.error)
+                    failed += 1
+                else:
+                    await repository.reschedule(row["id"], error.error, self._retry_at(row["attempts"]))
+                    rescheduled += 1
+        with self.lock:
+            self.batches += 1
+            self.claimed += len(rows)
+            self.delivered += len(delivered)
+            self.rescheduled += rescheduled
+            self.failed += failed
+            if rescheduled or failed:
+                self.last_error = next(error.error for error in errors if error is not None)
+        return len(rows)
+
+    async def _deliver(self, row) -> MailNotSent | None:
+        try:
+            message = render_message(row["recipient"], row["subject"], template_name=row["template"],
+                                     body=row["body"], text=row["text"])
+        except TemplateError as error:
+            return MailNotSent(repr(error), permanent=True)
+        try:
+            await self.mailer.send(message)
+        except MailNotSent as error:
+            return error
+        return None
+
+    def _retry_at(self, attempts: int) -> datetime:
+        delay = min(OUTBOX_MAX_BACKOFF_SECONDS, self.backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        return datetime.utcnow() + timedelta(seconds=delay)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "running": self.task is not None,
+                "batches": self.batches,
+                "claimed": self.claimed,
+                "delivered": self.delivered,
+                "rescheduled": self.rescheduled,
+                "failed": self.failed,
+                "last_error": self.last_error,
+            }
+
+
+outbox = OutboxWorker(mailer)
@@ -0,0 +1,43 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(position: dict) -> str:
+    """
+    The encode_cursor function turns the position of the last row on a page into an opaque cursor.
+        The cursor is url-safe base64 of a compact JSON object, so clients can pass it back as a query parameter.
+
+    :param position: dict: The key columns of the last row on the page, e.g. {&quot;id&quot;: 42}
+    :return: An opaque cursor string
+    :doc-author: Trelent
+    """
+    raw = json.dumps(position, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> dict:
+    """
+    The decode_cursor function is the inverse of encode_cursor.
+        An empty cursor means the first page. A cursor that cannot be decoded raises an HTTPException with status code 400.
+
+    :param cursor: str | None: The cursor sent by the client
+    :return: The position dictionary stored in the cursor
+    :doc-author: Trelent
+    """
+    if not cursor:
+        return {}
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(position, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from conf.config import settings
+from depenedencies.pool_metrics import WAIT_BUCKETS_MS
+from repository.user import UserRepo
+
+HASH_SCHEME = "scrypt"
+# about 50 ms and 16 MiB per hash; n must be a power of two
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_KEY_LENGTH = 32
+SALT_LENGTH = 16
+
+
+class PasswordHasher():
+    def __init__(self, workers: int = 4, max_pending: int = 64, n: int = SCRYPT_N, r: int = SCRYPT_R,
+                 p: int = SCRYPT_P) -> None:
+        """
+        The __init__ function creates the password hasher of this worker.
+            Hashes are derived with scrypt on a pool of threads (hashlib releases the GIL while it works),
+            so neither the event loop nor the request threads burn CPU on them. At most workers hashes run
+            at once and max_pending more wait for a thread; past that, logins are refused with a 503
+            instead of queueing without bound.
+        
+        :param self: Represent the instance of the class
+        :param workers: int: Number of hashes computed at the same time
+        :param max_pending: int: Number of hashes that may wait for a free thread
+        :param n: int: scrypt CPU/memory cost of new hashes
+        :param r: int: scrypt block size of new hashes
+        :param p: int: scrypt parallelization of new hashes
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.workers = workers
+        self.n = n
+        self.r = r
+        self.p = p
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.upgraded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        # no password matches it; checking one costs as much as checking a real hash with the same parameters
+        self.dummy_hash = f"{HASH_SCHEME}${n}${r}${p}${'00' * SALT_LENGTH}${'00' * SCRYPT_KEY_LENGTH}"
+
+    def _submit(self, function, *args) -> Future:
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many logins in progress", headers={"Retry-After": "1"})
+        queued = time.perf_counter()
+        with self.lock:
+            self.pending += 1
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self._record(started - queued, time.perf_counter() - started)
+                self.slots.release()
+
+        try:
+            return self.executor.submit(task)
+        except BaseException:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+            raise
+
+    def _record(self, wait: float, run: float) -> None:
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.run_total += run
+            self.wait_histogram[bisect.bisect_left(WAIT_BUCKETS_MS, wait * 1000)] += 1
+
+    def _derive(self, password: str) -> str:
+        salt = os.urandom(SALT_LENGTH)
+        key = hashlib.scrypt(password.encode(), salt=salt, n=self.n, r=self.r, p=self.p,
+                             maxmem=256 * self.n * self.r + 1024 * 1024, dklen=SCRYPT_KEY_LENGTH)
+        return f"{HASH_SCHEME}${self.n}${self.r}${self.p}${salt.hex()}${key.hex()}"
+
+    @staticmethod
+    def _check(password: str, stored: str) -> bool:
+        try:
+            _, n, r, p, salt, key = stored.split("$")
+            n, r, p, salt, key = int(n), int(r), int(p), bytes.fromhex(salt), bytes.fromhex(key)
+        except ValueError:
+            return False
+        derived = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                                 maxmem=256 * n * r + 1024 * 1024, dklen=len(key))
+        return hmac.compare_digest(derived, key)
+
+    def _check_any(self, password: str, stored: str | None, salt: str | None) -> bool:
+        if stored is None or self.needs_upgrade(stored):
+            # a legacy hash is cheap and a missing password costs nothing; one scrypt on the dummy hash makes
+            # them as slow as a scrypt hash, so the time of a login does not tell which accounts have not migrated
+            self._check(password, self.dummy_hash)
+            return stored is not None and self._check_legacy(password, stored, salt)
+        return self._check(password, stored)
+
+    @staticmethod
+    def _check_legacy(password: str, stored: str, salt: str | None) -> bool:
+        if not salt:
+            return False
+        derived, _ = UserRepo.hash_password(password, salt)
+        return hmac.compare_digest(derived, stored)
+
+    @staticmethod
+    def needs_upgrade(stored: str | None) -> bool:
+        """
+        The needs_upgrade function tells whether a stored password is a legacy salted SHA-256 hash,
+            which should be replaced by a scrypt hash the next time the user logs in.
+        
+        :param stored: str | None: The password column of the user
+        :return: True for a legacy hash, False for a scrypt hash or no password at all
+        :doc-author: Trelent
+        """
+        return stored is not None and not stored.startswith(HASH_SCHEME + "$")
+
+    def hash(self, password: str) -> str:
+        """
+        The hash function derives the hash to store for a new password, on the hashing pool.
+            Meant for sync code; the calling thread waits for the result.
+        
+        :param self: Represent the instance of the class
+        :param password: str: The plain password
+        :return: The hash, with the scrypt parameters and salt it was made with
+        :doc-author: Trelent
+        """
+        return self._submit(self._derive, password).result()
+
+    async def ahash(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(self._derive, password))
+
+    def verify(self, password: str, stored: str | None, salt: str | None = None) -> bool:
+        """
+        The verify function checks a password against the stored hash of the user, on the hashing pool.
+            Legacy SHA-256 hashes, with their salt column, and users without a password take as long as
+            a scrypt hash: they are checked next to a scrypt of the dummy hash.
+        
+        :param self: Represent the instance of the class
+        :param password: str: The plain password
+        :param stored: str | None: The password column of the user
+        :param salt: str | None: The salt column of the user, used by legacy hashes only
+        :return: True if the password matches
+        :doc-author: Trelent
+        """
+        return self._submit(self._check_any, password, stored, salt).result()
+
+    async def averify(self, password: str, stored: str | None, salt: str | None = None) -> bool:
+        return await asyncio.wrap_future(self._submit(self._check_any, password, stored, salt))
+
+    def record_upgrade(self) -> None:
+        with self.lock:
+            self.upgraded += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_histogram)}
+            buckets["le_inf"] = self.wait_histogram[-1]
+            return {
+                "scheme": HASH_SCHEME,
+                "workers": self.workers,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "upgraded": self.upgraded,
+                "wait_avg_ms": self.wait_total / self.completed * 1000 if self.completed else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+                "run_avg_ms": self.run_total / self.completed * 1000 if self.completed else 0.0,
+                "wait_histogram": buckets,
+            }
+
+
+password_hasher = PasswordHasher(workers=settings.password_hash_workers,
+                                 max_pending=settings.password_hash_max_pending)
@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter():
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        """
+        The __init__ function creates an empty Bloom filter sized for capacity items at the given false positive rate.
+            A Bloom filter never misses an item that was added, but may claim an item it never saw;
+            the odds of that stay near error_rate until more than capacity items are added.
+        
+        :param self: Represent the instance of the class
+        :param capacity: int: Number of items the filter is sized for
+        :param error_rate: float: Wanted false positive rate
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class MemoryRevocationStore():
+    def __init__(self) -> None:
+        """
+        The __init__ function creates a revocation store that lives in this worker only.
+            Revoked token ids are kept until the token would have expired anyway.
+        
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, jti: str, expires_at: float) -> None:
+        with self.lock:
+            self.entries[jti] = expires_at
+
+    def contains(self, jti: str) -> bool:
+        expires_at = self.entries.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def all(self) -> list[str]:
+        now = time.time()
+        with self.lock:
+            for jti in [jti for jti, expires_at in self.entries.items() if expires_at <= now]:
+                del self.entries[jti]
+            return list(self.entries)
+
+
+class RedisRevocationStore():
+    def __init__(self, client, prefix: str = "revoked:") -> None:
+        """
+        The __init__ function creates a revocation store in Redis, shared by all workers.
+            Every revoked token id is a key that Redis expires together with the token.
+        
+        :param self: Represent the instance of the class
+        :param client: A redis.Redis client, or anything with the same set/exists/scan_iter methods
+        :param prefix: str: Prefix of every key written to Redis
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def add(self, jti: str, expires_at: float) -> None:
+        self.client.set(self.prefix + jti, 1, ex=max(1, math.ceil(expires_at - time.time())))
+
+    def contains(self, jti: str) -> bool:
+        return bool(self.client.exists(self.prefix + jti))
+
+    def all(self) -> list[str]:
+        jtis = []
+        for key in self.client.scan_iter(match=self.prefix + "*", count=1000):
+            key = key.decode() if isinstance(key, bytes) else key
+            jtis.append(key[len(self.prefix):])
+        return jtis
+
+
+class RevocationList():
+    def __init__(self, store, capacity: int = 100000, error_rate: float = 0.001, rebuild_interval: float = 30,
+                 errors=(Exception,), fail_closed: bool = True) -> None:
+        """
+        The __init__ function creates the list of revoked access tokens that decode_jwt_token checks.
+            A Bloom filter of the revoked token ids answers for almost every token without asking the store:
+            only the ids the filter claims to know are looked up, to rule out false positives.
+            Once started, a background task rebuilds the filter from the store every rebuild_interval seconds,
+            which picks up the revocations of other workers when the store is shared and forgets the tokens
+            that have expired since; requests never wait for a rebuild.
+            When the store cannot be reached, a token the filter knows is taken as revoked with fail_closed
+            and as valid without; tokens the filter does not know are valid either way, and a failed
+            rebuild keeps the previous filter.
+        
+        :param self: Represent the instance of the class
+        :param store: The MemoryRevocationStore or RedisRevocationStore holding the revoked ids
+        :param capacity: int: Number of revoked tokens the filter is sized for at least
+        :param error_rate: float: False positive rate of the filter
+        :param rebuild_interval: float: Number of seconds between two rebuilds of the filter
+        :param errors: The exceptions that mean the store is unreachable
+        :param fail_closed: bool: Refuse the tokens the filter knows while the store is unreachable
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.store = store
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.errors = errors
+        self.fail_closed = fail_closed
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+        # revoked here while a rebuild reads the store, which may be too late for it to see them
+        self.recent = []
+        self.filter = BloomFilter(capacity, error_rate)
+        self.task = None
+        self.checks = 0
+        self.store_lookups = 0
+        self.false_positives = 0
+        self.store_errors = 0
+        self.rebuilds = 0
+        self.last_error = None
+
+    async def start(self) -> None:
+        """
+        The start function starts the background task that rebuilds the filter. Call it once per worker at startup.
+        
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.task = asyncio.create_task(self._refresh())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _refresh(self) -> None:
+        while True:
+            try:
+                # a rebuild scans the whole store; it runs in the threadpool, not on the event loop
+                await run_in_threadpool(self.rebuild)
+            except self.errors as error:
+                self._store_failed("rebuild", error)
+            await asyncio.sleep(self.rebuild_interval)
+
+    def _store_failed(self, operation: str, error: Exception) -> None:
+        self.store_errors += 1
+        self.last_error = repr(error)
+        logger.warning("token revocation store %s failed: %r", operation, error)
+
+    def revoke(self, jti: str, expires_at: float) -> None:
+        """
+        The revoke function revokes the token with the id jti until expires_at, its exp claim.
+        
+        :param self: Represent the instance of the class
+        :param jti: str: The jti claim of the token
+        :param expires_at: float: The exp claim of the token, as a unix timestamp
+        :return: Nothing; raises an HTTPException with status 503 if the store cannot be reached
+        :doc-author: Trelent
+        """
+        try:
+            self.store.add(jti, expires_at)
+        except self.errors as error:
+            # only this worker would know; the client has to try again
+            self._store_failed("revoke", error)
+            self._remember(jti)
+            raise HTTPException(status_code=503, detail="Could not revoke the token", headers={"Retry-After": "1"})
+        # after the store: a rebuild that starts in between reads the jti from the store, one that started
+        # before clears recent before this, so the jti is either in its snapshot or in recent
+        self._remember(jti)
+
+    async def arevoke(self, jti: str, expires_at: float) -> None:
+        await run_in_threadpool(self.revoke, jti, expires_at)
+
+    def _remember(self, jti: str) -> None:
+        with self.lock:
+            self.filter.add(jti)
+            self.recent.append(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        """
+        The is_revoked function tells whether the token with the id jti was revoked.
+            Only the ids the filter knows are looked up in the store, in the calling thread; async code uses ais_revoked.
+        
+        :param self: Represent the instance of the class
+        :param jti: str: The jti claim of the token
+        :return: True if the token was revoked
+        :doc-author: Trelent
+        """
+        self.checks += 1
+        if jti not in self.filter:
+            return False
+        return self._lookup(jti)
+
+    async def ais_revoked(self, jti: str) -> bool:
+        self.checks += 1
+        if jti not in self.filter:
+            return False
+        return await run_in_threadpool(self._lookup, jti)
+
+    def _lookup(self, jti: str) -> bool:
+        self.store_lookups += 1
+        try:
+            if self.store.contains(jti):
+                return True
+        except self.errors as error:
+            self._store_failed("lookup", error)
+            return self.fail_closed
+        self.false_positives += 1
+        return False
+
+    def rebuild(self, blocking: bool = True) -> None:
+        """
+        The rebuild function replaces the Bloom filter with a new one built from the store.
+            Without blocking it returns at once if another thread is already rebuilding.
+        
+        :param self: Represent the instance of the class
+        :param blocking: bool: Wait for a rebuild that is already running
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if not self.rebuild_lock.acquire(blocking=blocking):
+            return
+        try:
+            with self.lock:
+                self.recent = []
+            jtis = self.store.all()
+            new_filter = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+            for jti in jtis:
+                new_filter.add(jti)
+            with self.lock:
+                for jti in self.recent:
+                    new_filter.add(jti)
+                self.filter = new_filter
+            self.rebuilds += 1
+        finally:
+            self.rebuild_lock.release()
+
+    def stats(self) -> dict:
+        return {"backend": "redis" if isinstance(self.store, RedisRevocationStore) else "memory",
+                "checks": self.checks, "store_lookups": self.store_lookups,
+                "false_positives": self.false_positives, "rebuilds": self.rebuilds,
+                "store_errors": self.store_errors, "last_error": self.last_error, "fail_closed": self.fail_closed,
+                "filter_items": self.filter.count, "filter_bits": self.filter.size}
+
+
+def create_revocation_list() -> RevocationList:
+    """
+    The create_revocation_list function builds the revocation list selected by settings.token_revocation_backend:
+        "memory" keeps the revoked tokens in this worker, "redis" shares them between all workers
+        through redis_host/redis_port.
+        With "memory" a logout only revokes the token in the worker that handled it, so it is refused
+        when the server runs several workers (WEB_CONCURRENCY, as read by uvicorn and gunicorn, above 1).
+    
+    :return: A RevocationList
+    :doc-author: Trelent
+    """
+    if settings.token_revocation_backend == "redis":
+        import redis
+
+        store = RedisRevocationStore(redis.Redis(host=settings.redis_host, port=settings.redis_port,
+                                                 socket_timeout=settings.token_revocation_redis_timeout,
+                                                 socket_connect_timeout=settings.token_revocation_redis_timeout))
+        errors = (redis.RedisError,)
+    else:
+        if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+            raise RuntimeError("token_revocation_backend 'memory' revokes tokens in one worker only; "
+                               "use 'redis' when running several workers")
+        store = MemoryRevocationStore()
+        errors = ()
+    return RevocationList(store, capacity=settings.token_revocation_capacity,
+                          error_rate=settings.token_revocation_error_rate,
+                          rebuild_interval=settings.token_revocation_rebuild_seconds,
+                          errors=errors, fail_closed=settings.token_revocation_fail_closed)
+
+
+revoked_tokens = create_revocation_list()
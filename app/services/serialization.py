@@ -0,0 +1,76 @@
+import enum
+import json
+from datetime import date, datetime
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional, the stdlib encoder gives the same output
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - without msgpack every client gets JSON
+    msgpack = None
+
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def encode_default(value: Any) -> Any:
+    """
+    The encode_default function converts the values the encoders do not know natively.
+        Dates are written as ISO 8601 strings in JSON and in MessagePack alike,
+        so both representations of a todo carry exactly the same data.
+    
+    :param value: Any: The value to convert
+    :return: A value the encoder can write
+    :doc-author: Trelent
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps_json(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=encode_default)
+    return json.dumps(content, default=encode_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, default=encode_default, use_bin_type=True, datetime=False)
+
+
+def prefers_msgpack(accept: str | None) -> bool:
+    """
+    The prefers_msgpack function tells whether a client asked for MessagePack in its Accept header.
+        MessagePack is only chosen when it is listed explicitly with a quality at least as high as JSON's,
+        so browsers and clients that send */* keep getting JSON. It is never chosen when msgpack is not installed.
+    
+    :param accept: str | None: The Accept header of the request
+    :return: True if the response should be encoded as MessagePack
+    :doc-author: Trelent
+    """
+    if not accept or msgpack is None:
+        return False
+    msgpack_quality, json_quality = 0.0, 0.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.lower()
+        if media_type in MSGPACK_MEDIA_TYPES:
+            msgpack_quality = max(msgpack_quality, quality)
+        elif media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            json_quality = max(json_quality, quality)
+    return msgpack_quality > 0 and msgpack_quality >= json_quality
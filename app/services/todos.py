@@ -1,9 +1,46 @@
-from repository.todos import TodoRepo
-from schemas.todo import Todo, TodoCreate
+import csv
+import io
+import json
+import calendar
+import logging
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from conf.config import settings
+from models.todo import birthday_key
+from repository.todos import TodoRepo, AsyncTodoRepo
+from services.cache import create_cache
+from services.etag import make_etag
+from services.events import create_change_hub, make_event
+from services.serialization import dumps_msgpack, msgpack, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPES
+from schemas.todo import Todo, TodoCreate, TodoUpdate, TodoPage, TodoFilter, TodoSort, ExportFormat, TodoBulkError, TodoBulkResult, TodoBulkUpdate, TodoBulkUpdateResult
+from services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
+
+
+MAX_BULK_SIZE = 10000
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ("id", "name", "surname", "email", "phone", "birthday", "is_done", "description")
+TODO_FIELDS = EXPORT_COLUMNS + ("updated_at",)
+# description can be long and most list consumers never show it, so lists leave it out unless asked for
+LIST_FIELDS = tuple(field for field in TODO_FIELDS if field != "description")
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.MSGPACK: MSGPACK_MEDIA_TYPES[0],
+}
+
+
+logger = logging.getLogger(__name__)
+
+todo_cache = create_cache(Todo, prefix="todo:")
+todo_events = create_change_hub()
 
 
 class TodoService():
-    def __init__(self, db) -> None:
+    def __init__(self, db, cache=None, events=None) -> None:
         """
         The __init__ function is the constructor for a class.
         It's called when an instance of the class is created.
@@ -13,28 +50,274 @@ class TodoService():
         
         :param self: Represent the instance of the class
         :param db: Pass the database connection to the repository
+        :param cache: The cache of todo items by id, the module-wide todo_cache by default
+        :param events: The ChangeHub that gets the todo events, the module-wide todo_events by default
         :return: Nothing, so it returns none
         :doc-author: Trelent
         """
         self.repository = TodoRepo(db=db)
+        self.cache = cache if cache is not None else todo_cache
+        self.events = events if events is not None else todo_events
+
+    def get_all_todos(self, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+                      todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID) -> TodoPage:
+        """
+        The get_all_todos function returns one page of todos matching the filter, in the requested order.
+            Pages are addressed with a keyset cursor on (sort column, id) instead of an offset, so every page
+            is a single index range scan no matter how deep the client goes.
+        
+        :param self: Represent the instance of the class
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param todo_filter: TodoFilter | None: Only return todos matching these conditions
+        :param sort: TodoSort: One of the whitelisted, index-backed orderings
+        :return: A page of todo objects and the cursor of the next page
+        :doc-author: Trelent
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after_key = self._decode_position(after, sort)
+        # one extra row tells us whether there is a next page without a COUNT query
+        todos_from_db = self.repository.get_all(todo_filter=todo_filter, sort=sort, after=after_key, limit=limit + 1)
+        return self._build_page(todos_from_db, limit, sort)
+
+    @staticmethod
+    def _build_page(todos_from_db: list, limit: int, sort: TodoSort) -> TodoPage:
+        has_more = len(todos_from_db) > limit
+        todos_from_db = todos_from_db[:limit]
+        next_cursor = TodoService._encode_position(todos_from_db[-1], sort) if has_more else None
+        return TodoPage(items=[Todo.from_orm(item) for item in todos_from_db], next_cursor=next_cursor)
+
+    def get_page_rows(self, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+                      todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                      fields: tuple[str, ...] = TODO_FIELDS) -> dict:
+        """
+        The get_page_rows function returns the same page as get_all_todos, but as plain dictionaries.
+            The rows are read as column tuples and never go through the ORM or pydantic, so the result
+            can be encoded straight to JSON by the route without validating every item again.
+            Only the columns in fields are selected, plus the sort column the cursor needs.
+        
+        :param self: Represent the instance of the class
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param todo_filter: TodoFilter | None: Only return todos matching these conditions
+        :param sort: TodoSort: One of the whitelisted, index-backed orderings
+        :param fields: tuple[str, ...]: The fields of the items, from parse_fields
+        :return: A dictionary with the items of the page and the cursor of the next page
+        :doc-author: Trelent
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after_key = self._decode_position(after, sort)
+        rows = self.repository.get_all_rows(todo_filter=todo_filter, sort=sort, after=after_key, limit=limit + 1,
+                                            columns=self._row_columns(fields, sort))
+        return self._build_row_page(rows, limit, sort, fields)
+
+    @staticmethod
+    def _row_columns(fields: tuple[str, ...], sort: TodoSort) -> tuple[str, ...]:
+        return fields if sort.column in fields else fields + (sort.column,)
+
+    @staticmethod
+    def _build_row_page(rows: list, limit: int, sort: TodoSort, fields: tuple[str, ...] = TODO_FIELDS) -> dict:
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = TodoService._encode_position(rows[-1], sort) if has_more else None
+        if sort.column in fields:
+            items = [row._asdict() for row in rows]
+        else:
+            items = [{field: getattr(row, field) for field in fields} for row in rows]
+        return {"items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def parse_fields(fields: str | None, default: tuple[str, ...] = TODO_FIELDS) -> tuple[str, ...]:
+        """
+        The parse_fields function turns the fields query parameter into the tuple of fields to read and return.
+            The value is a comma separated list of Todo fields; id is always included, because it is
+            what identifies an item and what the cursors are built from.
+        
+        :param fields: str | None: The fields query parameter, None or empty for the default
+        :param default: tuple[str, ...]: The fields to use when none are given
+        :return: The requested fields in the order of the Todo schema
+        :doc-author: Trelent
+        """
+        if not fields or not fields.strip():
+            return default
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested.difference(TODO_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        requested.add("id")
+        return tuple(field for field in TODO_FIELDS if field in requested)
+
+    @staticmethod
+    def _item_fields(item, fields: tuple[str, ...]) -> dict:
+        return {field: getattr(item, field) for field in fields}
+
+    def get_list_etag(self, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+                      todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                      fields: tuple[str, ...] = TODO_FIELDS, media_type: str = JSON_MEDIA_TYPE) -> str:
+        """
+        The get_list_etag function returns the ETag of the page that get_all_todos would return for the same arguments.
+            It only reads the id and updated_at of the rows on the page, so a client that already has
+            the page can be answered with 304 Not Modified without loading or serializing the todos.
+        
+        :param self: Represent the instance of the class
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param todo_filter: TodoFilter | None: Only return todos matching these conditions
+        :param sort: TodoSort: One of the whitelisted, index-backed orderings
+        :param fields: tuple[str, ...]: The fields of the items, pages with other fields get another ETag
+        :param media_type: str: The media type of the response; every representation has its own strong ETag
+        :return: The ETag of the page
+        :doc-author: Trelent
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after_key = self._decode_position(after, sort)
+        versions = self.repository.get_page_versions(todo_filter=todo_filter, sort=sort, after=after_key, limit=limit + 1)
+        return make_etag(media_type, sort.value, limit, fields, [(id, updated_at) for id, updated_at in versions])
+
+    @staticmethod
+    def get_etag(todo_item: Todo, fields: tuple[str, ...] = TODO_FIELDS, media_type: str = JSON_MEDIA_TYPE) -> str:
+        """
+        The get_etag function returns the ETag of a single todo item, built from its id and updated_at.
+        
+        :param todo_item: Todo: The todo item
+        :param fields: tuple[str, ...]: The fields sent to the client, a narrowed item gets another ETag
+        :param media_type: str: The media type of the response; every representation has its own strong ETag
+        :return: The ETag of the todo item
+        :doc-author: Trelent
+        """
+        if fields == TODO_FIELDS:
+            return make_etag(media_type, todo_item.id, todo_item.updated_at)
+        return make_etag(media_type, todo_item.id, todo_item.updated_at, fields)
 
-    def get_all_todos(self) -> list[Todo]:
+    def search(self, q: str, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+               fields: tuple[str, ...] = TODO_FIELDS) -> dict:
         """
-        The get_all_todos function returns a list of all todos in the database.
-            :return: A list of Todo objects, each representing a single todo item.
+        The search function returns one page of todos whose name, surname or description match the query, best match first.
+            Paging works like get_all_todos: pass the next_cursor of a page as after to get the following page.
+            Only the columns in fields are loaded, and the items are returned as dictionaries of those fields.
         
+        :param self: Represent the instance of the class
+        :param q: str: The words to search for
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param fields: tuple[str, ...]: The fields of the items, from parse_fields
+        :return: A dictionary with the items of the page and the cursor of the next page
+        :doc-author: Trelent
+        """
+        if not q.strip():
+            return {"items": [], "next_cursor": None}
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        position = decode_cursor(after)
+        after_key = None
+        if position:
+            after_rank, after_id = position.get("k"), position.get("id")
+            if position.get("s") != "rank" or not isinstance(after_rank, (int, float)) or not isinstance(after_id, int):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            after_key = (after_rank, after_id)
+        found = self.repository.search(q, after=after_key, limit=limit + 1, columns=fields)
+        has_more = len(found) > limit
+        found = found[:limit]
+        next_cursor = None
+        if has_more:
+            last_item, last_rank = found[-1]
+            next_cursor = encode_cursor({"s": "rank", "id": last_item.id, "k": last_rank})
+        return {"items": [self._item_fields(item, fields) for item, _ in found], "next_cursor": next_cursor}
+
+    def get_changes(self, since: str | None = None, limit: int = MAX_PAGE_SIZE) -> dict:
+        """
+        The get_changes function returns the todos created, modified or deleted after the sync token since.
+            Changes come in (updated_at, id) order, at most limit per call, and next_token always moves forward:
+            store it and pass it back as since for the next call, and keep calling while has_more is true.
+            Without a token the client gets every live todo, which is how a client does its first sync.
+            updated_at is stamped when a write runs, not when it commits, so the changes of the last
+            settings.sync_settle_seconds are held back until concurrent writes have committed. A write that commits
+            later than that after stamping its rows is missed by the clients whose token already moved past them;
+            every write here is one statement committed right away, keep the window above the longest such gap.
+            Tombstones are purged after settings.sync_tombstone_retention_days, so a token older than that
+            is refused with 410 and the client has to sync in full again.
         
         :param self: Represent the instance of the class
-        :return: A list of todo objects
+        :param since: str | None: The next_token of the previous call, or None for a full sync
+        :param limit: int: Maximum number of changes to return, capped at MAX_PAGE_SIZE
+        :return: A dictionary with the changed todos, the ids of deleted todos, the next token and has_more
         :doc-author: Trelent
         """
-        all_todos_from_db = self.repository.get_all() # list[TodoDB]
-        result = [Todo.from_orm(item) for item in all_todos_from_db]
-        return result
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after, synced_at = self._decode_sync_token(since)
+        until = datetime.utcnow() - timedelta(seconds=settings.sync_settle_seconds)
+        # a client without a token has nothing to delete, so the full sync skips the tombstones
+        rows = self.repository.get_changes(after, until, limit + 1, include_deleted=after is not None)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        changed, deleted = [], []
+        for row in rows:
+            if row.deleted_at is None:
+                changed.append({field: getattr(row, field) for field in TODO_FIELDS})
+            else:
+                deleted.append(row.id)
+        # at is when the client was last up to date: until once it has everything, else where its sync began
+        if not has_more or synced_at is None:
+            synced_at = until
+        next_token = since
+        if rows:
+            next_token = self._encode_sync_token(rows[-1].updated_at, rows[-1].id, synced_at)
+        elif after is not None:
+            next_token = self._encode_sync_token(after[0], after[1], synced_at)
+        return {"changed": changed, "deleted": deleted, "next_token": next_token, "has_more": has_more}
+
+    @staticmethod
+    def _encode_sync_token(updated_at: datetime, id: int, synced_at: datetime) -> str:
+        return encode_cursor({"s": "sync", "t": updated_at.isoformat(), "id": id, "at": synced_at.isoformat()})
+
+    @staticmethod
+    def _decode_sync_token(token: str | None) -> tuple:
+        # the (updated_at, id) position in the change feed and the at time of the token, or None, None
+        position = decode_cursor(token)
+        if not position:
+            return None, None
+        after_id = position.get("id")
+        if position.get("s") != "sync" or not isinstance(after_id, int) or not isinstance(position.get("t"), str):
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+        try:
+            after = datetime.fromisoformat(position["t"])
+            synced_at = datetime.fromisoformat(position.get("at", position["t"]))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+        if synced_at < datetime.utcnow() - timedelta(days=settings.sync_tombstone_retention_days):
+            raise HTTPException(status_code=410, detail="Sync token expired, sync again without a token")
+        return (after, after_id), synced_at
+
+    @staticmethod
+    def _encode_position(item, sort: TodoSort) -> str:
+        position = {"s": sort.value, "id": item.id}
+        if sort.column != "id":
+            position["k"] = getattr(item, sort.column)
+        return encode_cursor(position)
+
+    @staticmethod
+    def _decode_position(cursor: str | None, sort: TodoSort) -> tuple | None:
+        position = decode_cursor(cursor)
+        if not position:
+            return None
+        after_id = position.get("id")
+        if position.get("s", TodoSort.ID.value) != sort.value or not isinstance(after_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if sort.column == "id":
+            return (after_id,)
+        key = position.get("k")
+        try:
+            if sort.column == "birthday":
+                key = date.fromisoformat(key)
+            elif not isinstance(key, str):
+                raise ValueError(key)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return key, after_id
 
     def create_new(self, todo_item: TodoCreate) -> Todo:
         """
         The create_new function creates a new todo item.
+            The id of a deleted todo can be used again; the id of a live one is refused with 409.
             Args:
                 todo_item (TodoCreate): The TodoCreate object containing the data for the new item.
             Returns:
@@ -45,19 +328,355 @@ class TodoService():
         :return: A todo object
         :doc-author: Trelent
         """
-        new_item_from_db = self.repository.create(todo_item)
-        todo_item = Todo.from_orm(new_item_from_db)
+        events, notify = self._notifier(lambda row: [make_event("created", row["id"], Todo(**row).dict())])
+        new_row = self.repository.create(todo_item, notify=notify)
+        if new_row is None:
+            raise HTTPException(status_code=409, detail="Todo item already exists")
+        todo_item = Todo(**new_row)
+        self._invalidate(todo_item.id)
+        self._publish(events)
         return todo_item
 
+    def create_many(self, raw_items: list[dict]) -> TodoBulkResult:
+        """
+        The create_many function creates many todo items with a single batched insert.
+            Every item is validated on its own, so an invalid item, or one whose id belongs to a live todo, is reported
+            in the result instead of rejecting the whole request. All new items are written in one transaction.
+        
+        :param self: Represent the instance of the class
+        :param raw_items: list[dict]: The raw todo items from the request body
+        :return: The ids of the created items and the errors of the rejected ones
+        :doc-author: Trelent
+        """
+        valid_items = []
+        valid_indexes = []
+        errors = []
+        seen_ids = set()
+        for index, raw_item in enumerate(raw_items):
+            try:
+                todo_item = TodoCreate.parse_obj(raw_item)
+            except ValidationError as err:
+                errors.append(TodoBulkError(index=index, errors=err.errors(include_url=False, include_context=False)))
+                continue
+            if todo_item.id in seen_ids:
+                errors.append(TodoBulkError(index=index, errors=[{"loc": ["id"], "msg": "Duplicate id in request", "type": "value_error"}]))
+                continue
+            seen_ids.add(todo_item.id)
+            valid_items.append(todo_item)
+            valid_indexes.append(index)
+        events, notify = self._notifier(lambda ids: [make_event("created", id) for id in ids])
+        created_ids = self.repository.create_many(valid_items, notify=notify)
+        created = set(created_ids)
+        errors.extend(TodoBulkError(index=index, errors=[{"loc": ["id"], "msg": "Todo item already exists", "type": "value_error"}])
+                      for index, todo_item in zip(valid_indexes, valid_items) if todo_item.id not in created)
+        errors.sort(key=lambda error: error.index)
+        self._invalidate(*created_ids)
+        self._publish(events)
+        return TodoBulkResult(created_ids=created_ids, errors=errors)
+
     def get_by_id(self, id: int) -> Todo:
         """
         The get_by_id function returns a Todo object with the given id.
-            
+            The item is read through the todo cache, so only a cache miss reaches the database.
         
         :param self: Represent the instance of the class
         :param id: int: Specify the id of the todo item we want to get
         :return: The todo object
         :doc-author: Trelent
         """
+        if self.cache is not None:
+            cached_item = self.cache.get(str(id))
+            if cached_item is not None:
+                return cached_item
         todo_item = self.repository.get_by_id(id)
-        return Todo.from_orm(todo_item)
\ No newline at end of file
+        if todo_item is None:
+            raise HTTPException(status_code=404, detail="Todo item not found")
+        todo_item = Todo.from_orm(todo_item)
+        if self.cache is not None:
+            self.cache.set(str(id), todo_item)
+        return todo_item
+
+    def _invalidate(self, *ids: int) -> None:
+        if self.cache is not None and ids:
+            self.cache.delete(*[str(id) for id in ids])
+
+    def _notifier(self, make_events: Callable) -> tuple[list[dict], Callable]:
+        # the events of a write: notify builds them from the written rows and queues them in the write
+        # transaction, see ChangeHub.notify; _publish hands the same events over once the write has committed
+        events = []
+
+        def notify(written) -> None:
+            events.extend(make_events(written))
+            if self.events is not None:
+                self.events.notify(events, db=self.repository.db)
+
+        return events, notify
+
+    def _publish(self, events: list[dict]) -> None:
+        if self.events is None:
+            return
+        try:
+            self.events.publish(events)
+        except Exception:
+            # the write has committed; subscribers that miss the event catch up through GET /todo/changes
+            logger.exception("publishing %d todo events failed", len(events))
+
+    def cache_stats(self) -> dict:
+        """
+        The cache_stats function returns the hit, miss and eviction counters of the todo cache.
+        
+        :param self: Represent the instance of the class
+        :return: A dictionary of counters, or {&quot;backend&quot;: &quot;none&quot;} if caching is disabled
+        :doc-author: Trelent
+        """
+        if self.cache is None:
+            return {"backend": "none"}
+        return self.cache.stats()
+
+    def get_upcoming_birthdays(self, days: int, today: date | None = None, limit: int = MAX_PAGE_SIZE,
+                               fields: tuple[str, ...] = TODO_FIELDS) -> list[dict]:
+        """
+        The get_upcoming_birthdays function returns todos whose birthday falls within the next days days, today included.
+            The dates are turned into at most two ranges of birthday_key (two when the window crosses the new year),
+            so the lookup is an index range scan. In a non-leap year people born on 29 February are listed on 28 February.
+        
+        :param self: Represent the instance of the class
+        :param days: int: Length of the window after today
+        :param today: date | None: First day of the window, today by default
+        :param limit: int: Maximum number of todos to return
+        :param fields: tuple[str, ...]: The fields of the items, only these columns are loaded
+        :return: The todos ordered by their next birthday, as dictionaries of the requested fields
+        :doc-author: Trelent
+        """
+        key_ranges = self.birthday_key_ranges(today or date.today(), days)
+        todos_from_db = self.repository.get_by_birthday_keys(key_ranges, limit=limit, columns=fields)
+        return [self._item_fields(item, fields) for item in todos_from_db]
+
+    @staticmethod
+    def birthday_key_ranges(today: date, days: int) -> list[tuple[int, int]]:
+        if days >= 365:
+            return [(birthday_key(today), 1231), (101, birthday_key(today) - 1)]
+        last_day = today + timedelta(days=days)
+        start, end = birthday_key(today), birthday_key(last_day)
+        if last_day.month == 2 and last_day.day == 28 and not calendar.isleap(last_day.year):
+            end = 229
+        if start <= end and today.year == last_day.year:
+            return [(start, end)]
+        return [(start, 1231), (101, end)]
+
+    def update(self, id: int, todo_item: TodoUpdate) -> Todo:
+        """
+        The update function changes only the fields that were sent in the request.
+            It runs a single UPDATE ... RETURNING statement, so the row is never read before it is written.
+            Fields that are missing or null in the request keep their current value.
+        
+        :param self: Represent the instance of the class
+        :param id: int: Specify the id of the todo item to update
+        :param todo_item: TodoUpdate: The fields to change
+        :return: The updated todo object
+        :doc-author: Trelent
+        """
+        values = todo_item.dict(exclude_unset=True, exclude_none=True)
+        if not values:
+            return self.get_by_id(id)
+        events, notify = self._notifier(lambda row: [make_event("updated", id, Todo(**row).dict())])
+        updated_row = self.repository.update(id, values, notify=notify)
+        self._invalidate(id)
+        if updated_row is None:
+            raise HTTPException(status_code=404, detail="Todo item not found")
+        self._publish(events)
+        return Todo(**updated_row)
+
+    def update_many(self, bulk_update: TodoBulkUpdate) -> TodoBulkUpdateResult:
+        """
+        The update_many function applies the same patch to many todo items with one set-based UPDATE.
+            A typical use is marking a selection of items as done.
+        
+        :param self: Represent the instance of the class
+        :param bulk_update: TodoBulkUpdate: The ids of the items and the fields to change
+        :return: The ids of the items that were updated
+        :doc-author: Trelent
+        """
+        values = bulk_update.patch.dict(exclude_unset=True, exclude_none=True)
+        if not values or not bulk_update.ids:
+            return TodoBulkUpdateResult(updated_ids=[])
+        events, notify = self._notifier(lambda ids: [make_event("updated", id) for id in ids])
+        updated_ids = self.repository.update_many(bulk_update.ids, values, notify=notify)
+        self._invalidate(*updated_ids)
+        self._publish(events)
+        return TodoBulkUpdateResult(updated_ids=updated_ids)
+
+    def remove(self, id: int) -> Todo:
+        """
+        The remove function deletes a todo item with a single UPDATE ... RETURNING statement.
+            The row is kept as a tombstone, so that GET /todo/changes can report the deletion.
+        
+        :param self: Represent the instance of the class
+        :param id: int: Specify the id of the todo item to delete
+        :return: The deleted todo object
+        :doc-author: Trelent
+        """
+        events, notify = self._notifier(lambda row: [make_event("deleted", id)])
+        removed_row = self.repository.remove(id, notify=notify)
+        self._invalidate(id)
+        if removed_row is None:
+            raise HTTPException(status_code=404, detail="Todo item not found")
+        self._publish(events)
+        return Todo(**removed_row)
+
+    @staticmethod
+    def check_export_format(export_format: ExportFormat) -> None:
+        """
+        The check_export_format function raises 406 when the export format needs a package that is not installed.
+            Call it before the response starts, the status of a streaming response cannot change afterwards.
+        
+        :param export_format: ExportFormat: The requested format
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        if export_format == ExportFormat.MSGPACK and msgpack is None:
+            raise HTTPException(status_code=406, detail="MessagePack export is not available")
+
+    def export(self, export_format: ExportFormat, since_id: int | None = None,
+               fields: tuple[str, ...] = EXPORT_COLUMNS) -> Iterator[str | bytes]:
+        """
+        The export function streams every todo with an id greater than since_id, ordered by id.
+            Rows are read from the repository in chunks of EXPORT_CHUNK_SIZE and each chunk is
+            encoded and yielded before the next one is fetched, so memory use does not depend on the table size.
+            Every record carries its id, so an interrupted export can be resumed by passing the last id seen as since_id.
+        
+        :param self: Represent the instance of the class
+        :param export_format: ExportFormat: Encode the rows as ndjson, csv or concatenated MessagePack maps
+        :param since_id: int | None: Only export todos with a greater id
+        :param fields: tuple[str, ...]: The columns to export, from parse_fields
+        :return: An iterator of encoded chunks, text for ndjson and csv, bytes for msgpack
+        :doc-author: Trelent
+        """
+        chunks = self.repository.iter_chunks(since_id=since_id, chunk_size=EXPORT_CHUNK_SIZE, columns=fields)
+        if export_format == ExportFormat.CSV:
+            return self._encode_csv(chunks, fields)
+        if export_format == ExportFormat.MSGPACK:
+            return self._encode_msgpack(chunks, fields)
+        return self._encode_ndjson(chunks, fields)
+
+    @staticmethod
+    def _encode_ndjson(chunks, columns: tuple[str, ...] = EXPORT_COLUMNS) -> Iterator[str]:
+        for chunk in chunks:
+            yield "".join(json.dumps({column: row[column] for column in columns}, default=str) + "\n"
+                          for row in chunk)
+
+    @staticmethod
+    def _encode_msgpack(chunks, columns: tuple[str, ...] = EXPORT_COLUMNS) -> Iterator[bytes]:
+        # a MessagePack stream is just the maps one after another, msgpack.Unpacker reads them back one by one
+        for chunk in chunks:
+            yield b"".join(dumps_msgpack({column: row[column] for column in columns}) for row in chunk)
+
+    @staticmethod
+    def _encode_csv(chunks, columns: tuple[str, ...] = EXPORT_COLUMNS) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows([row[column] for column in columns] for row in chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+class AsyncTodoService():
+    def __init__(self, db, cache=None) -> None:
+        """
+        The __init__ function creates the asyncio counterpart of TodoService for the hot read paths.
+            It shares the paging, ETag and cache logic of TodoService, but every database call is awaited.
+        
+        :param self: Represent the instance of the class
+        :param db: An AsyncSession from get_async_db
+        :param cache: The cache of todo items by id, the module-wide todo_cache by default
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.repository = AsyncTodoRepo(db=db)
+        self.cache = cache if cache is not None else todo_cache
+
+    async def get_all_todos(self, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+                            todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID) -> TodoPage:
+        """
+        The get_all_todos function is the asyncio version of TodoService.get_all_todos.
+        
+        :param self: Represent the instance of the class
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param todo_filter: TodoFilter | None: Only return todos matching these conditions
+        :param sort: TodoSort: One of the whitelisted, index-backed orderings
+        :return: A page of todo objects and the cursor of the next page
+        :doc-author: Trelent
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after_key = TodoService._decode_position(after, sort)
+        todos_from_db = await self.repository.get_all(todo_filter=todo_filter, sort=sort, after=after_key, limit=limit + 1)
+        return TodoService._build_page(todos_from_db, limit, sort)
+
+    async def get_page_rows(self, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+                            todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                            fields: tuple[str, ...] = TODO_FIELDS) -> dict:
+        """
+        The get_page_rows function is the asyncio version of TodoService.get_page_rows.
+        
+        :param self: Represent the instance of the class
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param todo_filter: TodoFilter | None: Only return todos matching these conditions
+        :param sort: TodoSort: One of the whitelisted, index-backed orderings
+        :param fields: tuple[str, ...]: The fields of the items, from parse_fields
+        :return: A dictionary with the items of the page and the cursor of the next page
+        :doc-author: Trelent
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after_key = TodoService._decode_position(after, sort)
+        rows = await self.repository.get_all_rows(todo_filter=todo_filter, sort=sort, after=after_key, limit=limit + 1,
+                                                  columns=TodoService._row_columns(fields, sort))
+        return TodoService._build_row_page(rows, limit, sort, fields)
+
+    async def get_list_etag(self, after: str | None = None, limit: int = DEFAULT_PAGE_SIZE,
+                            todo_filter: TodoFilter | None = None, sort: TodoSort = TodoSort.ID,
+                            fields: tuple[str, ...] = TODO_FIELDS, media_type: str = JSON_MEDIA_TYPE) -> str:
+        """
+        The get_list_etag function is the asyncio version of TodoService.get_list_etag.
+        
+        :param self: Represent the instance of the class
+        :param after: str | None: The next_cursor of the previous page, or None for the first page
+        :param limit: int: The page size, capped at MAX_PAGE_SIZE
+        :param todo_filter: TodoFilter | None: Only return todos matching these conditions
+        :param sort: TodoSort: One of the whitelisted, index-backed orderings
+        :param fields: tuple[str, ...]: The fields of the items, pages with other fields get another ETag
+        :param media_type: str: The media type of the response; every representation has its own strong ETag
+        :return: The ETag of the page
+        :doc-author: Trelent
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after_key = TodoService._decode_position(after, sort)
+        versions = await self.repository.get_page_versions(todo_filter=todo_filter, sort=sort, after=after_key, limit=limit + 1)
+        return make_etag(media_type, sort.value, limit, fields, [(id, updated_at) for id, updated_at in versions])
+
+    async def get_by_id(self, id: int) -> Todo:
+        """
+        The get_by_id function is the asyncio version of TodoService.get_by_id and uses the same cache.
+        
+        :param self: Represent the instance of the class
+        :param id: int: Specify the id of the todo item we want to get
+        :return: The todo object
+        :doc-author: Trelent
+        """
+        if self.cache is not None:
+            cached_item = await self.cache.aget(str(id))
+            if cached_item is not None:
+                return cached_item
+        todo_item = await self.repository.get_by_id(id)
+        if todo_item is None:
+            raise HTTPException(status_code=404, detail="Todo item not found")
+        todo_item = Todo.from_orm(todo_item)
+        if self.cache is not None:
+            await self.cache.aset(str(id), todo_item)
+        return todo_item
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from conf.config import settings
+from repository.todos import AsyncTodoRepo
+
+TOMBSTONE_PURGE_SECONDS = 3600.0
+TOMBSTONE_PURGE_BATCH_SIZE = 1000
+
+
+class TombstonePurger():
+    def __init__(self, retention: timedelta, interval: float = TOMBSTONE_PURGE_SECONDS,
+                 batch_size: int = TOMBSTONE_PURGE_BATCH_SIZE) -> None:
+        """
+        The __init__ function creates the worker that deletes the todo tombstones older than retention.
+            retention is also the sync window: GET /todo/changes refuses tokens older than it, so no client
+            still needs a tombstone by the time it is purged. Every worker process may run one; they only
+            delete the same rows.
+        
+        :param self: Represent the instance of the class
+        :param retention: timedelta: How long a deleted todo stays in the table
+        :param interval: float: Number of seconds between two purges
+        :param batch_size: int: Number of rows deleted per statement
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self.session_factory = None
+        self.task = None
+        self.purged = 0
+        self.runs = 0
+        self.last_error = None
+
+    async def start(self, session_factory) -> None:
+        self.session_factory = session_factory
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as error:
+                # the database is unreachable; the tombstones are still there at the next run
+                self.last_error = repr(error)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """
+        The run_once function deletes the tombstones older than the retention, batch_size rows per transaction.
+        
+        :param self: Represent the instance of the class
+        :return: The number of deleted rows
+        :doc-author: Trelent
+        """
+        before = datetime.utcnow() - self.retention
+        purged = 0
+        async with self.session_factory() as session:
+            repository = AsyncTodoRepo(db=session)
+            while True:
+                count = await repository.purge_tombstones(before, self.batch_size)
+                purged += count
+                if count < self.batch_size:
+                    break
+        self.runs += 1
+        self.purged += purged
+        return purged
+
+    def stats(self) -> dict:
+        return {"running": self.task is not None, "runs": self.runs, "purged": self.purged,
+                "retention_days": self.retention / timedelta(days=1), "last_error": self.last_error}
+
+
+tombstone_purger = TombstonePurger(timedelta(days=settings.sync_tombstone_retention_days))
@@ -1,6 +1,10 @@
-from repository.user import UserRepo
-from schemas.user import User, UserConfirmed
-from services.email import send_email
+from conf.config import settings
+from repository.user import UserRepo, AsyncUserRepo
+from schemas.user import User, UserConfirmed, RolesEnum
+from services.cache import LRUCache
+from services.email import otp_email
+from services.outbox import outbox
+from services.passwords import password_hasher
 
 
 from random import randint
@@ -8,6 +12,31 @@ from random import randint
 from fastapi import HTTPException
 
 
+# Users resolved from access tokens, by username. It stays in this worker on purpose: the entries hold
+# password hashes, which have no business in a shared cache. Writes invalidate it, the short ttl bounds
+# how long another worker may keep serving a changed user.
+principal_cache = (
+    LRUCache(max_size=settings.principal_cache_max_size, ttl=settings.principal_cache_ttl)
+    if settings.principal_cache_enabled else None
+)
+
+# The current token version of users, as far as this worker knows: bumped here by revoke_tokens and
+# refreshed whenever a user is loaded, so stateless role checks can refuse tokens of an older version.
+token_versions = LRUCache(max_size=settings.principal_cache_max_size, ttl=settings.access_token_ttl_minutes * 60)
+
+
+def invalidate_principal(*usernames: str) -> None:
+    """
+    The invalidate_principal function drops users from the principal cache.
+        Call it after every change to a user that get_current_user returns, e.g. role or confirmation.
+    
+    :param usernames: str: The usernames of the changed users
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    if principal_cache is not None and usernames:
+        principal_cache.delete(*usernames)
+
 
 class UserService():
     def __init__(self, db) -> None:
@@ -26,7 +55,7 @@ class UserService():
 
     def create_new(self, user: User) -> User:
         """
-        The create_new function creates a new user and sends an email to the user with a confirmation code.
+        The create_new function creates a new user and, in the same transaction, queues the email with a confirmation code.
             Args:
                 self (UserService): The UserService object that is calling this function.
                 user (User): The User object that will be created in the database.
@@ -38,11 +67,19 @@ class UserService():
         :return: A new user
         :doc-author: Trelent
         """
+        if self.repository.get_by_username(user.username) is not None:
+            raise HTTPException(status_code=409, detail="User already exists")
         user.confirmed = False
+        user.token_version = 0
         user.otp = str(randint(100000, 999999))
-        send_email("Welcome", f"your code is {user.otp}", user.username)
-        new_user_from_db = self.repository.create(user)
+        user.password = password_hasher.hash(user.password)
+        new_user_from_db = self.repository.create(user, mails=[otp_email(user.username, user.otp)])
+        if new_user_from_db is None:
+            # a concurrent signup took the username after the check above
+            raise HTTPException(status_code=409, detail="User already exists")
         new_user = User.from_orm(new_user_from_db)
+        invalidate_principal(new_user.username)
+        outbox.wake()
         return new_user
 
     def confirmed_user(self, data: UserConfirmed) -> User:
@@ -58,8 +95,7 @@ class UserService():
         """
         user = self.get_by_username(data.email)
         if data.otp == user.otp:
-            user.confirmed = True
-            user = self.repository.update(user)
+            user = self._update(data.email, {"confirmed": True})
         return user
 
 
@@ -68,6 +104,8 @@ class UserService():
         The get_user_for_auth function is used to authenticate a user.
             It takes the username and password as arguments, and returns a User object if authentication was successful.
             If authentication fails, it raises an HTTPException with status code 403 (Forbidden).
+            An unknown username is checked against a dummy hash, so it takes as long as a wrong password
+            and the response time does not tell which usernames exist.
         
         
         :param self: Represent the instance of a class
@@ -76,9 +114,16 @@ class UserService():
         :return: The user object from the repository
         :doc-author: Trelent
         """
-        user = self.repository.get_user_and_check_pass(username, password)
+        user = self.repository.get_by_username(username)
         if user is None:
+            password_hasher.verify(password, password_hasher.dummy_hash)
+            raise HTTPException(status_code=403)
+        if not password_hasher.verify(password, user.password, user.salt):
             raise HTTPException(status_code=403)
+        if password_hasher.needs_upgrade(user.password):
+            self.repository.set_password(username, password_hasher.hash(password))
+            password_hasher.record_upgrade()
+            invalidate_principal(username)
         return User.from_orm(user)
 
 
@@ -112,8 +157,116 @@ class UserService():
         :return: The updated user
         :doc-author: Trelent
         """
-        user.image = url
-        user_from_db = self.repository.update(user)
-        return User.from_orm(user_from_db)
+        return self._update(user.username, {"image": url})
+
+    def set_role(self, username: str, role: RolesEnum) -> User:
+        """
+        The set_role function changes the role of a user.
+            The tokens issued to the user before are revoked, so the old role cannot be used any more.
+        
+        :param self: Represent the instance of a class
+        :param username: str: The user whose role is changed
+        :param role: RolesEnum: The new role
+        :return: The updated user
+        :doc-author: Trelent
+        """
+        return self.revoke_tokens(username, {"role": RolesEnum(role).value})
+
+    def revoke_tokens(self, username: str, values: dict | None = None) -> User:
+        """
+        The revoke_tokens function bumps the token version of a user, along with other changes to the user.
+            Access tokens carry the version they were issued with, and a token of an older version
+            is refused, so every token issued to the user before is invalid afterwards.
+        
+        :param self: Represent the instance of a class
+        :param username: str: The user whose tokens are revoked
+        :param values: dict | None: Other columns to change in the same UPDATE
+        :return: The updated user
+        :doc-author: Trelent
+        """
+        user = self._update(username, values or {}, bump_token_version=True)
+        token_versions.set(username, user.token_version)
+        return user
+
+    def _update(self, username: str, values: dict, bump_token_version: bool = False) -> User:
+        updated_row = self.repository.update(username, values, bump_token_version)
+        invalidate_principal(username)
+        if updated_row is None:
+            raise HTTPException(status_code=403)
+        return User(**updated_row)
+
+
+class AsyncUserService():
+    def __init__(self, db, cache=None) -> None:
+        """
+        The __init__ function creates the asyncio counterpart of UserService for the per-request user lookup.
+        
+        :param self: Represent the instance of the class
+        :param db: An AsyncSession from get_async_db
+        :param cache: The cache of users by username, the module-wide principal_cache by default
+        :return: Nothing
+        :doc-author: Trelent
+        """
+        self.repository = AsyncUserRepo(db=db)
+        self.cache = cache if cache is not None else principal_cache
 
+    async def get_by_username(self, username: str) -> User:
+        """
+        The get_by_username function is the asyncio version of UserService.get_by_username.
+        
+        :param self: Represent the instance of the class
+        :param username: str: Specify the username of the user that we want to get
+        :return: An object of type user
+        :doc-author: Trelent
+        """
+        user = await self.repository.get_by_username(username)
+        if user is None:
+            raise HTTPException(status_code=403)
+        return User.from_orm(user)
 
+    async def get_user_for_auth(self, username: str, password: str) -> User:
+        """
+        The get_user_for_auth function is the asyncio counterpart of UserService.get_user_for_auth:
+            the password is checked on the hashing pool while the event loop keeps serving other requests,
+            and a legacy SHA-256 hash is replaced by a scrypt hash once the password is known to be right.
+        
+        :param self: Represent the instance of the class
+        :param username: str: Get the username from the request body
+        :param password: str: Check the password of the user
+        :return: The user object from the repository
+        :doc-author: Trelent
+        """
+        user = await self.repository.get_by_username(username)
+        if user is None:
+            await password_hasher.averify(password, password_hasher.dummy_hash)
+            raise HTTPException(status_code=403)
+        if not await password_hasher.averify(password, user.password, user.salt):
+            raise HTTPException(status_code=403)
+        if password_hasher.needs_upgrade(user.password):
+            await self.repository.set_password(username, await password_hasher.ahash(password))
+            password_hasher.record_upgrade()
+            invalidate_principal(username)
+        return User.from_orm(user)
+
+    async def get_principal(self, username: str, use_cache: bool = True) -> User:
+        """
+        The get_principal function returns the user an access token was issued to, for get_current_user.
+            The user is read through the principal cache, so most requests do not query the database.
+            With use_cache=False the user is read from the database and the cache is refreshed,
+            for routes that must see every change to the user right away.
+        
+        :param self: Represent the instance of the class
+        :param username: str: The sub claim of the token
+        :param use_cache: bool: Serve the user from the principal cache if it is there
+        :return: A copy of the user, so callers cannot change the cached one
+        :doc-author: Trelent
+        """
+        if use_cache and self.cache is not None:
+            cached_user = self.cache.get(username)
+            if cached_user is not None:
+                return cached_user.copy()
+        user = await self.get_by_username(username)
+        token_versions.set(username, user.token_version)
+        if self.cache is not None:
+            self.cache.set(username, user)
+        return user.copy()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.depenedencies.database import Base
+from app.models.outbox import OutboxDB
+from app.repository.outbox import OutboxRepo
+from app.repository.user import UserRepo
+from app.schemas.user import User, RolesEnum
+
+LEASE = timedelta(minutes=10)
+
+
+def make_user(username):
+    return User(username=username, password="scrypt$hash", role=RolesEnum.USER, confirmed=False, otp="111234", image="")
+
+
+class TestOutboxRepo(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.outbox_repo = OutboxRepo(db=self.db)
+
+    def add(self, count):
+        return self.outbox_repo.add(*({"recipient": f"user{i}@mail.com", "subject": "Welcome", "text": "hi"}
+                                      for i in range(count)))
+
+    def test_user_and_mail_are_written_together(self):
+        UserRepo(db=self.db).create(make_user("test@mail.com"),
+                                    mails=[{"recipient": "test@mail.com", "subject": "Welcome", "text": "your code is 1"}])
+        self.assertEqual(self.db.query(OutboxDB).one().recipient, "test@mail.com")
+        self.assertIsNone(UserRepo(db=self.db).create(make_user("test@mail.com"),
+                                                      mails=[{"recipient": "test@mail.com", "subject": "Welcome", "text": "again"}]))
+        self.assertEqual(self.db.query(OutboxDB).count(), 1)
+
+    def test_claim_leases_rows(self):
+        self.add(3)
+        claimed = self.outbox_repo.claim(2, LEASE)
+        self.assertEqual([row["attempts"] for row in claimed], [1, 1])
+        self.assertEqual([row["recipient"] for row in claimed], ["user0@mail.com", "user1@mail.com"])
+        self.assertEqual([row["recipient"] for row in self.outbox_repo.claim(10, LEASE)], ["user2@mail.com"])
+        self.assertEqual(self.outbox_repo.claim(10, LEASE), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        self.add(1)
+        self.outbox_repo.claim(1, timedelta(seconds=-1))
+        claimed = self.outbox_repo.claim(1, LEASE)
+        self.assertEqual(claimed[0]["attempts"], 2)
+
+    def test_delivered_failed_and_rescheduled_rows_are_skipped(self):
+        delivered, failed, rescheduled, due = (row.id for row in self.add(4))
+        self.outbox_repo.mark_delivered([delivered])
+        self.outbox_repo.mark_failed(failed, "550 No such user")
+        self.outbox_repo.reschedule(rescheduled, "451 Try again later", datetime.utcnow() + LEASE)
+        self.outbox_repo.reschedule(due, "451 Try again later", datetime.utcnow() - LEASE)
+        self.assertEqual([row["id"] for row in self.outbox_repo.claim(10, LEASE)], [due])
+        self.assertEqual(self.db.get(OutboxDB, failed).last_error, "550 No such user")
+
+
+class TestOutboxRepoConcurrency(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        with self.Session() as db:
+            OutboxRepo(db).add(*({"recipient": f"user{i}@mail.com", "subject": "Welcome", "text": "hi"} for i in range(200)))
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_workers_never_claim_the_same_row(self):
+        claimed = []
+
+        def drain():
+            with self.Session() as db:
+                while rows := OutboxRepo(db).claim(7, LEASE):
+                    claimed.extend(row["id"] for row in rows)
+
+        threads = [threading.Thread(target=drain) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), list(range(1, 201)))
@@ -1,8 +1,11 @@
 import unittest
+from datetime import date, datetime, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from app.depenedencies.database import Base
 from app.models.todo import TodoDB
 from app.repository.todos import TodoRepo
+from app.schemas.todo import TodoCreate
 
 class TestTodoRepo(unittest.TestCase):
     def setUp(self):
@@ -39,5 +42,59 @@ class TestTodoRepo(unittest.TestCase):
         retrieved_item = self.todo_repo.get_by_id(non_existent_id)
         self.assertIsNone(retrieved_item)
 
+
+class TestTodoRepoChanges(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(bind=engine)
+        self.db = sessionmaker(bind=engine)()
+        self.todo_repo = TodoRepo(db=self.db)
+        self.db.add_all(TodoDB(id=i, name=f"n{i}", surname="s", email=f"e{i}@x.com", phone=i,
+                               birthday=date(1990, 1, i), description="d") for i in range(1, 4))
+        self.db.commit()
+
+    def test_create_many_skips_existing_ids(self):
+        items = [TodoCreate(id=id, name=f"new{id}", surname="s", email="e@x.com", phone=id,
+                            birthday=date(1990, 2, 1), description=None) for id in (5, 2, 4)]
+        self.assertEqual(self.todo_repo.create_many(items), [5, 4])
+        self.assertEqual(self.todo_repo.get_by_id(2).name, "n2")
+        self.assertEqual(self.todo_repo.get_by_id(4).name, "new4")
+
+    def test_create_revives_a_tombstone(self):
+        self.todo_repo.remove(2)
+        item = TodoCreate(id=2, name="again", surname="s", email="e@x.com", phone=2,
+                          birthday=date(1990, 3, 1), description=None)
+        revived = self.todo_repo.create(item)
+        self.assertEqual((revived["name"], revived["deleted_at"], revived["birthday_key"]), ("again", None, 301))
+        self.assertEqual(self.todo_repo.get_by_id(2).name, "again")
+        self.assertIsNone(self.todo_repo.create(item))
+
+        self.todo_repo.remove(3)
+        items = [item.copy(update={"id": id}) for id in (3, 1)]
+        self.assertEqual(self.todo_repo.create_many(items), [3])
+        self.assertEqual(self.todo_repo.get_by_id(1).name, "n1")
+
+    def test_remove_leaves_a_tombstone(self):
+        removed = self.todo_repo.remove(2)
+        self.assertEqual(removed["id"], 2)
+        self.assertIsNone(self.todo_repo.get_by_id(2))
+        self.assertIsNone(self.todo_repo.remove(2))
+        self.assertEqual([item.id for item in self.todo_repo.get_all()], [1, 3])
+
+        rows = self.todo_repo.get_changes(None, datetime.utcnow() + timedelta(seconds=1), 10)
+        self.assertEqual([(row.id, row.deleted_at is not None) for row in rows][-1], (2, True))
+        live_rows = self.todo_repo.get_changes(None, datetime.utcnow() + timedelta(seconds=1), 10, include_deleted=False)
+        self.assertEqual(sorted(row.id for row in live_rows), [1, 3])
+
+    def test_get_changes_after_token(self):
+        until = datetime.utcnow() + timedelta(seconds=1)
+        first, second, third = self.todo_repo.get_changes(None, until, 10)
+        self.todo_repo.update(1, {"name": "changed"})
+        rows = self.todo_repo.get_changes((third.updated_at, third.id), datetime.utcnow() + timedelta(seconds=1), 10)
+        self.assertEqual([(row.id, row.name) for row in rows], [(1, "changed")])
+        # nothing newer than the horizon is handed out
+        self.assertEqual(self.todo_repo.get_changes((third.updated_at, third.id), third.updated_at, 10), [])
+
 if __name__ == "__main__":
     unittest.main()
+
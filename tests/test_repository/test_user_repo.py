@@ -2,9 +2,10 @@ import unittest
 from unittest.mock import MagicMock
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from app.users import UserDB
-from app.dependencies.database import SessionLocal
+from app.models.users import UserDB
+from app.depenedencies.database import Base, SessionLocal
 from app.repository.user import UserRepo
+from app.schemas.user import User, RolesEnum
 
 class TestUserRepo(unittest.TestCase):
     def setUp(self):
@@ -23,11 +24,10 @@ class TestUserRepo(unittest.TestCase):
         user_data = {"username": "testuser", "password": "password"}
         new_user = self.user_repo.create(user_data)
 
-        updated_user_data = {"username": "updateduser", "password": "newpassword"}
-        updated_user = self.user_repo.update(UserDB(**updated_user_data))
+        updated_user = self.user_repo.update(user_data["username"], {"image": "image.jpg"})
 
-        self.assertIsNone(self.user_repo.get_by_username(user_data["username"]))
-        self.assertIsNotNone(self.user_repo.get_by_username(updated_user_data["username"]))
+        self.assertEqual(updated_user["id"], new_user.id)
+        self.assertEqual(self.user_repo.get_by_username(user_data["username"]).image, "image.jpg")
 
     def test_get_by_username(self):
         user_data = {"username": "testuser", "password": "password"}
@@ -36,20 +36,6 @@ class TestUserRepo(unittest.TestCase):
         retrieved_user = self.user_repo.get_by_username(user_data["username"])
         self.assertEqual(retrieved_user.username, user_data["username"])
 
-    def test_get_user_and_check_pass_success(self):
-        user_data = {"username": "testuser", "password": "password"}
-        new_user = self.user_repo.create(user_data)
-
-        retrieved_user = self.user_repo.get_user_and_check_pass(user_data["username"], user_data["password"])
-        self.assertEqual(retrieved_user.username, user_data["username"])
-
-    def test_get_user_and_check_pass_failure(self):
-        user_data = {"username": "testuser", "password": "password"}
-        new_user = self.user_repo.create(user_data)
-
-        retrieved_user = self.user_repo.get_user_and_check_pass(user_data["username"], "wrongpassword")
-        self.assertIsNone(retrieved_user)
-
     def test_generate_salt(self):
         salt = self.user_repo.generate_salt()
         self.assertIsNotNone(salt)
@@ -60,5 +46,40 @@ class TestUserRepo(unittest.TestCase):
         self.assertIsNotNone(hashed_password)
         self.assertIsNotNone(salt)
 
+class TestUserRepoUpdate(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.user_repo = UserRepo(db=self.db)
+        self.user = self.user_repo.create(User(username="test@mail.com", password="scrypt$hash", role=RolesEnum.USER,
+                                               confirmed=False, otp="111234", image=""), salt="00ff")
+
+    def test_update_changes_only_given_columns(self):
+        updated_row = self.user_repo.update("test@mail.com", {"confirmed": True})
+        self.assertTrue(updated_row["confirmed"])
+        self.assertEqual(updated_row["id"], self.user.id)
+        self.assertEqual(updated_row["password"], "scrypt$hash")
+        self.assertEqual(updated_row["salt"], "00ff")
+        self.assertEqual(self.db.query(UserDB).count(), 1)
+
+    def test_update_bumps_token_version(self):
+        updated_row = self.user_repo.update("test@mail.com", {"role": "Manager"}, bump_token_version=True)
+        self.assertEqual((updated_row["role"], updated_row["token_version"]), ("Manager", 1))
+
+    def test_set_password(self):
+        self.user_repo.set_password("test@mail.com", "scrypt$other")
+        retrieved_user = self.user_repo.get_by_username("test@mail.com")
+        self.assertEqual(retrieved_user.password, "scrypt$other")
+        self.assertIsNone(retrieved_user.salt)
+
+    def test_update_unknown_user(self):
+        self.assertIsNone(self.user_repo.update("nobody@mail.com", {"image": "x"}))
+
+    def test_username_is_unique(self):
+        self.assertTrue(UserDB.__table__.c.username.unique)
+        self.assertIn("ix_users_username", {index.name for index in UserDB.__table__.indexes})
+
+
 if __name__ == "__main__":
     unittest.main()
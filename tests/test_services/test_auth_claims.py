@@ -0,0 +1,105 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.depenedencies import auth
+from app.depenedencies.auth import create_access_token, get_authorized_principal, check_is_admin, TokenPrincipal, \
+    create_email_token, get_email_from_token, decode_jwt_token
+from app.services import users as users_module
+from app.services.cache import LRUCache
+from app.services.users import UserService
+from app.schemas.user import User, RolesEnum
+
+
+def make_user(**fields):
+    values = dict(username="test@mail.com", password="hash", role=RolesEnum.ADMIN,
+                  confirmed=True, otp="111234", image="", token_version=2)
+    values.update(fields)
+    return User(**values)
+
+
+def test_claims_authorize_without_db():
+    token = create_access_token("test@mail.com", RolesEnum.ADMIN, confirmed=True, version=2)
+    db = Mock()
+    with patch.object(auth.settings, "auth_stateless_roles", True), \
+            patch.object(auth, "token_versions", LRUCache()), \
+            patch.object(auth, "AsyncUserService") as user_service:
+        principal = asyncio.run(get_authorized_principal(token, db))
+        assert asyncio.run(check_is_admin(principal)) is principal
+    assert principal == TokenPrincipal(username="test@mail.com", role=RolesEnum.ADMIN, confirmed=True, version=2)
+    user_service.assert_not_called()
+
+
+def test_claims_of_older_version_are_refused():
+    token = create_access_token("test@mail.com", RolesEnum.ADMIN, confirmed=True, version=2)
+    versions = LRUCache()
+    versions.set("test@mail.com", 3)
+    with patch.object(auth.settings, "auth_stateless_roles", True), patch.object(auth, "token_versions", versions):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(get_authorized_principal(token, Mock()))
+    assert error.value.status_code == 401
+
+
+def test_unconfirmed_claims_are_forbidden():
+    token = create_access_token("test@mail.com", RolesEnum.ADMIN, confirmed=False, version=0)
+    with patch.object(auth.settings, "auth_stateless_roles", True), patch.object(auth, "token_versions", LRUCache()):
+        principal = asyncio.run(get_authorized_principal(token, Mock()))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(check_is_admin(principal))
+    assert error.value.status_code == 403
+
+
+def test_claims_past_the_stateless_window_load_the_user():
+    token = create_access_token("test@mail.com", RolesEnum.ADMIN, confirmed=True, version=2)
+    with patch.object(auth.settings, "auth_stateless_roles", True), \
+            patch.object(auth.settings, "auth_stateless_max_age_seconds", -1), \
+            patch.object(auth, "token_versions", LRUCache()), \
+            patch.object(auth, "AsyncUserService") as user_service:
+        user_service.return_value.get_principal = AsyncMock(return_value=make_user(role=RolesEnum.USER))
+        principal = asyncio.run(get_authorized_principal(token, Mock()))
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(check_is_admin(principal))
+    assert error.value.status_code == 403
+
+
+def test_token_without_version_loads_the_user():
+    token = create_access_token("test@mail.com", RolesEnum.ADMIN)
+    with patch.object(auth.settings, "auth_stateless_roles", True), patch.object(auth, "AsyncUserService") as user_service:
+        user_service.return_value.get_principal = AsyncMock(return_value=make_user())
+        assert asyncio.run(get_authorized_principal(token, Mock())).username == "test@mail.com"
+
+
+def test_stale_version_is_refused_when_the_user_is_loaded():
+    token = create_access_token("test@mail.com", RolesEnum.ADMIN, confirmed=True, version=1)
+    with patch.object(auth, "AsyncUserService") as user_service:
+        user_service.return_value.get_principal = AsyncMock(return_value=make_user(token_version=2))
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(get_authorized_principal(token, Mock()))
+    assert error.value.status_code == 401
+
+
+def test_set_role_bumps_token_version():
+    versions = LRUCache()
+    user_service = UserService(Mock())
+    user_service.repository = Mock()
+    user_service.repository.update.return_value = make_user(role=RolesEnum.MANAGER, token_version=3).dict()
+    with patch.object(users_module, "token_versions", versions):
+        result = user_service.set_role("test@mail.com", RolesEnum.MANAGER)
+    user_service.repository.update.assert_called_once_with("test@mail.com", {"role": "Manager"}, True)
+    assert result.role == RolesEnum.MANAGER and result.token_version == 3
+    assert versions.get("test@mail.com") == 3
+
+
+def test_token_types_are_not_interchangeable():
+    email_token = create_email_token({"sub": "test@mail.com"})
+    access_token = create_access_token("test@mail.com", RolesEnum.ADMIN, confirmed=True, version=2)
+    assert get_email_from_token(email_token) == "test@mail.com"
+    assert decode_jwt_token(email_token) == "Invalid token"
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(get_authorized_principal(email_token, Mock()))
+    assert error.value.status_code == 401
+    with pytest.raises(HTTPException) as error:
+        get_email_from_token(access_token)
+    assert error.value.status_code == 422
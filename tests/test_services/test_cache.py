@@ -0,0 +1,170 @@
+import asyncio
+import threading
+from datetime import date
+from unittest.mock import AsyncMock, patch, Mock
+
+import pytest
+
+from app.services import cache as cache_module
+from app.services.cache import LRUCache, RedisCache
+from app.services.todos import TodoService, AsyncTodoService
+from app.schemas.todo import Todo, TodoUpdate
+from app.models.todo import TodoDB
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and name in self.data:
+            return None
+        self.data[name] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, *names):
+        for name in names:
+            self.data.pop(name, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def execute(self):
+        pass
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+    def execute(self):
+        return [self.client.set(*args, **kwargs) for args, kwargs in self.commands]
+
+
+class UnreachableRedis:
+    def get(self, name):
+        raise ConnectionError("Redis is down")
+
+    set = delete = get
+
+    def pipeline(self, transaction=True):
+        raise ConnectionError("Redis is down")
+
+
+def make_todo(id=1, **fields):
+    values = dict(id=id, name="Test", surname="Doe", email="test@mail.com", phone=12345,
+                  birthday=date(1990, 1, 1), is_done=False, description="lorem ipsum")
+    values.update(fields)
+    return values
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set("1", "a")
+    cache.set("2", "b")
+    assert cache.get("1") == "a"
+    cache.set("3", "c")
+    assert cache.get("2") is None
+    assert cache.get("1") == "a"
+    assert cache.stats() == {"backend": "memory", "hits": 2, "misses": 1, "evictions": 1, "size": 2}
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(max_size=2, ttl=10)
+    with patch.object(cache_module.time, "monotonic", return_value=100):
+        cache.set("1", "a")
+    with patch.object(cache_module.time, "monotonic", return_value=111):
+        assert cache.get("1") is None
+
+
+def test_redis_cache_round_trip():
+    cache = RedisCache(FakeRedis(), Todo, ttl=60, prefix="todo:")
+    todo = Todo(**make_todo())
+    cache.set("1", todo)
+    assert cache.get("1") == todo
+    cache.delete("1")
+    assert cache.get("1") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_invalidated_key_is_not_repopulated_by_a_stale_reader():
+    cache = RedisCache(FakeRedis(), Todo, ttl=60, prefix="todo:")
+    stale = Todo(**make_todo(name="Old"))
+    assert cache.get("1") is None
+    cache.delete("1")
+    cache.set("1", stale)
+    assert cache.get("1") is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_lru_cache_tombstone_blocks_a_stale_reader():
+    cache = LRUCache(max_size=10, ttl=60, tombstone_ttl=5)
+    with patch.object(cache_module.time, "monotonic", return_value=100):
+        cache.set("1", "old")
+        cache.delete("1")
+        cache.set("1", "old")
+        assert cache.get("1") is None
+    with patch.object(cache_module.time, "monotonic", return_value=106):
+        cache.set("1", "new")
+        assert cache.get("1") == "new"
+
+
+def test_memory_cache_is_refused_with_several_workers():
+    with patch.object(cache_module.settings, "cache_backend", "memory"):
+        with patch.dict(cache_module.os.environ, {"WEB_CONCURRENCY": "4"}):
+            with pytest.raises(RuntimeError):
+                cache_module.create_cache(Todo, "todo:")
+        with patch.dict(cache_module.os.environ, {"WEB_CONCURRENCY": "1"}):
+            assert isinstance(cache_module.create_cache(Todo, "todo:"), LRUCache)
+
+
+def test_unreachable_redis_falls_back_to_the_database():
+    cache = RedisCache(UnreachableRedis(), Todo, prefix="todo:")
+    service = TodoService(Mock(), cache=cache)
+    with patch.object(service.repository, "get_by_id", return_value=TodoDB(**make_todo())), \
+            patch.object(service.repository, "update", return_value=make_todo(name="New")):
+        assert service.get_by_id(1).name == "Test"
+        assert service.update(1, TodoUpdate(name="New")).name == "New"
+    assert cache.stats()["failures"] == 3
+
+
+def test_get_by_id_reads_through_cache():
+    service = TodoService(Mock(), cache=RedisCache(FakeRedis(), Todo, prefix="todo:"))
+    with patch.object(service.repository, "get_by_id", return_value=TodoDB(**make_todo())) as mock_get_by_id:
+        assert service.get_by_id(1).name == "Test"
+        assert service.get_by_id(1).name == "Test"
+        mock_get_by_id.assert_called_once_with(1)
+
+
+def test_update_invalidates_cache():
+    cache = LRUCache()
+    service = TodoService(Mock(), cache=cache)
+    cache.set("1", Todo(**make_todo()))
+    with patch.object(service.repository, "update", return_value=make_todo(name="New")):
+        service.update(1, TodoUpdate(name="New"))
+    assert cache.get("1") is None
+
+
+def test_async_get_by_id_keeps_redis_off_the_event_loop():
+    client = FakeRedis()
+    threads = []
+    real_get = client.get
+    client.get = lambda name: threads.append(threading.get_ident()) or real_get(name)
+    service = AsyncTodoService(Mock(), cache=RedisCache(client, Todo, prefix="todo:"))
+
+    async def scenario():
+        with patch.object(service.repository, "get_by_id", AsyncMock(return_value=TodoDB(**make_todo()))) as mock_get_by_id:
+            assert (await service.get_by_id(1)).name == "Test"
+            assert (await service.get_by_id(1)).name == "Test"
+            mock_get_by_id.assert_awaited_once_with(1)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(scenario())
+    assert len(threads) == 2 and loop_thread not in threads
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+from app.services import events as events_module
+from app.services.events import ChangeHub, make_event, encode_sse, NOTIFY_BATCH_SIZE
+from app.services.todos import TodoService
+from app.schemas.todo import TodoUpdate
+
+
+def test_dispatch_to_every_subscriber():
+    async def scenario():
+        hub = ChangeHub()
+        first, second = hub.subscribe(), hub.subscribe()
+        hub.publish([make_event("deleted", 1)])
+        assert (await first.get())["todo_id"] == 1
+        assert (await second.get())["type"] == "deleted"
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_is_dropped():
+    async def scenario():
+        hub = ChangeHub(queue_size=2)
+        slow, fast = hub.subscribe(), hub.subscribe()
+        hub.publish([make_event("updated", 1), make_event("updated", 2)])
+        assert (await fast.get())["todo_id"] == 1
+        hub.publish([make_event("updated", 3)])
+        assert slow.dropped and not fast.dropped
+        assert await slow.get() is None
+        assert [(await fast.get())["todo_id"] for _ in range(2)] == [2, 3]
+        assert hub.stats()["dropped"] == 1 and hub.stats()["subscribers"] == 1
+    asyncio.run(scenario())
+
+
+def test_resume_from_last_event_id():
+    async def scenario():
+        hub = ChangeHub(history_size=3)
+        events = [make_event("created", id) for id in range(1, 5)]
+        hub.publish(events)
+        resumed = hub.subscribe(last_event_id=events[1]["id"])
+        assert [(await resumed.get())["todo_id"] for _ in range(2)] == [3, 4]
+        # events[0] fell out of the history
+        too_old = hub.subscribe(last_event_id=events[0]["id"])
+        assert (await too_old.get())["type"] == "reset"
+    asyncio.run(scenario())
+
+
+def test_publish_from_another_thread():
+    async def scenario():
+        hub = ChangeHub()
+        subscription = hub.subscribe()
+        thread = threading.Thread(target=hub.publish, args=([make_event("created", 7)],))
+        thread.start()
+        thread.join()
+        event = await asyncio.wait_for(subscription.get(), timeout=1)
+        assert event["todo_id"] == 7
+    asyncio.run(scenario())
+
+
+def test_notify_sends_events_in_batches():
+    hub = ChangeHub(use_notify=True)
+    db = Mock()
+    hub.notify([make_event("updated", id) for id in range(NOTIFY_BATCH_SIZE * 2 + 1)], db=db)
+    batches = [call.args[1]["payloads"] for call in db.execute.call_args_list]
+    assert [len(batch) for batch in batches] == [NOTIFY_BATCH_SIZE, NOTIFY_BATCH_SIZE, 1]
+    # the NOTIFY statements belong to the write transaction, which the repository commits
+    db.commit.assert_not_called()
+
+
+class FakeDriverConnection:
+    def __init__(self):
+        self.on_terminate = None
+
+    def add_termination_listener(self, callback):
+        self.on_terminate = callback
+
+    async def add_listener(self, channel, callback):
+        pass
+
+
+class FakeEngine:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.drivers = []
+
+    async def connect(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("connection refused")
+        driver = FakeDriverConnection()
+        self.drivers.append(driver)
+        raw_connection = Mock(driver_connection=driver)
+        connection = Mock()
+
+        async def get_raw_connection():
+            return raw_connection
+
+        async def close():
+            pass
+        connection.get_raw_connection = get_raw_connection
+        connection.close = close
+        return connection
+
+
+def test_listener_reconnects_after_the_connection_is_lost():
+    async def scenario():
+        hub = ChangeHub(use_notify=True)
+        engine = FakeEngine(failures=1)
+        subscription = hub.subscribe()
+        with patch.object(events_module, "LISTEN_BACKOFF_SECONDS", 0.01):
+            await hub.start(engine)
+            while not engine.drivers:
+                await asyncio.sleep(0.01)
+            engine.drivers[0].on_terminate(None)
+            event = await asyncio.wait_for(subscription.get(), timeout=1)
+            await hub.stop()
+        return hub, engine, event
+
+    hub, engine, event = asyncio.run(scenario())
+    assert event["type"] == "reset"
+    assert len(engine.drivers) == 2
+    assert hub.stats()["reconnects"] == 1 and "connection refused" in hub.stats()["last_error"]
+
+
+def test_encode_sse():
+    event = {"id": "abc", "type": "updated", "todo_id": 3, "data": None}
+    assert encode_sse(event) == 'id: abc\nevent: updated\ndata: {"todo_id":3,"data":null}\n\n'
+
+
+def test_service_publishes_updates():
+    hub = Mock()
+    service = TodoService(Mock(), cache=Mock(), events=hub)
+    row = {"id": 3, "name": "a", "surname": "b", "email": "c", "phone": 1, "birthday": "1990-01-01",
+           "is_done": True, "description": "d", "updated_at": None}
+
+
+    def update(id, values, notify):
+        notify(row)
+        return row
+
+    with patch.object(service.repository, "update", side_effect=update):
+        service.update(3, TodoUpdate(is_done=True))
+    (events,), kwargs = hub.notify.call_args
+    assert [(event["type"], event["todo_id"], event["data"]["is_done"]) for event in events] == [("updated", 3, True)]
+    assert kwargs["db"] is service.repository.db
+    hub.publish.assert_called_once_with(events)
+
+
+ROW = {"id": 3, "name": "a", "surname": "b", "email": "c", "phone": 1, "birthday": "1990-01-01",
+       "is_done": True, "description": "d", "updated_at": None}
+
+
+def test_notify_runs_in_the_write_transaction():
+    db = Mock()
+    db.execute.return_value.mappings.return_value.first.return_value = ROW
+    hub = ChangeHub(use_notify=True)
+    service = TodoService(db, cache=Mock(), events=hub)
+    with patch.object(hub, "notify", side_effect=lambda events, db: db.notified(events)):
+        service.remove(3)
+    assert [call[0] for call in db.mock_calls if call[0] in ("execute", "notified", "commit")] == \
+        ["execute", "notified", "commit"]
+
+
+def test_publish_failure_does_not_fail_the_write():
+    hub = Mock()
+    hub.publish.side_effect = RuntimeError("loop is gone")
+    service = TodoService(Mock(), cache=Mock(), events=hub)
+    with patch.object(service.repository, "remove", return_value=ROW):
+        assert service.remove(3).id == 3
@@ -0,0 +1,162 @@
+import asyncio
+import socket
+import threading
+
+from unittest.mock import patch
+
+import aiosmtplib
+import pytest
+
+from app.services import mailer as mailer_module
+from app.services.mailer import Mailer, MailNotSent, render_message
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller  # noqa: E402
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+        self.replies = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.replies:
+            return self.replies.pop(0)
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_mailer(port, **options):
+    return Mailer("127.0.0.1", port, sender="app@example.com", start_tls=False, backoff=0.01, **options)
+
+
+def send_all(mailer, messages, wait=5):
+    async def scenario():
+        await mailer.start()
+        for message in messages:
+            mailer.enqueue(message)
+        await mailer.stop(timeout=wait)
+    asyncio.run(scenario())
+
+
+def test_messages_share_persistent_sessions(smtp_server):
+    controller, handler = smtp_server
+    mailer = make_mailer(controller.port, connections=2)
+    send_all(mailer, [render_message(f"user{i}@example.com", "Welcome", text=f"your code is {i}") for i in range(50)])
+    assert len(handler.messages) == 50
+    assert handler.sessions <= 2
+    stats = mailer.stats()
+    assert stats["sent"] == 50 and stats["queue_depth"] == 0 and stats["sessions_opened"] <= 2
+    assert stats["batches"] < 50 and stats["latency_max_ms"] > 0
+
+
+def test_html_template(smtp_server):
+    controller, handler = smtp_server
+    send_all(make_mailer(controller.port), [render_message("user@example.com", "Confirm your email",
+                                                           template_name="email_template.html",
+                                                           body={"host": "http://app/", "username": "Bob", "token": "abc"})])
+    content = handler.messages[0].content.decode()
+    assert "text/html" in content and "api/auth/confirmed_email/abc" in content
+    assert handler.messages[0].mail_from == "app@example.com"
+
+
+def test_temporary_failure_is_retried(smtp_server):
+    controller, handler = smtp_server
+    handler.replies = ["451 Try again later"]
+    mailer = make_mailer(controller.port)
+    send_all(mailer, [render_message("user@example.com", "Welcome", text="your code is 1")])
+    assert len(handler.messages) == 1
+    assert mailer.stats()["retried"] == 1 and mailer.stats()["failed"] == 0
+
+
+def test_permanent_failure_is_not_retried(smtp_server):
+    controller, handler = smtp_server
+    handler.replies = ["550 No such user"]
+    mailer = make_mailer(controller.port)
+    send_all(mailer, [render_message("nobody@example.com", "Welcome", text="your code is 1")])
+    assert handler.messages == []
+    assert mailer.stats()["retried"] == 0 and mailer.stats()["failed"] == 1
+
+
+def test_unreachable_server_gives_up():
+    mailer = make_mailer(free_port(), max_attempts=3)
+    send_all(mailer, [render_message("user@example.com", "Welcome", text="your code is 1")])
+    stats = mailer.stats()
+    assert stats["retried"] == 2 and stats["failed"] == 1 and stats["sessions_open"] == 0
+
+
+def test_failed_connect_closes_the_client():
+    clients = []
+
+    class FailingSMTP:
+        def __init__(self, **options):
+            self.closed = False
+            clients.append(self)
+
+        async def connect(self):
+            raise aiosmtplib.SMTPConnectError("greeting refused")
+
+        def close(self):
+            self.closed = True
+
+    mailer = make_mailer(free_port(), max_attempts=3)
+    with patch.object(mailer_module.aiosmtplib, "SMTP", FailingSMTP):
+        send_all(mailer, [render_message("user@example.com", "Welcome", text="your code is 1")])
+    assert len(clients) == 3 and all(client.closed for client in clients)
+    assert mailer.stats()["sessions_open"] == 0
+
+
+def test_enqueue_from_another_thread(smtp_server):
+    controller, handler = smtp_server
+    mailer = make_mailer(controller.port)
+
+    async def scenario():
+        await mailer.start()
+        thread = threading.Thread(target=mailer.enqueue, args=(render_message("user@example.com", "Welcome", text="hi"),))
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.05)
+        await mailer.stop()
+
+    asyncio.run(scenario())
+    assert len(handler.messages) == 1
+    assert not make_mailer(controller.port).enqueue(render_message("user@example.com", "Welcome", text="hi"))
+
+
+def test_send_waits_for_the_outcome(smtp_server):
+    controller, handler = smtp_server
+    handler.replies = ["451 Try again later", "550 No such user"]
+    mailer = make_mailer(controller.port, max_attempts=2)
+
+    async def scenario():
+        await mailer.start()
+        with pytest.raises(MailNotSent) as refused:
+            await mailer.send(render_message("nobody@example.com", "Welcome", text="hi"))
+        await mailer.send(render_message("user@example.com", "Welcome", text="hi"))
+        await mailer.stop()
+        return refused.value
+
+    error = asyncio.run(scenario())
+    assert error.permanent and "550" in error.error
+    assert len(handler.messages) == 1 and mailer.stats()["retried"] == 1
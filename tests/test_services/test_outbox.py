@@ -0,0 +1,152 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.depenedencies.database import Base
+from app.models.outbox import OutboxDB
+from app.repository.outbox import OutboxRepo
+from app.services.mailer import MailNotSent
+from app.services.outbox import OutboxWorker
+
+
+class RecordingMailer:
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    async def send(self, message):
+        await asyncio.sleep(0)
+        error = self.errors.get(message["To"])
+        if error is not None:
+            raise error
+        self.sent.append(message)
+
+
+@pytest.fixture
+def database():
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine), f"sqlite+aiosqlite:///{path}"
+    engine.dispose()
+    os.remove(path)
+
+
+def add_mails(Session, *recipients):
+    with Session() as db:
+        return [row.id for row in OutboxRepo(db).add(*({"recipient": recipient, "subject": "Welcome", "text": "hi"}
+                                                          for recipient in recipients))]
+
+
+def rows(Session):
+    with Session() as db:
+        return {row.recipient: row for row in db.scalars(select(OutboxDB))}
+
+
+def run(url, scenario):
+    async def main():
+        engine = create_async_engine(url)
+        try:
+            return await scenario(async_sessionmaker(engine, expire_on_commit=False))
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+def test_batch_is_sent_and_marked_delivered(database):
+    Session, url = database
+    add_mails(Session, "a@mail.com", "b@mail.com", "c@mail.com")
+    mailer = RecordingMailer()
+    worker = OutboxWorker(mailer, batch_size=2)
+
+    async def scenario(session_factory):
+        worker.session_factory = session_factory
+        return [await worker.run_once() for _ in range(3)]
+
+    assert run(url, scenario) == [2, 1, 0]
+    assert [message["To"] for message in mailer.sent] == ["a@mail.com", "b@mail.com", "c@mail.com"]
+    assert all(row.delivered_at is not None and row.attempts == 1 for row in rows(Session).values())
+    assert worker.stats()["delivered"] == 3 and worker.stats()["batches"] == 2
+
+
+def test_template_rows_are_rendered(database):
+    Session, url = database
+    with Session() as db:
+        OutboxRepo(db).add({"recipient": "a@mail.com", "subject": "Confirm your email ", "template": "email_template.html",
+                            "body": {"host": "http://app/", "username": "Bob", "token": "abc"}})
+    mailer = RecordingMailer()
+    worker = OutboxWorker(mailer)
+
+    async def scenario(session_factory):
+        worker.session_factory = session_factory
+        await worker.run_once()
+
+    run(url, scenario)
+    assert "api/auth/confirmed_email/abc" in mailer.sent[0].get_content()
+
+
+def test_failures_are_rescheduled_or_given_up(database):
+    Session, url = database
+    add_mails(Session, "ok@mail.com", "later@mail.com", "nobody@mail.com")
+    mailer = RecordingMailer({"later@mail.com": MailNotSent("451 Try again later", permanent=False),
+                              "nobody@mail.com": MailNotSent("550 No such user", permanent=True)})
+    worker = OutboxWorker(mailer, max_attempts=2, backoff=0)
+
+    async def scenario(session_factory):
+        worker.session_factory = session_factory
+        return [await worker.run_once() for _ in range(3)]
+
+    assert run(url, scenario) == [3, 1, 0]
+    outbox = rows(Session)
+    assert outbox["ok@mail.com"].delivered_at is not None
+    assert outbox["nobody@mail.com"].failed_at is not None and outbox["nobody@mail.com"].attempts == 1
+    assert outbox["later@mail.com"].failed_at is not None and outbox["later@mail.com"].attempts == 2
+    assert outbox["later@mail.com"].last_error == "451 Try again later"
+    assert worker.stats()["rescheduled"] == 1 and worker.stats()["failed"] == 2
+
+
+def test_wake_sends_without_waiting_for_the_poll(database):
+    Session, url = database
+    mailer = RecordingMailer()
+    worker = OutboxWorker(mailer, poll_interval=60)
+
+    async def scenario(session_factory):
+        await worker.start(session_factory)
+        await asyncio.sleep(0.05)
+        await asyncio.to_thread(add_mails, Session, "a@mail.com")
+        worker.wake()
+        for _ in range(100):
+            if mailer.sent:
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+
+    run(url, scenario)
+    assert len(mailer.sent) == 1
+    assert not worker.stats()["running"]
+
+
+def test_workers_drain_in_parallel_without_duplicates(database):
+    Session, url = database
+    add_mails(Session, *(f"user{i}@mail.com" for i in range(120)))
+    mailer = RecordingMailer()
+    workers = [OutboxWorker(mailer, batch_size=10) for _ in range(3)]
+
+    async def drain(worker):
+        while await worker.run_once():
+            pass
+
+    async def scenario(session_factory):
+        for worker in workers:
+            worker.session_factory = session_factory
+        await asyncio.gather(*(drain(worker) for worker in workers))
+
+    run(url, scenario)
+    recipients = [message["To"] for message in mailer.sent]
+    assert len(recipients) == len(set(recipients)) == 120
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.repository.user import UserRepo
+from app.services.passwords import PasswordHasher
+from app.services.users import UserService, AsyncUserService
+from app.models.users import UserDB
+from app.schemas.user import RolesEnum
+
+
+def make_hasher(**options):
+    return PasswordHasher(n=2 ** 4, **options)
+
+
+def test_hash_and_verify():
+    hasher = make_hasher()
+    stored = hasher.hash("password")
+    assert stored.startswith("scrypt$16$") and not hasher.needs_upgrade(stored)
+    assert stored != hasher.hash("password")
+    assert hasher.verify("password", stored)
+    assert not hasher.verify("wrongpassword", stored)
+    assert asyncio.run(hasher.averify("password", stored))
+    assert hasher.stats()["completed"] == 5
+
+
+def test_verify_legacy_hash():
+    hasher = make_hasher()
+    legacy, salt = UserRepo.hash_password("password")
+    assert hasher.needs_upgrade(legacy)
+    assert hasher.verify("password", legacy, salt)
+    assert not hasher.verify("wrongpassword", legacy, salt)
+    # checked on the pool, padded to the cost of a scrypt hash
+    assert hasher.stats()["completed"] == 2
+    with patch.object(hasher, "_check", wraps=hasher._check) as check:
+        hasher.verify("password", legacy, salt)
+    check.assert_called_once_with("password", hasher.dummy_hash)
+
+
+def test_user_without_password_is_refused():
+    hasher = make_hasher()
+    assert not hasher.needs_upgrade(None)
+    assert not hasher.verify("password", None)
+    assert not asyncio.run(hasher.averify("password", None))
+    assert hasher.stats()["completed"] == 2
+
+
+def test_full_queue_is_refused():
+    hasher = make_hasher(workers=1, max_pending=1)
+    release = threading.Event()
+    blocked = [hasher._submit(release.wait) for _ in range(2)]
+    with pytest.raises(HTTPException) as error:
+        hasher.hash("password")
+    release.set()
+    for future in blocked:
+        future.result()
+    assert error.value.status_code == 503 and hasher.stats()["rejected"] == 1
+    assert hasher.stats()["pending"] == 0
+
+
+def make_user_db(password, salt=None):
+    return UserDB(username="test@mail.com", password=password, salt=salt, role=RolesEnum.USER,
+                  confirmed=True, otp="111234", image="", token_version=0)
+
+
+def test_login_upgrades_legacy_hash(monkeypatch):
+    hasher = make_hasher()
+    monkeypatch.setattr("app.services.users.password_hasher", hasher)
+    legacy, salt = UserRepo.hash_password("password")
+    user_service = UserService(Mock())
+    user_service.repository = Mock()
+    user_service.repository.get_by_username.return_value = make_user_db(legacy, salt)
+    assert user_service.get_user_for_auth("test@mail.com", "password").username == "test@mail.com"
+    username, upgraded = user_service.repository.set_password.call_args.args
+    assert username == "test@mail.com" and hasher.verify("password", upgraded)
+
+    user_service.repository.get_by_username.return_value = make_user_db(upgraded)
+    user_service.repository.set_password.reset_mock()
+    user_service.get_user_for_auth("test@mail.com", "password")
+    user_service.repository.set_password.assert_not_called()
+    with pytest.raises(HTTPException) as error:
+        user_service.get_user_for_auth("test@mail.com", "wrongpassword")
+    assert error.value.status_code == 403
+
+
+def test_async_login_upgrades_legacy_hash(monkeypatch):
+    hasher = make_hasher()
+    monkeypatch.setattr("app.services.users.password_hasher", hasher)
+    legacy, salt = UserRepo.hash_password("password")
+    user_service = AsyncUserService(Mock())
+    user_service.repository = Mock()
+
+    async def get_by_username(username):
+        return make_user_db(legacy, salt)
+
+    async def set_password(username, password):
+        user_service.upgraded = password
+
+    user_service.repository.get_by_username = get_by_username
+    user_service.repository.set_password = set_password
+    assert asyncio.run(user_service.get_user_for_auth("test@mail.com", "password")).username == "test@mail.com"
+    assert hasher.verify("password", user_service.upgraded)
+    assert hasher.stats()["upgraded"] == 1
+
+
+def test_unknown_user_is_checked_against_the_dummy_hash(monkeypatch):
+    hasher = make_hasher()
+    monkeypatch.setattr("app.services.users.password_hasher", hasher)
+    assert not hasher.needs_upgrade(hasher.dummy_hash) and not hasher.verify("password", hasher.dummy_hash)
+    completed = hasher.stats()["completed"]
+    user_service = UserService(Mock())
+    user_service.repository = Mock()
+    user_service.repository.get_by_username.return_value = None
+    with pytest.raises(HTTPException) as error:
+        user_service.get_user_for_auth("nobody@mail.com", "password")
+    assert error.value.status_code == 403
+
+    async_service = AsyncUserService(Mock())
+    async_service.repository = Mock()
+
+    async def get_by_username(username):
+        return None
+
+    async_service.repository.get_by_username = get_by_username
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(async_service.get_user_for_auth("nobody@mail.com", "password"))
+    assert error.value.status_code == 403
+    assert hasher.stats()["completed"] == completed + 2
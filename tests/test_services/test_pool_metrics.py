@@ -0,0 +1,47 @@
+import unittest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.depenedencies.pool_metrics import PoolMetrics, MeteredQueuePool, WAIT_BUCKETS_MS
+
+
+class TestPoolMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = PoolMetrics()
+        pool_class = type("TestPool", (MeteredQueuePool,), {"metrics": self.metrics})
+        self.engine = create_engine("sqlite://", poolclass=pool_class, pool_size=1, max_overflow=0, pool_timeout=0.05)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_checkout_counts_and_pool_state(self):
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            stats = self.metrics.snapshot()
+            self.assertEqual(stats["checked_out"], 1)
+            self.assertEqual(stats["size"], 1)
+        stats = self.metrics.snapshot()
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertEqual(sum(stats["wait_histogram"].values()), 1)
+
+    def test_checkout_timeout(self):
+        with self.engine.connect():
+            with self.assertRaises(PoolTimeoutError):
+                self.engine.connect()
+        self.assertEqual(self.metrics.snapshot()["checkout_timeouts"], 1)
+
+    def test_wait_histogram_buckets(self):
+        self.metrics.record_wait(0.0005)
+        self.metrics.record_wait(0.2)
+        self.metrics.record_wait(60)
+        histogram = self.metrics.snapshot()["wait_histogram"]
+        self.assertEqual(histogram[f"le_{WAIT_BUCKETS_MS[0]}ms"], 1)
+        self.assertEqual(histogram["le_250ms"], 1)
+        self.assertEqual(histogram["le_inf"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.services import users as users_module
+from app.services.cache import LRUCache
+from app.services.users import AsyncUserService, invalidate_principal
+from app.schemas.user import RolesEnum
+from app.models.users import UserDB
+
+
+def make_user_db(**fields):
+    values = dict(username="test@mail.com", password="hash", role=RolesEnum.USER,
+                  confirmed=True, otp="111234", image="", token_version=0)
+    values.update(fields)
+    return UserDB(**values)
+
+
+def make_service(cache, user_db):
+    service = AsyncUserService(Mock(), cache=cache)
+    service.repository = Mock()
+    service.repository.get_by_username = AsyncMock(return_value=user_db)
+    return service
+
+
+def test_get_principal_served_from_cache():
+    service = make_service(LRUCache(), make_user_db())
+    first = asyncio.run(service.get_principal("test@mail.com"))
+    second = asyncio.run(service.get_principal("test@mail.com"))
+    assert first == second and first.role == RolesEnum.USER
+    service.repository.get_by_username.assert_awaited_once()
+
+
+def test_get_principal_returns_copy():
+    cache = LRUCache()
+    service = make_service(cache, make_user_db())
+    user = asyncio.run(service.get_principal("test@mail.com"))
+    user.role = RolesEnum.ADMIN
+    assert cache.get("test@mail.com").role == RolesEnum.USER
+
+
+def test_get_principal_without_cache_refreshes_it():
+    cache = LRUCache()
+    service = make_service(cache, make_user_db())
+    asyncio.run(service.get_principal("test@mail.com"))
+    service.repository.get_by_username.return_value = make_user_db(role=RolesEnum.MANAGER)
+    user = asyncio.run(service.get_principal("test@mail.com", use_cache=False))
+    assert user.role == RolesEnum.MANAGER
+    assert asyncio.run(service.get_principal("test@mail.com")).role == RolesEnum.MANAGER
+    assert service.repository.get_by_username.await_count == 2
+
+
+def test_invalidate_principal():
+    cache = LRUCache()
+    service = make_service(cache, make_user_db())
+    with patch.object(users_module, "principal_cache", cache):
+        asyncio.run(service.get_principal("test@mail.com"))
+        invalidate_principal("test@mail.com")
+        asyncio.run(service.get_principal("test@mail.com"))
+    assert service.repository.get_by_username.await_count == 2
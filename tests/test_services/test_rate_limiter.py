@@ -0,0 +1,66 @@
+import threading
+from unittest.mock import patch
+
+from app.depenedencies import rate_limiter as rate_limiter_module
+from app.depenedencies.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_steady_rate():
+    clock = FakeClock()
+    with patch.object(rate_limiter_module.time, "monotonic", clock):
+        limiter = RateLimiter(3, 120)
+        assert [limiter.is_allowed("1.1.1.1") for _ in range(4)] == [True, True, True, False]
+        assert limiter.is_allowed("2.2.2.2")
+        clock.now += 40
+        assert limiter.is_allowed("1.1.1.1")
+        assert not limiter.is_allowed("1.1.1.1")
+        clock.now += 1000
+        assert [limiter.is_allowed("1.1.1.1") for _ in range(4)] == [True, True, True, False]
+
+
+def test_cost():
+    limiter = RateLimiter(3, 120)
+    assert limiter.is_allowed("1.1.1.1", cost=2)
+    assert not limiter.is_allowed("1.1.1.1", cost=2)
+    assert limiter.is_allowed("1.1.1.1")
+
+
+def test_tracked_clients_are_bounded():
+    limiter = RateLimiter(3, 120, max_clients=64, shards=4)
+    for i in range(10000):
+        limiter.is_allowed(f"client-{i}")
+    stats = limiter.stats()
+    assert stats["clients"] <= 64 and stats["evictions"] >= 10000 - 64
+
+
+def test_idle_clients_are_evicted():
+    clock = FakeClock()
+    with patch.object(rate_limiter_module.time, "monotonic", clock):
+        limiter = RateLimiter(3, 120, shards=1)
+        limiter.is_allowed("1.1.1.1")
+        clock.now += 121
+        limiter.is_allowed("2.2.2.2")
+    assert limiter.stats()["clients"] == 1
+
+
+def test_concurrent_checks_never_exceed_the_limit():
+    limiter = RateLimiter(100, 3600)
+    allowed = []
+
+    def worker():
+        allowed.extend(limiter.is_allowed("1.1.1.1") for _ in range(100))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(allowed) == 100
@@ -0,0 +1,61 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.depenedencies import rate_limiter as rate_limiter_module
+from app.depenedencies.rate_limiter import RateLimit, RateLimiter, RedisRateLimiter
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+class UnreachableRedis:
+    def register_script(self, script):
+        def run(keys, args):
+            raise ConnectionError("Redis is down")
+        return run
+
+
+def test_workers_share_the_limit():
+    server = fakeredis.FakeServer()
+    first = RedisRateLimiter(fakeredis.FakeRedis(server=server), 3, 120)
+    second = RedisRateLimiter(fakeredis.FakeRedis(server=server), 3, 120)
+    assert [first.is_allowed("1.1.1.1"), second.is_allowed("1.1.1.1"), first.is_allowed("1.1.1.1")] == [True] * 3
+    assert not second.is_allowed("1.1.1.1")
+    assert first.is_allowed("2.2.2.2")
+    assert second.stats()["rejected"] == 1
+
+
+def test_cost_and_expiry():
+    client = fakeredis.FakeRedis()
+    limiter = RedisRateLimiter(client, 3, 120)
+    assert limiter.is_allowed("1.1.1.1", cost=3)
+    assert not limiter.is_allowed("1.1.1.1")
+    assert 0 < client.ttl("rate:1.1.1.1") <= 121
+
+
+def test_falls_back_to_local_limiter():
+    limiter = RedisRateLimiter(UnreachableRedis(), 2, 120, errors=(ConnectionError,))
+    assert [limiter.is_allowed("1.1.1.1") for _ in range(3)] == [True, True, False]
+    stats = limiter.stats()
+    assert stats["fallbacks"] == 3 and stats["redis_down"]
+
+
+def test_route_limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter_module, "_limiters", {})
+    app = FastAPI()
+
+    @app.get("/cheap", dependencies=[Depends(RateLimit(3, 120))])
+    def cheap():
+        return {}
+
+    @app.get("/expensive", dependencies=[Depends(RateLimit(3, 120, cost=2))])
+    def expensive():
+        return {}
+
+    client = TestClient(app)
+    assert [client.get("/expensive").status_code for _ in range(2)] == [200, 429]
+    response = client.get("/expensive")
+    assert response.headers["retry-after"] == "80"
+    assert [client.get("/cheap").status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert isinstance(rate_limiter_module._limiters[(3, 120)], RateLimiter)
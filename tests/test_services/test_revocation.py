@@ -0,0 +1,158 @@
+import asyncio
+import time
+import uuid
+from unittest.mock import Mock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.depenedencies import auth
+from app.depenedencies.auth import create_access_token, decode_jwt_token, revoke_access_token, get_authorized_principal
+from app.services import revocation
+from app.services.revocation import BloomFilter, MemoryRevocationStore, RedisRevocationStore, RevocationList
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def set(self, name, value, ex=None):
+        self.data[name] = value
+
+    def exists(self, name):
+        return int(name in self.data)
+
+    def scan_iter(self, match=None, count=None):
+        prefix = match.rstrip("*")
+        return [name.encode() for name in self.data if name.startswith(prefix)]
+
+
+class UnreachableError(Exception):
+    pass
+
+
+class UnreachableStore:
+    def add(self, jti, expires_at):
+        raise UnreachableError()
+
+    def contains(self, jti):
+        raise UnreachableError()
+
+    def all(self):
+        raise UnreachableError()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    added = [uuid.uuid4().hex for _ in range(1000)]
+    for jti in added:
+        bloom.add(jti)
+    assert all(jti in bloom for jti in added)
+    false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+    assert false_positives < 300
+
+
+def test_tokens_not_revoked_skip_the_store():
+    store = Mock(wraps=MemoryRevocationStore())
+    revoked = RevocationList(store, capacity=1000)
+    revoked.revoke("revoked", time.time() + 60)
+    assert revoked.is_revoked("revoked")
+    assert not revoked.is_revoked("live")
+    assert store.contains.call_count == revoked.stats()["store_lookups"] == 1
+
+
+def test_rebuild_picks_up_other_workers_and_drops_expired():
+    store = RedisRevocationStore(FakeRedis())
+    first, second = RevocationList(store, capacity=100), RevocationList(store, capacity=100)
+    first.revoke("jti", time.time() + 60)
+    assert store.contains("jti")
+    second.rebuild()
+    assert second.is_revoked("jti")
+
+    memory = MemoryRevocationStore()
+    revoked = RevocationList(memory, capacity=100)
+    revoked.revoke("old", time.time() - 1)
+    revoked.rebuild()
+    assert "old" not in revoked.filter and memory.all() == []
+
+
+def test_decode_refuses_revoked_token():
+    revoked = RevocationList(MemoryRevocationStore(), capacity=100)
+    with patch.object(auth, "revoked_tokens", revoked):
+        token = create_access_token("test@mail.com", "User", confirmed=True, version=0)
+        assert decode_jwt_token(token)["sub"] == "test@mail.com"
+        assert asyncio.run(revoke_access_token(token))
+        assert decode_jwt_token(token) == "The token has been revoked"
+        assert not asyncio.run(revoke_access_token(token))
+        assert not asyncio.run(revoke_access_token("not a token"))
+
+
+def test_async_check_refuses_revoked_token():
+    revoked = RevocationList(MemoryRevocationStore(), capacity=100)
+    with patch.object(auth, "revoked_tokens", revoked), patch.object(auth.settings, "auth_stateless_roles", True):
+        token = create_access_token("test@mail.com", "User", confirmed=True, version=0)
+        assert asyncio.run(get_authorized_principal(token, Mock())).username == "test@mail.com"
+        assert asyncio.run(revoke_access_token(token))
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(get_authorized_principal(token, Mock()))
+        assert error.value.status_code == 401
+
+
+def test_background_task_rebuilds_the_filter():
+    store = MemoryRevocationStore()
+    revoked = RevocationList(store, capacity=100, rebuild_interval=0.01)
+
+    async def run():
+        await revoked.start()
+        store.add("jti", time.time() + 60)
+        await asyncio.sleep(0.1)
+        await revoked.stop()
+
+    asyncio.run(run())
+    assert revoked.stats()["rebuilds"] > 1 and revoked.is_revoked("jti")
+
+
+@pytest.mark.parametrize("fail_closed", [True, False])
+def test_unreachable_store_follows_the_failure_policy(fail_closed):
+    revoked = RevocationList(MemoryRevocationStore(), capacity=100, errors=(UnreachableError,), fail_closed=fail_closed)
+    revoked.revoke("jti", time.time() + 60)
+    revoked.store = UnreachableStore()
+
+    assert revoked.is_revoked("jti") is fail_closed
+    assert asyncio.run(revoked.ais_revoked("jti")) is fail_closed
+    assert not revoked.is_revoked("live")
+    with pytest.raises(HTTPException) as error:
+        revoked.revoke("other", time.time() + 60)
+    assert error.value.status_code == 503
+
+    async def refresh_once():
+        await revoked.start()
+        while revoked.stats()["store_errors"] < 4:
+            await asyncio.sleep(0.01)
+        await revoked.stop()
+
+    asyncio.run(refresh_once())
+    assert "jti" in revoked.filter and revoked.stats()["rebuilds"] == 0
+
+
+def test_memory_store_is_refused_with_several_workers():
+    with patch.dict(revocation.os.environ, {"WEB_CONCURRENCY": "4"}):
+        with pytest.raises(RuntimeError):
+            revocation.create_revocation_list()
+    with patch.dict(revocation.os.environ, {"WEB_CONCURRENCY": "1"}):
+        assert isinstance(revocation.create_revocation_list().store, MemoryRevocationStore)
+
+
+def test_revoke_during_a_rebuild_is_kept():
+    store = MemoryRevocationStore()
+    revoked = RevocationList(store, capacity=100)
+    add = store.add
+
+    def rebuild_then_add(jti, expires_at):
+        # a whole rebuild runs while the revocation is on its way to the store
+        revoked.rebuild()
+        add(jti, expires_at)
+
+    with patch.object(store, "add", side_effect=rebuild_then_add):
+        revoked.revoke("late", time.time() + 60)
+    assert revoked.is_revoked("late")
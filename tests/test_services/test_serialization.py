@@ -0,0 +1,42 @@
+import json
+from datetime import date, datetime
+
+import pytest
+
+from app.api.responses import NegotiatedResponse, FastJSONResponse, MsgPackResponse
+from app.schemas.todo import Todo
+from app.services.serialization import prefers_msgpack, dumps_json
+
+msgpack = pytest.importorskip("msgpack")
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, False),
+    ("*/*", False),
+    ("application/json", False),
+    ("application/msgpack", True),
+    ("application/x-msgpack, application/json;q=0.5", True),
+    ("application/msgpack;q=0.5, application/json", False),
+    ("application/msgpack;q=0", False),
+    ("text/html, application/msgpack", True),
+])
+def test_prefers_msgpack(accept, expected):
+    assert prefers_msgpack(accept) is expected
+
+
+def test_negotiated_response_same_content_in_both_formats():
+    todo = Todo(id=1, name="a", surname="b", email="c@d.e", phone=1, birthday=date(1990, 1, 2), is_done=False,
+                description="lorem", updated_at=datetime(2024, 5, 6, 7, 8, 9, 123456))
+    json_response = NegotiatedResponse(accept="application/json")(todo, headers={"ETag": '"x"'})
+    msgpack_response = NegotiatedResponse(accept="application/msgpack")(todo)
+
+    assert isinstance(json_response, FastJSONResponse)
+    assert isinstance(msgpack_response, MsgPackResponse)
+    assert msgpack_response.headers["content-type"] == "application/msgpack"
+    assert json_response.headers["vary"] == "Accept"
+    assert json_response.headers["etag"] == '"x"'
+    assert msgpack.unpackb(msgpack_response.body) == json.loads(json_response.body) == json.loads(todo.json())
+
+
+def test_dumps_json_dates():
+    assert json.loads(dumps_json({"d": date(2020, 2, 29)})) == {"d": "2020-02-29"}
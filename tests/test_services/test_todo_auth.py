@@ -0,0 +1,40 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.todo_items import router
+from app.depenedencies import auth
+from app.depenedencies.auth import create_access_token
+from app.depenedencies.database import get_db, get_async_db
+from app.schemas.user import RolesEnum
+from app.services.cache import LRUCache
+
+ROUTES = [("put", "/todo/1", {"json": {"name": "n"}}), ("delete", "/todo/?id=1", {})]
+
+
+def fake_db():
+    return Mock()
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router, prefix="/todo")
+    app.dependency_overrides[get_db] = fake_db
+    app.dependency_overrides[get_async_db] = fake_db
+    with patch.object(auth.settings, "auth_stateless_roles", True), patch.object(auth, "token_versions", LRUCache()):
+        yield TestClient(app)
+
+
+@pytest.mark.parametrize("method, url, body", ROUTES)
+def test_anonymous_callers_are_refused(client, method, url, body):
+    assert client.request(method, url, **body).status_code == 401
+
+
+@pytest.mark.parametrize("method, url, body", ROUTES)
+def test_users_are_refused(client, method, url, body):
+    token = create_access_token("test@mail.com", RolesEnum.USER, confirmed=True, version=0)
+    response = client.request(method, url, headers={"Authorization": f"Bearer {token}"}, **body)
+    assert response.status_code == 403
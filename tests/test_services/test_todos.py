@@ -1,9 +1,18 @@
+import asyncio
+import io
+import json
 import pytest
-from unittest.mock import patch
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from unittest.mock import ANY, patch, Mock, AsyncMock
 
-from app.services.todos import TodoService
-from app.schemas.todo import Todo, TodoCreate
+from fastapi import HTTPException
+
+from app.services.todos import TodoService, AsyncTodoService, EXPORT_COLUMNS, TODO_FIELDS, LIST_FIELDS
+from app.services.etag import make_etag, etag_matches
+from app.schemas.todo import Todo, TodoCreate, TodoUpdate, TodoBulkUpdate, TodoFilter, TodoSort, ExportFormat
 from app.models.todo import TodoDB
+from app.api.responses import FastJSONResponse, NegotiatedResponse
 
 @pytest.fixture
 def sample_todos_from_db():
@@ -16,8 +25,292 @@ def test_create_success(test_db):
     assert test_item.name == "test"
     assert test_item.is_done == False
 
-def test_get_all_todos(test_db, sample_todos_from_db):
-    with patch('app.repository.todos.TodoRepo') as mock:
-        mock.return_value.get_all.return_value = sample_todos_from_db
-        service = TodoService(test_db)
-        assert service.get_all_todos() == sample_todos_from_db
+@pytest.fixture
+def full_todos_from_db():
+    return [
+        TodoDB(id=i, name=f"Test Todo {i}", surname="Doe", email=f"todo{i}@mail.com", phone=12345,
+               birthday=date(1990, 1, i), is_done=False, description="13212321")
+        for i in range(1, 4)
+    ]
+
+def test_get_all_todos(full_todos_from_db):
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_all", return_value=full_todos_from_db) as mock_get_all:
+        page = service.get_all_todos()
+        assert [item.id for item in page.items] == [1, 2, 3]
+        assert page.next_cursor is None
+        mock_get_all.assert_called_once_with(todo_filter=None, sort=TodoSort.ID, after=None, limit=51)
+
+def test_get_all_todos_next_cursor(full_todos_from_db):
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_all", return_value=full_todos_from_db) as mock_get_all:
+        page = service.get_all_todos(limit=2)
+        assert [item.id for item in page.items] == [1, 2]
+        assert page.next_cursor
+
+        service.get_all_todos(after=page.next_cursor, limit=2)
+        mock_get_all.assert_called_with(todo_filter=None, sort=TodoSort.ID, after=(2,), limit=3)
+
+def test_get_page_rows_matches_get_all_todos(full_todos_from_db):
+    columns = ["id", "name", "surname", "email", "phone", "birthday", "is_done", "description", "updated_at"]
+    TodoRow = namedtuple("TodoRow", columns)
+    rows = [TodoRow(*[getattr(item, column) for column in columns]) for item in full_todos_from_db]
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_all_rows", return_value=rows), \
+            patch.object(service.repository, "get_all", return_value=full_todos_from_db):
+        fast_page = service.get_page_rows(limit=2, sort=TodoSort.BIRTHDAY)
+        page = service.get_all_todos(limit=2, sort=TodoSort.BIRTHDAY)
+    assert fast_page["next_cursor"] == page.next_cursor
+    assert json.loads(FastJSONResponse(fast_page).body) == json.loads(page.json())
+
+def test_get_page_rows_narrowed_fields(full_todos_from_db):
+    TodoRow = namedtuple("TodoRow", ["id", "name", "birthday"])
+    rows = [TodoRow(item.id, item.name, item.birthday) for item in full_todos_from_db]
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_all_rows", return_value=rows) as mock_get_all_rows:
+        page = service.get_page_rows(limit=2, sort=TodoSort.BIRTHDAY, fields=("id", "name"))
+    # the sort column is read for the cursor but not returned
+    mock_get_all_rows.assert_called_once_with(todo_filter=None, sort=TodoSort.BIRTHDAY, after=None, limit=3,
+                                              columns=("id", "name", "birthday"))
+    assert page["items"] == [{"id": 1, "name": "Test Todo 1"}, {"id": 2, "name": "Test Todo 2"}]
+    assert service._decode_position(page["next_cursor"], TodoSort.BIRTHDAY) == (date(1990, 1, 2), 2)
+
+@pytest.mark.parametrize("fields, expected", [
+    (None, LIST_FIELDS),
+    ("", LIST_FIELDS),
+    ("name,is_done", ("id", "name", "is_done")),
+    (" is_done , id,name,name", ("id", "name", "is_done")),
+    ("description", ("id", "description")),
+])
+def test_parse_fields(fields, expected):
+    assert TodoService.parse_fields(fields, default=LIST_FIELDS) == expected
+
+def test_parse_fields_unknown():
+    with pytest.raises(HTTPException) as exc_info:
+        TodoService.parse_fields("name,password,birthday_key")
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Unknown fields: birthday_key, password"
+
+def test_list_defaults_leave_out_description():
+    assert "description" not in LIST_FIELDS
+    assert set(TODO_FIELDS) - set(LIST_FIELDS) == {"description"}
+
+def test_get_all_todos_invalid_cursor():
+    service = TodoService(Mock())
+    with pytest.raises(HTTPException) as exc_info:
+        service.get_all_todos(after="not-a-cursor")
+    assert exc_info.value.status_code == 400
+
+def test_get_all_todos_sorted_by_birthday(full_todos_from_db):
+    service = TodoService(Mock())
+    todo_filter = TodoFilter(is_done=False)
+    with patch.object(service.repository, "get_all", return_value=full_todos_from_db) as mock_get_all:
+        page = service.get_all_todos(limit=2, todo_filter=todo_filter, sort=TodoSort.BIRTHDAY_DESC)
+        service.get_all_todos(after=page.next_cursor, limit=2, todo_filter=todo_filter, sort=TodoSort.BIRTHDAY_DESC)
+        mock_get_all.assert_called_with(todo_filter=todo_filter, sort=TodoSort.BIRTHDAY_DESC,
+                                        after=(date(1990, 1, 2), 2), limit=3)
+
+def test_get_all_todos_cursor_of_other_sort(full_todos_from_db):
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_all", return_value=full_todos_from_db):
+        page = service.get_all_todos(limit=2, sort=TodoSort.EMAIL)
+        with pytest.raises(HTTPException) as exc_info:
+            service.get_all_todos(after=page.next_cursor, sort=TodoSort.ID)
+        assert exc_info.value.status_code == 400
+
+def test_export_ndjson():
+    service = TodoService(Mock())
+    chunk = [{"id": 1, "name": "a", "surname": "b", "email": "c", "phone": 1,
+              "birthday": date(1990, 1, 1), "is_done": False, "description": None}]
+    with patch.object(service.repository, "iter_chunks", return_value=iter([chunk, chunk])) as mock_iter:
+        lines = "".join(service.export(ExportFormat.NDJSON, since_id=7)).splitlines()
+        assert len(lines) == 2
+        assert '"birthday": "1990-01-01"' in lines[0]
+        mock_iter.assert_called_once_with(since_id=7, chunk_size=1000, columns=EXPORT_COLUMNS)
+
+def test_export_csv_empty():
+    service = TodoService(Mock())
+    with patch.object(service.repository, "iter_chunks", return_value=iter([])):
+        assert "".join(service.export(ExportFormat.CSV)).strip() == "id,name,surname,email,phone,birthday,is_done,description"
+
+def test_export_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    service = TodoService(Mock())
+    chunk = [{"id": 1, "name": "a", "surname": "b", "email": "c", "phone": 1,
+              "birthday": date(1990, 1, 1), "is_done": False, "description": None}]
+    with patch.object(service.repository, "iter_chunks", return_value=iter([chunk, chunk])):
+        records = list(msgpack.Unpacker(io.BytesIO(b"".join(service.export(ExportFormat.MSGPACK)))))
+    assert len(records) == 2
+    assert records[0]["birthday"] == "1990-01-01"
+
+def test_create_many_reports_invalid_items():
+    service = TodoService(Mock())
+    valid = {"id": 1, "name": "a", "surname": "b", "email": "c", "phone": 1, "birthday": "1990-01-01", "description": None}
+    with patch.object(service.repository, "create_many", return_value=[1]) as mock_create_many:
+        result = service.create_many([valid, {"id": 2, "name": "no birthday"}, dict(valid)])
+        assert result.created_ids == [1]
+        assert [error.index for error in result.errors] == [1, 2]
+        created = mock_create_many.call_args.args[0]
+        assert [item.id for item in created] == [1]
+
+def test_create_many_reports_existing_ids():
+    service = TodoService(Mock())
+    item = {"name": "a", "surname": "b", "email": "c", "phone": 1, "birthday": "1990-01-01", "description": None}
+    with patch.object(service.repository, "create_many", return_value=[1, 3]):
+        result = service.create_many([dict(item, id=1), dict(item, id=2), {"id": 9}, dict(item, id=3)])
+    assert result.created_ids == [1, 3]
+    assert [(error.index, error.errors[0]["msg"]) for error in result.errors][0] == (1, "Todo item already exists")
+    assert [error.index for error in result.errors] == [1, 2]
+
+def test_update_sends_only_provided_fields():
+    service = TodoService(Mock())
+    row = {"id": 1, "name": "a", "surname": "b", "email": "c", "phone": 1,
+           "birthday": date(1990, 1, 1), "is_done": True, "description": "d"}
+    with patch.object(service.repository, "update", return_value=row) as mock_update:
+        updated = service.update(1, TodoUpdate(is_done=True))
+        mock_update.assert_called_once_with(1, {"is_done": True}, notify=ANY)
+        assert updated.is_done
+
+def test_update_not_found():
+    service = TodoService(Mock())
+    with patch.object(service.repository, "update", return_value=None):
+        with pytest.raises(HTTPException) as exc_info:
+            service.update(1, TodoUpdate(name="new"))
+        assert exc_info.value.status_code == 404
+
+def test_update_many():
+    service = TodoService(Mock())
+    with patch.object(service.repository, "update_many", return_value=[1, 3]) as mock_update_many:
+        result = service.update_many(TodoBulkUpdate(ids=[1, 2, 3], patch=TodoUpdate(is_done=True)))
+        mock_update_many.assert_called_once_with([1, 2, 3], {"is_done": True}, notify=ANY)
+        assert result.updated_ids == [1, 3]
+
+@pytest.mark.parametrize("today, days, expected", [
+    (date(2023, 6, 1), 7, [(601, 608)]),
+    (date(2023, 12, 28), 7, [(1228, 1231), (101, 104)]),
+    (date(2023, 2, 20), 8, [(220, 229)]),
+    (date(2024, 2, 20), 8, [(220, 228)]),
+    (date(2023, 3, 1), 0, [(301, 301)]),
+    (date(2023, 3, 1), 366, [(301, 1231), (101, 300)]),
+])
+def test_birthday_key_ranges(today, days, expected):
+    assert TodoService.birthday_key_ranges(today, days) == expected
+
+def test_search_pages_by_rank(full_todos_from_db):
+    service = TodoService(Mock())
+    found = [(item, 1.5) for item in full_todos_from_db]
+    with patch.object(service.repository, "search", return_value=found) as mock_search:
+        page = service.search("milk", limit=2)
+        assert [item["id"] for item in page["items"]] == [1, 2]
+        service.search("milk", after=page["next_cursor"], limit=2)
+        mock_search.assert_called_with("milk", after=(1.5, 2), limit=3, columns=TODO_FIELDS)
+
+def test_search_narrowed_fields(full_todos_from_db):
+    service = TodoService(Mock())
+    found = [(item, 1.5) for item in full_todos_from_db]
+    with patch.object(service.repository, "search", return_value=found) as mock_search:
+        page = service.search("milk", fields=("id", "name"))
+        assert page["items"][0] == {"id": 1, "name": "Test Todo 1"}
+        mock_search.assert_called_once_with("milk", after=None, limit=51, columns=("id", "name"))
+
+def test_search_blank_query():
+    service = TodoService(Mock())
+    assert service.search("   ")["items"] == []
+
+def test_list_etag_changes_with_page_versions():
+    service = TodoService(Mock())
+    versions = [(1, datetime(2024, 1, 1)), (2, datetime(2024, 1, 2))]
+    with patch.object(service.repository, "get_page_versions", return_value=versions):
+        etag = service.get_list_etag(limit=10)
+        assert etag == service.get_list_etag(limit=10)
+        assert etag != service.get_list_etag(limit=10, sort=TodoSort.ID_DESC)
+    with patch.object(service.repository, "get_page_versions", return_value=versions[:1]):
+        assert etag != service.get_list_etag(limit=10)
+
+def test_etags_differ_between_json_and_msgpack():
+    json_media_type = NegotiatedResponse("application/json").media_type
+    msgpack_media_type = NegotiatedResponse("application/msgpack").media_type
+    assert json_media_type != msgpack_media_type
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_page_versions", return_value=[(1, datetime(2024, 1, 1))]):
+        assert service.get_list_etag(limit=10, media_type=json_media_type) != service.get_list_etag(limit=10, media_type=msgpack_media_type)
+    todo_item = Todo(id=1, name="a", surname="b", email="c", phone=1, birthday=date(1990, 1, 1),
+                     is_done=False, description="d", updated_at=datetime(2024, 1, 1))
+    assert TodoService.get_etag(todo_item, media_type=json_media_type) != TodoService.get_etag(todo_item, media_type=msgpack_media_type)
+
+def test_get_changes_pages_and_tokens():
+    columns = ["id", "name", "surname", "email", "phone", "birthday", "is_done", "description", "updated_at", "deleted_at"]
+    ChangeRow = namedtuple("ChangeRow", columns)
+    rows = [ChangeRow(1, "a", "s", "e", 1, date(1990, 1, 1), False, "d", datetime(2024, 1, 1, 10), None),
+            ChangeRow(2, "b", "s", "e", 2, date(1990, 1, 2), False, "d", datetime(2024, 1, 1, 11), datetime(2024, 1, 1, 11)),
+            ChangeRow(3, "c", "s", "e", 3, date(1990, 1, 3), False, "d", datetime(2024, 1, 1, 12), None)]
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_changes", return_value=rows) as mock_get_changes:
+        changes = service.get_changes(limit=2)
+        assert [item["id"] for item in changes["changed"]] == [1]
+        assert changes["deleted"] == [2]
+        assert changes["has_more"] is True
+        assert mock_get_changes.call_args.kwargs["include_deleted"] is False
+
+        service.get_changes(since=changes["next_token"], limit=2)
+        after, until, limit = mock_get_changes.call_args.args
+        assert after == (datetime(2024, 1, 1, 11), 2)
+        assert limit == 3
+        assert mock_get_changes.call_args.kwargs["include_deleted"] is True
+
+    with patch.object(service.repository, "get_changes", return_value=[]):
+        next_token = service.get_changes(since=changes["next_token"])["next_token"]
+        assert service._decode_sync_token(next_token)[0] == service._decode_sync_token(changes["next_token"])[0]
+
+def test_get_changes_invalid_token():
+    service = TodoService(Mock())
+    cursor = TodoService._encode_position(Mock(id=1), TodoSort.ID)
+    with pytest.raises(HTTPException) as exc_info:
+        service.get_changes(since=cursor)
+    assert exc_info.value.status_code == 400
+
+def test_etag_matches():
+    etag = make_etag(1, datetime(2024, 1, 1))
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+def test_async_get_all_todos(full_todos_from_db):
+    service = AsyncTodoService(Mock())
+    with patch.object(service.repository, "get_all", AsyncMock(return_value=full_todos_from_db)) as mock_get_all:
+        page = asyncio.run(service.get_all_todos(limit=2))
+        assert [item.id for item in page.items] == [1, 2]
+        mock_get_all.assert_awaited_once_with(todo_filter=None, sort=TodoSort.ID, after=None, limit=3)
+
+
+def test_create_new_refuses_the_id_of_a_live_todo():
+    service = TodoService(Mock(), cache=Mock(), events=Mock())
+    item = TodoCreate(id=1, name="n", surname="s", email="e@x.com", phone=1, birthday=date(1990, 1, 1), description=None)
+    with patch.object(service.repository, "create", return_value=None):
+        with pytest.raises(HTTPException) as error:
+            service.create_new(item)
+    assert error.value.status_code == 409
+    service.events.publish.assert_not_called()
+
+
+def test_sync_token_older_than_the_tombstone_retention_is_refused():
+    service = TodoService(Mock())
+    with patch.object(service.repository, "get_changes", return_value=[]):
+        token = service._encode_sync_token(datetime(2020, 1, 1), 1, datetime.utcnow() - timedelta(days=1))
+        refreshed = service.get_changes(token)["next_token"]
+        assert service._decode_sync_token(refreshed)[0] == (datetime(2020, 1, 1), 1)
+        expired = service._encode_sync_token(datetime(2020, 1, 1), 1, datetime(2020, 1, 1))
+        with pytest.raises(HTTPException) as error:
+            service.get_changes(expired)
+    assert error.value.status_code == 410
+
+
+def test_sync_settle_window_is_configurable():
+    service = TodoService(Mock())
+    with patch("app.services.todos.settings.sync_settle_seconds", 60), \
+            patch.object(service.repository, "get_changes", return_value=[]) as mock_get_changes:
+        service.get_changes()
+    _, until, _ = mock_get_changes.call_args.args
+    assert timedelta(seconds=59) < datetime.utcnow() - until < timedelta(seconds=61)
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.depenedencies.database import Base
+from app.models.todo import TodoDB
+from app.services.tombstones import TombstonePurger
+
+
+@pytest.fixture
+def database():
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine), f"sqlite+aiosqlite:///{path}"
+    engine.dispose()
+    os.remove(path)
+
+
+def test_purge_deletes_old_tombstones_only(database):
+    Session, url = database
+    now = datetime.utcnow()
+    with Session() as db:
+        db.add_all([
+            TodoDB(id=1, name="live", birthday=date(1990, 1, 1), updated_at=now - timedelta(days=60)),
+            TodoDB(id=2, name="old", updated_at=now - timedelta(days=40), deleted_at=now - timedelta(days=40)),
+            TodoDB(id=3, name="old", updated_at=now - timedelta(days=35), deleted_at=now - timedelta(days=35)),
+            TodoDB(id=4, name="recent", updated_at=now - timedelta(days=1), deleted_at=now - timedelta(days=1)),
+        ])
+        db.commit()
+
+    async def main():
+        engine = create_async_engine(url)
+        try:
+            purger = TombstonePurger(timedelta(days=30), batch_size=1)
+            await purger.start(async_sessionmaker(engine, expire_on_commit=False))
+            while purger.runs == 0:
+                await asyncio.sleep(0.01)
+            await purger.stop()
+            return purger.stats()
+        finally:
+            await engine.dispose()
+
+    stats = asyncio.run(main())
+    assert stats["purged"] == 2 and stats["last_error"] is None
+    with Session() as db:
+        assert sorted(db.scalars(select(TodoDB.id))) == [1, 4]
@@ -1,4 +1,7 @@
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+
+import pytest
+from fastapi import HTTPException
 
 import app.repository.user
 from app.services.users import UserService
@@ -20,4 +23,17 @@ def test_create_success(default_user, test_db):
         result = user_service.create_new(default_user)
         assert result.confirmed == False
         assert result.otp
-        assert result.otp != default_user.otp
\ No newline at end of file
+        assert result.otp != default_user.otp
+
+
+def test_concurrent_signup_is_a_conflict():
+    user_service = UserService(Mock())
+    user_service.repository = Mock()
+    user_service.repository.get_by_username.return_value = None
+    user_service.repository.create.return_value = None
+    user = User(username="test@mail.com", password="123pass", role=RolesEnum.USER, confirmed=None, otp=None, image="")
+    with patch("app.services.users.password_hasher") as hasher:
+        hasher.hash.return_value = "hash"
+        with pytest.raises(HTTPException) as error:
+            user_service.create_new(user)
+    assert error.value.status_code == 409
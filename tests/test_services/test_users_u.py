@@ -32,13 +32,14 @@ class TestUserService(unittest.TestCase):
             self.assertFalse(updated_user.confirmed)
 
     def test_get_user_for_auth_success(self):
-        user = User(username="testuser", password="password")
-        with patch.object(self.user_service.repository, "get_user_and_check_pass", return_value=user):
-            authenticated_user = self.user_service.get_user_for_auth(username=user.username, password=user.password)
+        user = User(username="testuser", password="scrypt$hash")
+        with patch.object(self.user_service.repository, "get_by_username", return_value=user), \
+                patch("app.services.users.password_hasher.verify", return_value=True):
+            authenticated_user = self.user_service.get_user_for_auth(username=user.username, password="password")
             self.assertEqual(authenticated_user, user)
 
     def test_get_user_for_auth_failure(self):
-        with patch.object(self.user_service.repository, "get_user_and_check_pass", return_value=None):
+        with patch.object(self.user_service.repository, "get_by_username", return_value=None):
             with self.assertRaises(HTTPException) as context:
                 self.user_service.get_user_for_auth(username="nonexistentuser", password="wrongpassword")
             self.assertEqual(context.exception.status_code, 403)